@@ -32,6 +32,8 @@ import time
 import subprocess
 import shelve
 import socket
+import sqlite3
+import argparse
 import win32com.client
 import win32api
 import win32gui
@@ -41,9 +43,19 @@ from pysnmp.entity.rfc3413 import context
 from pysnmp.entity.rfc3413.oneliner import ntforg
 from pysnmp.proto import rfc1902
 from pysnmp.error import PySnmpError
-from pyasn1.type import univ
 from PySide import QtCore, QtGui
 from misnertraptoolui import Ui_MainWindow
+from notification import OID_TYPES, SPECIFIC_TRAP_TYPE, USM_AUTH_PROTOCOLS, USM_PRIV_PROTOCOLS
+from notification import Notification, Varbind, error_indication, snmptrap_varbinds, timer
+import trapapi
+import trapexport
+import trapfleet
+import traphistory
+import trapmetrics
+import trapmib
+import trapprofile
+import trapreceiver
+import traptcp
 
 # Debug PySNMP issues
 #from pysnmp import debug
@@ -62,21 +74,11 @@ DEFAULT_SOURCE_OID = '1.3.6.1.4.1.3.1.1'
 CREATE_NO_WINDOW = 0x8000000  # Flag which suppresses console window output
 COMBO_HISTORY = 10
 CONFIG_FILE = 'misnertraptool.cfg'
-
-SPECIFIC_TRAP_TYPE = '1'
-OID_TYPES = {
-    0: ["Integer", 'i'],
-    1: ["Unsigned", 'u'],
-    2: ["Counter32", 'c'],
-    3: ["String", 's'],
-   #4: ["Hex String", 'x'],
-   #5: ["Decimal String", 'd'],
-    4: ["Null Object", 'n'],
-    5: ["OID", 'o'],
-    6: ["Time Ticks", 't'],
-    7: ["IP Address", 'a']
-  #10: ["Bits", 'b']
-}
+STATS_REFRESH = 1000  # Milliseconds between Stats tab refreshes
+OUTPUT_MAX_LINES = 10000  # Oldest Output tab lines are discarded beyond this
+FLEET_SIZE = 10000
+FLEET_PROGRESS_INTERVAL = 100
+TCP_SEND_TIMEOUT = 5  # Seconds to wait for a TCP connection to take a notification
 
 HELP_TEXT = """
 Graphically build and send SNMP notifications to a remote SNMP
@@ -84,7 +86,7 @@ manager, including Traps and InformRequests. Allows saving of traps
 for future use, as well as building snmptrap arguments for sending
 from a remote system. Supports SNMP versions 1, 2c, and 3.
 
-misnertraptool.exe [notification.ntf]
+misnertraptool.exe [--profile DIRECTORY] [notification.ntf]
 
 Features:
 - Notifications include SNMPv1/2c/3 Trap and SNMPv2/3 InformRequest
@@ -93,6 +95,42 @@ Features:
 - Forward built notification to a SecureCRT or PuTTY window to source
   the notification from a remote host using Net-SNMP snmptrap
 - Track notification activities in output log
+- Send from a simulated fleet of thousands of agents, each with its own
+  agent address, community string or SNMPv3 user, uptime and counter
+- Export notification files as a shell script or batch file of
+  thousands of snmptrap commands for running on remote hosts
+- Built-in loopback receiver reports end-to-end latency, loss,
+  reordering and payload mismatches of notifications sent to localhost
+- Stats tab shows per-stage send timings and counters, which can be
+  exported as a Prometheus text file or statsd UDP stream
+- Profile sends and batch runs with `--profile DIRECTORY` or the Tools
+  menu, showing the hottest functions in the Output tab
+- Send SNMPv1/2c notifications over TCP (RFC 3430) to a `tcp:host:port`
+  destination through pooled persistent connections
+- Local HTTP/JSON API server (Tools menu or `trapapi.py`) queues single
+  or batched notifications from other programs, sending them through a
+  pool of long-lived engines and reporting per-notification results
+- Stream notifications one JSON object per line from standard input, a
+  file or a named pipe with `trapstream.py`, holding back fast producers
+  with a bounded in-flight queue and printing periodic progress
+- Per-destination token bucket rate, burst and in-flight Inform limits
+  for API and stream sends, shared fairly between destinations and
+  slowing down automatically on Inform timeouts or unreachable managers
+- Send history recorded in an indexed SQLite database (`history.sqlite`)
+  by a background writer, browsable on the History tab or queried with
+  `traphistory.py`, e.g. all failed Informs to one host today
+- Soak test mode (`trapsoak.py`) sends continuously for hours or days,
+  sampling RSS, tracemalloc top allocators and latency drift, and fails
+  when memory growth or drift passes a threshold
+- Replay captured traps from tcpdump/Wireshark captures or snmptrapd
+  logs with `trapreplay.py` at original timing, sped up or as fast as
+  possible, rewriting destination and community, and reporting achieved
+  against original timing
+- Varbind data types are filled in from the bundled MIBs as OIDs are
+  entered, enumeration labels such as down(2) are accepted, and values
+  are checked against MIB ranges and sizes before sending, or in bulk
+  with `trapmib.py`; data types other than the MIB's are sent with a
+  warning
 - Input fields keep history of last ten sent values in drop-down box,
   as well as persistent values from when the application was last run
 
@@ -145,7 +183,7 @@ Click the "Show Details" button below for complete license information.
 
 class MainWindow(QtGui.QMainWindow):
     """Object class for the main window"""
-    def __init__(self):
+    def __init__(self, filename=None, profile_directory=None):
         """Executed when the MainWindow() object is created"""
         # GUI Setup
         QtGui.QMainWindow.__init__(self)
@@ -198,6 +236,9 @@ class MainWindow(QtGui.QMainWindow):
         # Assign default value to placeholder
         self.ui.editSpecificType.setPlaceholderText(SPECIFIC_TRAP_TYPE)
         
+        # Keep the Output tab from growing without bound during long runs
+        self.ui.editOutput.setMaximumBlockCount(OUTPUT_MAX_LINES)
+        
         # Qt Signals
         self.ui.comboNotificationType.activated.connect(self.comboNotificationType_activated)
         self.ui.comboGenericType.activated.connect(self.comboGenericType_activated)
@@ -207,6 +248,7 @@ class MainWindow(QtGui.QMainWindow):
         self.ui.buttonVarbindAdd.clicked.connect(self.buttonVarbindAdd_clicked)
         self.ui.buttonVarbindClearAll.clicked.connect(self.buttonVarbindClearAll_clicked)
         self.ui.buttonVarbindRemove.clicked.connect(self.buttonVarbindRemove_clicked)
+        self.ui.tableVarbinds.itemChanged.connect(self.tableVarbinds_itemChanged)
         
         self.ui.buttonClearAll.clicked.connect(self.buttonClearAll_clicked)
         self.ui.buttonSend.clicked.connect(self.buttonSend_clicked)
@@ -214,6 +256,48 @@ class MainWindow(QtGui.QMainWindow):
         self.ui.actionOpen.triggered.connect(self.actionOpen_triggered)
         self.ui.actionSaveAs.triggered.connect(self.actionSaveAs_triggered)
         self.ui.actionExit.triggered.connect(self.close)
+        self.ui.actionSendFleet.triggered.connect(self.actionSendFleet_triggered)
+        self.ui.actionExportScript.triggered.connect(self.actionExportScript_triggered)
+        self.ui.actionLoopbackReceiver.triggered.connect(self.actionLoopbackReceiver_triggered)
+        self.ui.actionLoopbackReport.triggered.connect(self.actionLoopbackReport_triggered)
+        self.ui.actionApiServer.triggered.connect(self.actionApiServer_triggered)
+        
+        # Loopback receiver is only running while enabled from the Tools menu
+        self.receiver = None
+        
+        # Persistent connections for tcp: destinations, opened on first use
+        self.tcp_pool = None
+        
+        # Local HTTP/JSON API server is only running while enabled from the Tools menu
+        self.api_server = None
+        
+        # Send pipeline metrics, shown on the Stats tab and optionally exported
+        self.metrics = trapmetrics.Metrics()
+        self.metrics_exporters = {}
+        self.ui.actionMetricsPrometheus.triggered.connect(self.actionMetricsPrometheus_triggered)
+        self.ui.actionMetricsStatsd.triggered.connect(self.actionMetricsStatsd_triggered)
+        self.ui.buttonStatsReset.clicked.connect(self.buttonStatsReset_clicked)
+        self.stats_timer = QtCore.QTimer(self)
+        self.stats_timer.timeout.connect(self.stats_refresh)
+        self.stats_timer.start(STATS_REFRESH)
+        
+        # Every send is recorded in the history database by a background writer
+        try:
+            self.history = traphistory.HistoryWriter(os.path.join(script_path, traphistory.HISTORY_FILE))
+            self.history.start()
+        except sqlite3.Error as e:
+            self.history = None
+            self.outputtab_msg('Unable to open send history database: %s' % e, timestamp=False)
+        self.ui.buttonHistoryRefresh.clicked.connect(self.history_refresh)
+        self.ui.editHistoryHost.returnPressed.connect(self.history_refresh)
+        self.ui.comboHistoryPdu.currentIndexChanged.connect(self.history_refresh)
+        self.ui.comboHistoryResult.currentIndexChanged.connect(self.history_refresh)
+        self.ui.checkHistoryToday.toggled.connect(self.history_refresh)
+        self.ui.tabWidget.currentChanged.connect(self.history_refresh)
+        
+        # Profile sends and batch runs when enabled from the command line or Tools menu
+        self.profiler = None
+        self.ui.actionProfile.triggered.connect(self.actionProfile_triggered)
         self.ui.actionHelp.triggered.connect(self.actionHelp_triggered)
         self.ui.actionAbout.triggered.connect(self.actionAbout_triggered)
         
@@ -241,6 +325,14 @@ class MainWindow(QtGui.QMainWindow):
         else:
             self.mibs_path = ''
         
+        # Varbind data types and values are looked up and checked against the MIBs' object definitions
+        self.mib_index = None
+        if self.mibs_path:
+            try:
+                self.mib_index = trapmib.MibIndex(self.mibs_path)
+            except EnvironmentError as e:
+                self.outputtab_msg('Unable to read MIBs for varbind checking: %s' % e, timestamp=False)
+        
         # Configure Win32 API shell
         if sys.platform == 'win32':
             self.shell = win32com.client.Dispatch("Wscript.Shell")
@@ -248,9 +340,11 @@ class MainWindow(QtGui.QMainWindow):
         # Load form values from previous session
         self.open_notification(from_config=True)
         
+        if profile_directory:
+            self.profile_start(profile_directory)
+        
         # Check if a notification file was passed as an argument and load it
-        if len(sys.argv) > 1:
-            filename             = sys.argv[1]
+        if filename:
             script_path_filename = os.path.join(script_path, filename)
             if filename[-4:] == '.ntf':
                 if os.path.exists(filename):
@@ -263,13 +357,23 @@ class MainWindow(QtGui.QMainWindow):
                     msg = "Unable to locate notification file from argument: %s" % os.path.normpath(filename)
                 self.outputtab_msg(msg, timestamp=False)
             else:
-                msg = "Invalid argument: %s" % ' '.join(sys.argv[1:])
+                msg = "Invalid argument: %s" % filename
                 self.outputtab_msg(msg, timestamp=False)
     
     def closeEvent(self, event):
         """Executed just before the main window is closed"""
         # Save form values for a future session
         self.save_notification(to_config=True)
+        if self.receiver:
+            self.receiver.stop()
+        if self.tcp_pool:
+            self.tcp_pool.close()
+        if self.api_server:
+            self.api_server.stop()
+        for exporter in self.metrics_exporters.values():
+            exporter.stop()
+        if self.history:
+            self.history.stop()
     
     # Qt slots
     def actionOpen_triggered(self):
@@ -296,6 +400,206 @@ class MainWindow(QtGui.QMainWindow):
         
         self.save_notification(filename)
     
+    def actionSendFleet_triggered(self):
+        """Tools > Send to Simulated Fleet... dialog boxes"""
+        if self.ui.comboSendTo.currentText() != 'Destination Address':
+            self.window_error("Simulated fleets are sent using the included PySNMP engine only.\n\n"
+                              "Set Send To as 'Destination Address'.")
+            return
+        
+        fleet_size, ok = QtGui.QInputDialog.getInt(self, "Simulated Fleet", "Number of devices in the fleet:",
+                                                   FLEET_SIZE, 1, trapfleet.MAX_FLEET_SIZE)
+        if not ok:
+            return
+        count, ok = QtGui.QInputDialog.getInt(self, "Simulated Fleet", "Number of notifications to send:",
+                                              fleet_size, 1, 2147483647)
+        if not ok:
+            return
+        
+        # Devices are assigned credentials round-robin from a comma separated list
+        if 'SNMPv3' in self.ui.comboNotificationType.currentText():
+            label = "SNMPv3 users / security names (comma separated):"
+            current_text = self.ui.comboSecurityName.currentText()
+        else:
+            label = "Community strings (comma separated):"
+            current_text = self.ui.comboCommunityString.currentText()
+        credentials, ok = QtGui.QInputDialog.getText(self, "Simulated Fleet", label,
+                                                     QtGui.QLineEdit.Normal, current_text)
+        if not ok:
+            return
+        credentials = [credential.strip() for credential in credentials.split(',') if credential.strip()]
+        
+        # Agent addresses are assigned sequentially starting from the form's agent address
+        base_address = self.ui.comboAgentAddress.currentText() or DEFAULT_AGENT_ADDRESS
+        try:
+            fleet = trapfleet.Fleet(fleet_size, socket.gethostbyname(base_address), credentials)
+        except (ValueError, socket.error) as e:
+            self.window_error('Error building simulated fleet:\n\n%s' % e)
+            return
+        self.outputtab_msg('Simulated fleet of %s devices built from %s using %s KB of device state'
+                           % (len(fleet), base_address, fleet.nbytes() // 1024))
+        self.profiled('fleet', self.send_notification, fleet=fleet, fleet_count=count)
+    
+    def actionExportScript_triggered(self):
+        """Tools > Export snmptrap Script... dialog boxes"""
+        filenames, _ = QtGui.QFileDialog.getOpenFileNames(self, "Export Notifications", script_path,
+                                                          "Notification Files (*.ntf);;All Files (*.*)")
+        if not filenames:
+            return
+        count, ok = QtGui.QInputDialog.getInt(self, "Export snmptrap Script",
+                                              "Number of commands per notification file:", 1, 1, 2147483647)
+        if not ok:
+            return
+        output, selected_filter = QtGui.QFileDialog.getSaveFileName(self, "Save Script", script_path,
+                                                                    "Batch Files (*.bat);;Shell Scripts (*.sh)")
+        if not output:
+            return
+        script_format = 'sh' if 'Shell' in selected_filter else 'bat'
+        
+        self.statusbar_msg('Exporting snmptrap script...')
+        skipped = []
+        
+        def skip_file(filename, error):
+            skipped.append(os.path.normpath(filename))
+            self.outputtab_msg('Skipped %s: unable to open notification file: %s' % (os.path.normpath(filename), error))
+        
+        try:
+            lines = self.profiled('export', trapexport.export_script, filenames, output, script_format, count,
+                                  progress=self.export_progress, skipped=skip_file)
+        except (IOError, OSError) as e:
+            self.window_error('Unable to export %s\n\n%s' % (os.path.normpath(output), e))
+            return
+        self.outputtab_msg('Exported %s snmptrap commands from %s notification files to %s'
+                           % (lines, len(filenames) - len(skipped), os.path.normpath(output)))
+        if skipped:
+            self.window_error('Unable to open these notification files, which were skipped:\n\n%s'
+                              % '\n'.join(skipped))
+        self.statusbar_msg('Exported snmptrap script: %s' % os.path.normpath(output))
+    
+    def actionLoopbackReceiver_triggered(self):
+        """Tools > Loopback Receiver toggled"""
+        if not self.ui.actionLoopbackReceiver.isChecked():
+            self.receiver.stop()
+            self.outputtab_msg('Loopback receiver stopped')
+            self.actionLoopbackReport_triggered()
+            self.receiver = None
+            return
+        
+        port, ok = QtGui.QInputDialog.getInt(self, "Loopback Receiver", "Local port to receive notifications on:",
+                                             trapreceiver.LOOPBACK_PORT, 1, 65535)
+        if not ok:
+            self.ui.actionLoopbackReceiver.setChecked(False)
+            return
+        
+        # Accept the community string and SNMPv3 user currently on the form
+        communities = [self.ui.comboCommunityString.currentText() or DEFAULT_COMMUNITY_STRING]
+        users = [(trapreceiver.LOOPBACK_USER, None, None, None, None)]
+        security_name = self.ui.comboSecurityName.currentText()
+        if security_name and security_name != trapreceiver.LOOPBACK_USER:
+            auth_protocol = USM_AUTH_PROTOCOLS.get(self.ui.comboAuthProtocol.currentText())
+            priv_protocol = USM_PRIV_PROTOCOLS.get(self.ui.comboPrivProtocol.currentText()) if auth_protocol else None
+            users.append((security_name, auth_protocol, self.ui.comboAuthKey.currentText() if auth_protocol else None,
+                          priv_protocol, self.ui.comboPrivKey.currentText() if priv_protocol else None))
+        try:
+            self.receiver = trapreceiver.TrapReceiver((trapreceiver.LOOPBACK_ADDRESS, port), communities, users)
+            self.receiver.start()
+        except (PySnmpError, socket.error) as e:
+            self.receiver = None
+            self.ui.actionLoopbackReceiver.setChecked(False)
+            self.window_error('Unable to start loopback receiver.\n\n%s' % e)
+            return
+        self.outputtab_msg('Loopback receiver listening on %s:%s; notifications sent to it are tracked'
+                           % (trapreceiver.LOOPBACK_ADDRESS, port))
+    
+    def actionLoopbackReport_triggered(self):
+        """Tools > Loopback Receiver Report clicked"""
+        if not self.receiver:
+            self.window_error('The loopback receiver is not running.')
+            return
+        for line in trapreceiver.format_report(self.receiver.tracker.report()):
+            self.outputtab_msg('Loopback> ' + line)
+    
+    def actionApiServer_triggered(self):
+        """Tools > Local API Server... toggled"""
+        if not self.ui.actionApiServer.isChecked():
+            self.statusbar_msg('Stopping local API server...')
+            self.api_server.stop()
+            stats = self.api_server.service.stats()
+            self.api_server = None
+            self.outputtab_msg('Local API server stopped: %s sent, %s errors, %s rejected'
+                               % (stats['sent'], stats['errors'], stats['rejected']))
+            self.statusbar_msg('Local API server stopped')
+            return
+        
+        port, ok = QtGui.QInputDialog.getInt(self, "Local API Server", "Local port to accept JSON notifications on:",
+                                             trapapi.API_PORT, 1, 65535)
+        if not ok:
+            self.ui.actionApiServer.setChecked(False)
+            return
+        
+        self.statusbar_msg('Starting local API server...')
+        try:
+            self.api_server = trapapi.ApiServer((trapapi.API_ADDRESS, port), metrics=self.metrics,
+                                                history=self.history)
+            self.api_server.start()
+        except (PySnmpError, socket.error, trapapi.SenderError) as e:
+            self.api_server = None
+            self.ui.actionApiServer.setChecked(False)
+            self.window_error('Unable to start local API server.\n\n%s' % e)
+            return
+        self.outputtab_msg('Local API server listening on http://%s:%s/ with %s senders; POST notifications '
+                           'as JSON to /notifications' % (trapapi.API_ADDRESS, port, trapapi.SENDERS))
+        self.statusbar_msg('Local API server started')
+    
+    def actionMetricsPrometheus_triggered(self):
+        """Tools > Export Metrics to Prometheus File... toggled"""
+        if not self.ui.actionMetricsPrometheus.isChecked():
+            self.metrics_export_stop('prometheus')
+            return
+        filename, _ = QtGui.QFileDialog.getSaveFileName(self, "Prometheus Metrics File", script_path,
+                                                        "Prometheus Text Files (*.prom);;All Files (*.*)")
+        if not filename:
+            self.ui.actionMetricsPrometheus.setChecked(False)
+            return
+        self.metrics_export_start('prometheus', trapmetrics.PrometheusFileExporter(self.metrics, filename),
+                                  os.path.normpath(filename))
+    
+    def actionMetricsStatsd_triggered(self):
+        """Tools > Export Metrics to statsd... toggled"""
+        if not self.ui.actionMetricsStatsd.isChecked():
+            self.metrics_export_stop('statsd')
+            return
+        address, ok = QtGui.QInputDialog.getText(self, "statsd Metrics", "statsd address (host:port):",
+                                                 QtGui.QLineEdit.Normal, 'localhost:8125')
+        if not ok or not address:
+            self.ui.actionMetricsStatsd.setChecked(False)
+            return
+        host, _, port = address.partition(':')
+        try:
+            address = (socket.gethostbyname(host), int(port or 8125))
+        except (socket.error, ValueError):
+            self.ui.actionMetricsStatsd.setChecked(False)
+            self.window_error('statsd address is not valid.')
+            return
+        self.metrics_export_start('statsd', trapmetrics.StatsdExporter(self.metrics, address), '%s:%s' % address)
+    
+    def actionProfile_triggered(self):
+        """Tools > Profile Sends... toggled"""
+        if not self.ui.actionProfile.isChecked():
+            self.profiler = None
+            self.outputtab_msg('Profiling stopped')
+            return
+        directory = QtGui.QFileDialog.getExistingDirectory(self, "Profile Directory", script_path)
+        if not directory:
+            self.ui.actionProfile.setChecked(False)
+            return
+        self.profile_start(directory)
+    
+    def buttonStatsReset_clicked(self):
+        """Stats tab Reset button clicked"""
+        self.metrics.reset()
+        self.stats_refresh()
+    
     def actionHelp_triggered(self):
         """Help > Help dialog box"""
         QtGui.QMessageBox.about(self, "Help", HELP_TEXT)
@@ -397,7 +701,7 @@ class MainWindow(QtGui.QMainWindow):
     
     def buttonSend_clicked(self):
         """Send button clicked"""
-        self.send_notification()
+        self.profiled('send', self.send_notification)
     
     def buttonVarbindAdd_clicked(self):
         """Add Varbind button clicked"""
@@ -411,6 +715,11 @@ class MainWindow(QtGui.QMainWindow):
         """Remove Varbind button clicked"""
         self.varbind_remove()
     
+    def tableVarbinds_itemChanged(self, item):
+        """Varbind table cell edited"""
+        if item.column() == 0:
+            self.varbind_oid_changed(item)
+    
     # Convenience methods
     def combobox_history_add(self, combobox, config_key):
         """Add new entry into top of combobox history"""
@@ -446,6 +755,78 @@ class MainWindow(QtGui.QMainWindow):
         # Auto scroll output
         self.ui.editOutput.textCursor().movePosition(QtGui.QTextCursor.End, QtGui.QTextCursor.MoveAnchor)
     
+    def stats_refresh(self):
+        """Refresh the Stats tab from the send pipeline metrics while it is visible"""
+        if self.ui.tabWidget.currentWidget() is self.ui.tabStats:
+            self.ui.editStats.setPlainText('\n'.join(self.metrics.summary_lines()))
+    
+    def history_record(self, notification, error, started):
+        """Queue a send to the history database with its result and latency since started"""
+        if self.history:
+            self.history.record(notification, error, timer() - started)
+    
+    def history_refresh(self):
+        """Refresh the History tab from the history database while it is visible"""
+        if self.ui.tabWidget.currentWidget() is not self.ui.tabHistory or not self.history:
+            return
+        filters = {'host': self.ui.editHistoryHost.text().strip() or None,
+                   'pdu': (None, 'trap', 'inform')[self.ui.comboHistoryPdu.currentIndex()],
+                   'ok': (None, True, False)[self.ui.comboHistoryResult.currentIndex()],
+                   'since': traphistory.day_start() if self.ui.checkHistoryToday.isChecked() else None}
+        self.history.flush(traphistory.FLUSH_TIMEOUT)  # Include sends still queued to the writer, if written soon
+        try:
+            connection = traphistory.open_database(self.history.filename)
+            try:
+                rows = traphistory.query(connection, **filters)
+                total = traphistory.count(connection, **filters)
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            self.window_error('Unable to read send history database.\n\n%s' % e)
+            return
+        self.ui.tableHistory.setRowCount(len(rows))
+        for row_number, row in enumerate(rows):
+            for column, text in enumerate(traphistory.display_fields(row)):
+                self.ui.tableHistory.setItem(row_number, column, QtGui.QTableWidgetItem(text))
+        self.ui.tableHistory.resizeColumnsToContents()
+        self.ui.labelHistoryCount.setText('Showing %s of %s matching sends' % (len(rows), total))
+    
+    def profile_start(self, directory):
+        """Start profiling sends and batch runs into directory"""
+        try:
+            self.profiler = trapprofile.Profiler(directory)
+        except OSError as e:
+            self.profiler = None
+            self.ui.actionProfile.setChecked(False)
+            self.window_error('Unable to create profile directory %s\n\n%s' % (os.path.normpath(directory), e))
+            return
+        self.ui.actionProfile.setChecked(True)
+        self.outputtab_msg('Profiling sends into %s' % os.path.normpath(directory))
+        if not trapprofile.tracemalloc:
+            self.outputtab_msg('Allocation snapshots require Python 3.4 or later and will be skipped')
+    
+    def profiled(self, name, func, *args, **kwargs):
+        """Call func, under the profiler when profiling is enabled, sending its summary to the Output tab"""
+        if not self.profiler:
+            return func(*args, **kwargs)
+        result, lines = self.profiler.run(name, func, *args, **kwargs)
+        for line in lines:
+            self.outputtab_msg('Profile> ' + line, timestamp=False)
+        return result
+    
+    def metrics_export_start(self, name, exporter, destination):
+        """Start a periodic metrics exporter"""
+        exporter.start()
+        self.metrics_exporters[name] = exporter
+        self.outputtab_msg('Exporting metrics every %s seconds to %s' % (exporter.interval, destination))
+    
+    def metrics_export_stop(self, name):
+        """Stop a periodic metrics exporter after a final flush"""
+        exporter = self.metrics_exporters.pop(name, None)
+        if exporter:
+            exporter.stop()
+            self.outputtab_msg('Stopped exporting %s metrics' % name)
+    
     def statusbar_msg(self, msg):
         """Sends a message to the statusbar"""
         self.ui.statusbar.showMessage(msg)
@@ -456,43 +837,74 @@ class MainWindow(QtGui.QMainWindow):
         self.statusbar_msg('Error occurred during previous operation')
     
     # Notification methods
+    def form_notification(self, missing_ok=False):
+        """Return a Notification of the current form values
+
+        Raises ValueError for a varbind row with a missing value unless
+        missing_ok, in which case the value is left blank.
+        """
+        varbinds = []
+        for row in range(0, self.ui.tableVarbinds.rowCount()):
+            values = []
+            for column in range(0, 3):
+                try:
+                    values.append(self.ui.tableVarbinds.item(row, column).text())
+                except AttributeError:
+                    if not missing_ok:
+                        raise ValueError('Varbind row %s is missing a value.' % str(row + 1))
+                    values.append('0' if column == 1 else '')
+            varbinds.append(Varbind(*values))
+        return Notification(
+            notification_type   = self.ui.comboNotificationType.currentIndex(),
+            community_string    = self.ui.comboCommunityString.currentText(),
+            agent_address       = self.ui.comboAgentAddress.currentText(),
+            destination_address = self.ui.comboDestinationAddress.currentText(),
+            source_oid          = self.ui.comboSourceOID.currentText(),
+            generic_trap_type   = self.ui.comboGenericType.currentIndex(),
+            specific_trap_type  = self.ui.editSpecificType.displayText(),
+            security_name       = self.ui.comboSecurityName.currentText(),
+            context_name        = self.ui.comboContext.currentText(),
+            auth_protocol       = self.ui.comboAuthProtocol.currentIndex(),
+            auth_key            = self.ui.comboAuthKey.currentText(),
+            priv_protocol       = self.ui.comboPrivProtocol.currentIndex(),
+            priv_key            = self.ui.comboPrivKey.currentText(),
+            varbinds            = varbinds)
+    
     def open_notification(self, filename=None, from_config=False):
         """Open notification file"""
         # The from_config argument is used when loading on application startup from the config file
         try:
             if from_config:
-                ntf_file = config
+                notification = Notification.from_ntf(config)
             else:
                 ntf_file = shelve.open(filename)
+                try:
+                    notification = Notification.from_ntf(ntf_file)
+                finally:
+                    ntf_file.close()
             
             # Place data on current fields from loaded
-            self.ui.comboNotificationType.setCurrentIndex(ntf_file['notification_type'])
-            self.ui.comboCommunityString.setEditText(ntf_file['community_string'])
-            self.ui.comboAgentAddress.setEditText(ntf_file['agent_address'])
-            self.ui.comboDestinationAddress.setEditText(ntf_file['destination_address'])
-            self.ui.comboSourceOID.setEditText(ntf_file['source_oid'])
-            self.ui.comboGenericType.setCurrentIndex(ntf_file['generic_trap_type'])
-            self.ui.editSpecificType.setText(ntf_file['specific_trap_type'])
-            self.ui.comboSecurityName.setEditText(ntf_file['security_name'])
-            self.ui.comboContext.setEditText(ntf_file['context_name'])
-            self.ui.comboAuthProtocol.setCurrentIndex(ntf_file['auth_protocol'])
-            self.ui.comboAuthKey.setEditText(ntf_file['auth_key'])
-            self.ui.comboPrivProtocol.setCurrentIndex(ntf_file['priv_protocol'])
-            self.ui.comboPrivKey.setEditText(ntf_file['priv_key'])
+            self.ui.comboNotificationType.setCurrentIndex(notification.notification_type)
+            self.ui.comboCommunityString.setEditText(notification.community_string)
+            self.ui.comboAgentAddress.setEditText(notification.agent_address)
+            self.ui.comboDestinationAddress.setEditText(notification.destination_address)
+            self.ui.comboSourceOID.setEditText(notification.source_oid)
+            self.ui.comboGenericType.setCurrentIndex(notification.generic_trap_type)
+            self.ui.editSpecificType.setText(notification.specific_trap_type)
+            self.ui.comboSecurityName.setEditText(notification.security_name)
+            self.ui.comboContext.setEditText(notification.context_name)
+            self.ui.comboAuthProtocol.setCurrentIndex(notification.auth_protocol)
+            self.ui.comboAuthKey.setEditText(notification.auth_key)
+            self.ui.comboPrivProtocol.setCurrentIndex(notification.priv_protocol)
+            self.ui.comboPrivKey.setEditText(notification.priv_key)
             
             # Build the varbinds table
             self.varbind_clearall(skip_dialog=True)
-            for row in range(0, len(ntf_file['varbinds'])):
+            for row, varbind in enumerate(notification.varbinds):
                 self.varbind_add()
-                self.ui.tableVarbinds.setItem(row, 0, QtGui.QTableWidgetItem())
-                self.ui.tableVarbinds.setItem(row, 1, QtGui.QTableWidgetItem())
-                self.ui.tableVarbinds.setItem(row, 2, QtGui.QTableWidgetItem())
-                self.ui.tableVarbinds.item(row, 0).setText(ntf_file['varbinds'][row][0])
-                self.ui.tableVarbinds.item(row, 1).setText(ntf_file['varbinds'][row][1])
-                self.ui.tableVarbinds.item(row, 2).setText(ntf_file['varbinds'][row][2])
-            
-            if not from_config:
-                ntf_file.close()
+                for column, text in enumerate(varbind.row()):
+                    self.ui.tableVarbinds.setItem(row, column, QtGui.QTableWidgetItem())
+                    self.ui.tableVarbinds.item(row, column).setText(text)
         except:
             if not from_config:
                 self.window_error("Unable to load values from %s" % os.path.normpath(filename))
@@ -509,18 +921,7 @@ class MainWindow(QtGui.QMainWindow):
     def save_notification(self, filename=None, to_config=False):
         """Save notification file"""
         # The to_config argument is used when automatically saving on application shutdown to the config file
-        
-        # Grab values from varbinds table
-        row_total = self.ui.tableVarbinds.rowCount()
-        varbinds = []
-        for row in range(0, row_total):
-            try:    oid  = self.ui.tableVarbinds.item(row, 0).text()
-            except: oid  = ''
-            datatype     = self.ui.tableVarbinds.item(row, 1).text()
-            try:    data = self.ui.tableVarbinds.item(row, 2).text()
-            except: data = ''
-            varbind = [oid, datatype, data]
-            varbinds.append(varbind)
+        notification = self.form_notification(missing_ok=True)
         
         # Package data into file
         try:
@@ -528,20 +929,8 @@ class MainWindow(QtGui.QMainWindow):
                 ntf_file = config
             else:
                 ntf_file = shelve.open(filename)
-            ntf_file['notification_type']   = self.ui.comboNotificationType.currentIndex()
-            ntf_file['community_string']    = self.ui.comboCommunityString.currentText()
-            ntf_file['agent_address']       = self.ui.comboAgentAddress.currentText()
-            ntf_file['destination_address'] = self.ui.comboDestinationAddress.currentText()
-            ntf_file['source_oid']          = self.ui.comboSourceOID.currentText()
-            ntf_file['generic_trap_type']   = self.ui.comboGenericType.currentIndex()
-            ntf_file['specific_trap_type']  = self.ui.editSpecificType.displayText()
-            ntf_file['security_name']       = self.ui.comboSecurityName.currentText()
-            ntf_file['context_name']        = self.ui.comboContext.currentText()
-            ntf_file['auth_protocol']       = self.ui.comboAuthProtocol.currentIndex()
-            ntf_file['auth_key']            = self.ui.comboAuthKey.currentText()
-            ntf_file['priv_protocol']       = self.ui.comboPrivProtocol.currentIndex()
-            ntf_file['priv_key']            = self.ui.comboPrivKey.currentText()
-            ntf_file['varbinds']            = varbinds
+            for key, value in notification.to_ntf().items():
+                ntf_file[key] = value
             
             if not to_config:
                 ntf_file.close()
@@ -552,70 +941,35 @@ class MainWindow(QtGui.QMainWindow):
             if not to_config:
                 self.statusbar_msg("Saved notification file: %s" % os.path.normpath(filename))
     
-    def send_notification(self):
+    def export_progress(self, count):
+        """Progress callback while exporting an snmptrap script, keeping the GUI responsive"""
+        self.statusbar_msg('Exporting snmptrap script... %s commands written' % count)
+        QtGui.QApplication.processEvents()
+    
+    def fleet_progress(self, sent, errors):
+        """Progress callback while a simulated fleet is sending, keeping the GUI responsive"""
+        self.statusbar_msg('Sending notifications from simulated fleet... %s sent, %s errors' % (sent, errors))
+        QtGui.QApplication.processEvents()
+    
+    def send_notification(self, fleet=None, fleet_count=0):
         """Send notification to specified destination"""
+        # When a simulated fleet is given, fleet_count notifications are sent on behalf of its devices
         self.statusbar_msg('Building notification...')
+        send_to = self.ui.comboSendTo.currentText()
         
-        # Create variables based on current form values
-        notification_type   = self.ui.comboNotificationType.currentText()
-        community_string    = self.ui.comboCommunityString.currentText()
-        agent_address       = self.ui.comboAgentAddress.currentText()
-        destination_address = self.ui.comboDestinationAddress.currentText()
-        source_oid          = self.ui.comboSourceOID.currentText()
-        generic_trap_type   = int(self.ui.comboGenericType.currentText()[0])
-        specific_trap_type  = self.ui.editSpecificType.displayText()
-        security_name       = self.ui.comboSecurityName.currentText()
-        context_name        = self.ui.comboContext.currentText()
-        auth_protocol       = self.ui.comboAuthProtocol.currentText()
-        auth_key            = self.ui.comboAuthKey.currentText()
-        priv_protocol       = self.ui.comboPrivProtocol.currentText()
-        priv_key            = self.ui.comboPrivKey.currentText()
-        send_to             = self.ui.comboSendTo.currentText()
-        
-        # If form values are missing, fill them in using defaults from script constants
-        if not specific_trap_type:
-            specific_trap_type = SPECIFIC_TRAP_TYPE
-        
-        # Check for issues with the form fields
-        if not community_string and not 'SNMPv3' in notification_type:
-            self.window_error('Error building notification:\n\n'
-                              'Community string must be filled in.')
-            return
-        if not agent_address and notification_type == 'SNMPv1 Trap':
-            self.window_error('Error building notification:\n\n'
-                              'Agent address must be filled in.')
-            return
-        if not destination_address:
-            self.window_error('Error building notification:\n\n'
-                              'Destination address must be filled in.')
-            return
-        if not source_oid:
-            if 'SNMPv1' in notification_type and generic_trap_type < 6:
-                source_oid = '1.3.6.1.6.3.1.1.5'  # Use default enterprise OID for non-enterprise specific SNMPv1 traps
-            else:
-                self.window_error('Error building notification:\n\n'
-                                  'Source OID must be filled in.')
-                return
-        if not character_test(source_oid, '0123456789.'):
-            self.window_error('Error building notification:\n\n'
-                              'Source Object ID must be a dotted set of numbers.')
-            return
-        if not specific_trap_type.isdigit() and generic_trap_type == 6 and notification_type == 'SNMPv1 Trap':
-            self.window_error('Error building notification:\n\n'
-                              'Specific trap type must be numeric.')
-            return
-        if not security_name and 'SNMPv3' in notification_type:
-            self.window_error('Error building notification:\n\n'
-                              'User / Security Name must be filled in.')
-            return
-        if len(auth_key) < 8 and auth_protocol != 'None' and 'SNMPv3' in notification_type:
-            self.window_error('Error building notification:\n\n'
-                              'Authentication key must be at least 8 characters.')
-            return
-        if len(priv_key) < 8 and auth_protocol != 'None' and priv_protocol != 'None' and 'SNMPv3' in notification_type:
-            self.window_error('Error building notification:\n\n'
-                              'Privacy key must be at least 8 characters.')
+        # Check for issues with the form fields, converting them once into a plan to send
+        try:
+            notification = self.form_notification()
+            warnings = []
+            if self.mib_index:
+                notification, warnings = self.mib_index.check_notification(notification)
+            plan = notification.compile(pysnmp=send_to == 'Destination Address', metrics=self.metrics)
+        except ValueError as e:
+            self.window_error('Error building notification:\n\n%s' % e)
             return
+        for warning in warnings:  # Sent as typed, which may be deliberate, e.g. to test a manager
+            self.outputtab_msg('MIB warning: %s' % warning)
+        destination_address = notification.destination_address
         
         # Add form values to combobox history
         self.combobox_history_add(self.ui.comboCommunityString, 'comboCommunityString_history')
@@ -627,223 +981,118 @@ class MainWindow(QtGui.QMainWindow):
         self.combobox_history_add(self.ui.comboAuthKey, 'comboAuthKey_history')
         self.combobox_history_add(self.ui.comboPrivKey, 'comboPrivKey_history')
         
-        # Parse destination address into host and port
-        if ':' in destination_address:
-            host, port = destination_address.split(':')
-            if not port.isdigit():
-                self.window_error('Error building notification:\n\n'
-                                  'Port number is not valid.')
-                return
-        else:
-            host = destination_address
-            port = '162'
-        transport_target = ntforg.UdpTransportTarget((host, int(port)))
-        
-        # Resolve host DNS, checking address validity in the process
-        try:
-            host = socket.gethostbyname(host)
-        except:
-            self.window_error('Error building notification:\n\n'
-                              'Destination address is not valid.')
-            return
-        try:
-            agent_address = socket.gethostbyname(agent_address)
-        except:
-            self.window_error('Error building notification:\n\n'
-                              'Agent address is not valid.')
-            return
-        
         # Process notification using included PySNMP module
         if send_to == 'Destination Address':
-            # Trap or Inform PDU
-            if 'Trap' in notification_type:
-                pdu = 'trap'
-            if 'Inform' in notification_type:
-                pdu = 'inform'
-            
-            # If using SNMPv1, integrate the generic and specific trap types into the source OID,
-            # and separate the enterprise_oid
-            if notification_type == 'SNMPv1 Trap':
-                snmp_model = 0  # SNMPv1
-                enterprise_oid = source_oid
-                if generic_trap_type < 6:
-                    source_oid = '1.3.6.1.6.3.1.1.5.%s' % (generic_trap_type + 1)
-                if generic_trap_type == 6:
-                    source_oid = '%s.0.%s' % (enterprise_oid, specific_trap_type)
-            else:
-                snmp_model = 1  # SNMPv2c
-                enterprise_oid = ''
+            varbinds = list(plan.varbinds)
             
-            # Avoid "pyasn1.error.PyAsn1Error: Invalid sub-ID" exception
-            # by converting source and enterprise OIDs to string
-            source_oid = str(source_oid)
-            enterprise_oid = str(enterprise_oid)
-            
-            # Determine authentication information based on community string (SNMPv1/2c)
-            # or user-based security model (SNMPv3)
-            if ('SNMPv1' or 'SNMPv2c') in notification_type:
-                authentication = ntforg.CommunityData(community_string, mpModel=snmp_model)
-            if 'SNMPv3' in notification_type:
-                # Map selected protocols to ntforg objects
-                if auth_protocol == 'MD5':     auth_protocol = ntforg.usmHMACMD5AuthProtocol
-                if auth_protocol == 'SHA-1':   auth_protocol = ntforg.usmHMACSHAAuthProtocol
-                if priv_protocol == 'DES':     priv_protocol = ntforg.usmDESPrivProtocol
-                if priv_protocol == '3DES':    priv_protocol = ntforg.usm3DESEDEPrivProtocol
-                if priv_protocol == 'AES-128': priv_protocol = ntforg.usmAesCfb128Protocol
-                if priv_protocol == 'AES-192': priv_protocol = ntforg.usmAesCfb192Protocol
-                if priv_protocol == 'AES-256': priv_protocol = ntforg.usmAesCfb256Protocol
-                # Built USM authentication object
-                if auth_protocol == 'None':    # No authentication, no privacy
-                    authentication = ntforg.UsmUserData(security_name)
-                elif priv_protocol == 'None':  # Authentication, no privacy
-                    authentication = ntforg.UsmUserData(security_name, auth_key, authProtocol=auth_protocol)
-                else:                          # Authentication and privacy
-                    authentication = ntforg.UsmUserData(security_name, auth_key, priv_key,
-                                                        authProtocol=auth_protocol, privProtocol=priv_protocol)
-            
-            # Compile a list of all the varbinds in the table
-            row_total = self.ui.tableVarbinds.rowCount()
-            varbinds = []
-            for row in range(0, row_total):
-                try:
-                    oid      = str(self.ui.tableVarbinds.item(row, 0).text().strip())
-                    datatype = str(self.ui.tableVarbinds.item(row, 1).text().strip())
-                    data     = str(self.ui.tableVarbinds.item(row, 2).text().strip())
-                except AttributeError:
-                    self.window_error('Error building notification:\n\n'
-                                      'Varbind row %s is missing a value.' % str(row + 1))
+            # SNMP over TCP is encoded directly and sent through persistent connections, not the PySNMP engine
+            if plan.transport == 'tcp':
+                if fleet:
+                    self.window_error('Simulated fleets are sent over UDP only.')
                     return
-                if not character_test(oid, '0123456789.'):
-                    self.window_error('Error building notification:\n\n'
-                                      'OID in varbind row %s must be a single dotted set of numbers.' % str(row + 1))
-                    return
-                datatype = OID_TYPES[int(datatype)][0]
+                self.send_tcp(plan)
+                return
+            
+            # Hand off to the simulated fleet, which appends per-device standard varbinds itself
+            if fleet:
+                sender = trapfleet.FleetSender.from_plan(fleet, plan)
+                self.statusbar_msg('Sending notifications from simulated fleet...')
+                self.outputtab_msg('Sending %s notifications from %s simulated devices to %s: '
+                                   'notification_type="%s" source_oid="%s"'
+                                   % (fleet_count, len(fleet), destination_address, plan.notification_type,
+                                      plan.trap_oid))
                 try:
-                    if datatype == 'Integer':           varbind = (oid, rfc1902.Integer(data))
-                    elif datatype == 'Unsigned':        varbind = (oid, rfc1902.Unsigned32(data))
-                    elif datatype == 'Counter32':       varbind = (oid, rfc1902.Counter32(data))
-                    elif datatype == 'String':          varbind = (oid, rfc1902.OctetString(data))
-                    #elif datatype == 'Hex String':     varbind = (oid, rfc1902.OctetString(data))
-                    #elif datatype == 'Decimal String': varbind = (oid, rfc1902.OctetString(data))
-                    elif datatype == 'Null Object':     varbind = (oid, univ.Null())
-                    elif datatype == 'OID':             varbind = (oid, univ.ObjectIdentifier(data))
-                    elif datatype == 'Time Ticks':      varbind = (oid, rfc1902.TimeTicks(data))
-                    elif datatype == 'IP Address':      varbind = (oid, rfc1902.IpAddress(data))
-                    #elif datatype == 'Bits':           varbind = (oid, rfc1902.Bits(data))
-                    else:                               raise
-                except:
-                    self.window_error('Error building notification:\n\n'
-                                      'Varbind row %s contains an invalid data value.' % str(row + 1))
+                    sent, errors, elapsed = sender.run(fleet_count, progress=self.fleet_progress,
+                                                       progress_interval=FLEET_PROGRESS_INTERVAL)
+                except PySnmpError as e:
+                    self.window_error('Exception while sending notification.\n\n%s' % e)
+                    self.outputtab_msg('Exception while sending notification.')
                     return
-                varbinds.append(varbind)
+                self.metrics.increment('sends', sent)
+                self.metrics.increment('errors', errors)
+                self.outputtab_msg('Simulated fleet sent %s notifications with %s errors in %.1f seconds (%.0f/s)'
+                                   % (sent, errors, elapsed, (sent + errors) / max(elapsed, 0.001)))
+                self.statusbar_msg('Notifications sent from simulated fleet')
+                return
             
-            # Append the standard varbinds (SNMPv1 only)
-            if 'SNMPv1' in notification_type:
-                varbinds.append(('1.3.6.1.2.1.1.3.0', 0))                   # SNMPv1 Time Stamp / Uptime (always zero)
-                varbinds.append(('1.3.6.1.6.3.18.1.3.0', agent_address))    # SNMPv1 Agent Address
-                varbinds.append(('1.3.6.1.6.3.1.1.4.3.0', enterprise_oid))  # SNMPv1 Enterprise OID
+            # Tag notifications sent to the loopback receiver so it can match them on arrival
+            loopback = self.receiver and (plan.host, plan.port) == self.receiver.address
+            if loopback:
+                sequence = self.receiver.tracker.register(trapreceiver.varbinds_digest(varbinds))
+                varbinds.append((trapreceiver.SEQUENCE_OID, rfc1902.Unsigned32(sequence)))
+            varbinds.extend(plan.standard_varbinds())
             
             # Send the notification using the PySNMP engine
             self.statusbar_msg('Sending notification...')
-            if ('SNMPv1' or 'SNMPv2c') in notification_type:
+            if plan.version == 'SNMPv3':
                 self.outputtab_msg('Sending notification to %s: '
-                                   'notification_type="%s" community_string="%s" source_oid="%s"'
-                                   % (destination_address, notification_type, community_string, source_oid))
+                                   'notification_type="%s" security_name="%s" source_oid="%s"'
+                                   % (destination_address, plan.notification_type, notification.security_name,
+                                      plan.trap_oid))
             else:
                 self.outputtab_msg('Sending notification to %s: '
-                                   'notification_type="%s" security_name="%s" source_oid="%s"'
-                                   % (destination_address, notification_type, security_name, source_oid))
+                                   'notification_type="%s" community_string="%s" source_oid="%s"'
+                                   % (destination_address, plan.notification_type, notification.community_string,
+                                      plan.trap_oid))
+            context_name = notification.context_name
+            send_started = timer()
             try:
-                if context_name != '' and 'SNMPv3' in notification_type: # Custom context name when using SNMPv3
-                    snmpEngine = engine.SnmpEngine()
-                    snmpContext = context.SnmpContext(snmpEngine)
-                    snmpContext.registerContextName(context_name, snmpContext.getMibInstrum())
-                    ntfOrg = ntforg.NotificationOriginator(snmpEngine, snmpContext)
-                    errorIndication = ntfOrg.sendNotification(authentication, transport_target,
-                                                              pdu, source_oid, *varbinds, contextName=context_name)
-                else:
-                    ntfOrg = ntforg.NotificationOriginator()
-                    errorIndication = ntfOrg.sendNotification(authentication, transport_target,
-                                                              pdu, source_oid, *varbinds)
+                with self.metrics.timer('engine_setup'):
+                    if context_name != '' and plan.version == 'SNMPv3': # Custom context name when using SNMPv3
+                        snmpEngine = trapreceiver.loopback_engine() if loopback else engine.SnmpEngine()
+                        snmpContext = context.SnmpContext(snmpEngine)
+                        snmpContext.registerContextName(context_name, snmpContext.getMibInstrum())
+                        ntfOrg = ntforg.NotificationOriginator(snmpEngine, snmpContext)
+                        send_options = {'contextName': context_name}
+                    else:
+                        ntfOrg = ntforg.NotificationOriginator(trapreceiver.loopback_engine() if loopback else None)
+                        send_options = {}
+                observer = trapmetrics.EngineObserver(self.metrics, ntfOrg.snmpEngine)
+                try:
+                    errorIndication = error_indication(ntfOrg.sendNotification(plan.authentication(),
+                                                                               plan.transport_target(), plan.pdu,
+                                                                               plan.trap_oid, *varbinds,
+                                                                               **send_options))
+                finally:
+                    observer.finish(plan.pdu == 'inform')
                 if errorIndication:
-                    if pdu == 'inform' and str(errorIndication) == 'No SNMP response received before timeout':
+                    self.metrics.increment('errors')
+                    if plan.pdu == 'inform' and str(errorIndication) == 'No SNMP response received before timeout':
+                        self.metrics.increment('inform_timeouts')
                         error_msg = 'InformRequest packet received no acknowledgment from %s.' % destination_address
                     else:
                         error_msg = 'Error building notification: %s' % errorIndication
+                    self.history_record(notification, error_msg, send_started)
                     self.window_error(error_msg)
                     self.outputtab_msg(error_msg)
                     return
             except PySnmpError as e:
+                self.metrics.increment('errors')
+                self.history_record(notification, 'Exception while sending notification: %s' % e, send_started)
                 self.window_error('Exception while sending notification.\n\n%s' % e)
                 self.outputtab_msg('Exception while sending notification.')
             except:
+                self.metrics.increment('errors')
+                self.history_record(notification, 'Exception while sending notification.', send_started)
                 self.window_error('Exception while sending notification.\n\n'
                                   'See log file in current working directory for details.')
                 self.outputtab_msg('Exception while sending notification.')
                 raise
             else:
+                self.metrics.increment('sends')
+                self.history_record(notification, None, send_started)
                 self.outputtab_msg("Notification sent successfully")
                 self.statusbar_msg('Notification sent')
         
         # Process notification using external snmptrap program
         if 'snmptrap' in send_to:
-            # Trap or Inform PDU; needed to build the options string
-            if 'Trap' in notification_type:
-                pdu = ''
-            if 'Inform' in notification_type:
-                pdu = '-Ci '
-            
-            # Build a string made up of the form values, making up the trap options
-            if 'SNMPv1' in notification_type:
-                options = "-v 1 -c %s %s %s %s %s %s 0" % (community_string, destination_address, source_oid,
-                                                           agent_address, generic_trap_type, specific_trap_type)
-            if 'SNMPv2c' in notification_type:
-                options = "%s-v 2c -c %s %s 0 %s" % (pdu, community_string, destination_address, source_oid)
-            if 'SNMPv3' in notification_type:
-                # Translate protocols to terms snmptrap understands
-                if auth_protocol == 'SHA-1':   auth_protocol = 'SHA'
-                if priv_protocol == 'AES-128': priv_protocol = 'AES'
-                # Make security level as required by snmptrap '-l' argument
-                if auth_protocol == 'None' and priv_protocol == 'None':
-                    security_level = 'noAuthNoPriv'
-                    options = "%s-v 3 -n \"%s\" -u %s -l %s %s 0 %s"\
-                              % (pdu, context_name, security_name, security_level, destination_address, source_oid)
-                if auth_protocol != 'None' and priv_protocol == 'None':
-                    security_level = 'authNoPriv'
-                    options = "%s-v 3 -n \"%s\" -u %s -l %s -a %s -A %s %s 0 %s"\
-                              % (pdu, context_name, security_name, security_level,
-                                 auth_protocol, auth_key, destination_address, source_oid)
-                if auth_protocol != 'None' and priv_protocol != 'None':
-                    unsupported_protocols = ['3DES', 'AES-192', 'AES-256']
-                    if priv_protocol in unsupported_protocols:
-                        self.window_error('Error building notification:\n\n'
-                                          '%s protocol is not supported by snmptrap.' % priv_protocol)
-                        return
-                    security_level = 'authPriv'
-                    options = "%s-v 3 -n \"%s\" -u %s -l %s -a %s -A %s -x %s -X %s %s 0 %s"\
-                              % (pdu, context_name, security_name, security_level, auth_protocol,
-                                 auth_key, priv_protocol, priv_key, destination_address, source_oid)
-        
-            # Build a dictionary made up of all the varbinds in the table, then convert to string
-            row_total = self.ui.tableVarbinds.rowCount()
-            varbinds = []
-            for row in range(0, row_total):
-                try:
-                    oid      =          self.ui.tableVarbinds.item(row, 0).text().strip()
-                    datatype =          self.ui.tableVarbinds.item(row, 1).text().strip()
-                    data     = '"%s"' % self.ui.tableVarbinds.item(row, 2).text().strip()
-                except AttributeError:
-                    self.window_error('Error building notification:\n\n'
-                                      'Varbind row %s is missing a value.' % str(row + 1))
-                    return
-                if ' ' in oid:
-                    self.window_error('Error building notification:\n\n'
-                                      'OID in varbind row %s contains multiple values.' % str(row + 1))
-                    return
-                datatype = OID_TYPES[int(datatype)][1]
-                varbind = '%s %s %s' % (oid, datatype, data)
-                varbinds.append(varbind)
-            varbinds = ' '.join(varbinds)
+            # Build the options and varbinds strings from the plan
+            try:
+                options = plan.snmptrap_options()
+                varbinds = snmptrap_varbinds(notification.varbinds)
+            except ValueError as e:
+                self.window_error('Error building notification:\n\n%s' % e)
+                return
 
             if sys.platform == 'win32':
                 # Copy snmptrap command to local SecureCRT window
@@ -884,7 +1133,7 @@ class MainWindow(QtGui.QMainWindow):
                 try:
                     output = subprocess.check_output(command, stderr=subprocess.STDOUT, creationflags=CREATE_NO_WINDOW)
                 except subprocess.CalledProcessError as e:
-                    if 'Inform' in notification_type and 'snmpinform: Timeout' in e.output:
+                    if plan.pdu == 'inform' and 'snmpinform: Timeout' in e.output:
                         error_msg = 'snmptrap error:\n' \
                                     'InformRequest packet received no acknowledgment from %s.' % destination_address
                     else:
@@ -901,6 +1150,67 @@ class MainWindow(QtGui.QMainWindow):
                 self.outputtab_msg('OutputOnly> ' + command)
                 self.statusbar_msg('snmptrap command sent to output tab')
     
+    def send_tcp(self, plan):
+        """Send a compiled notification over a pooled persistent TCP connection"""
+        destination_address = plan.notification.destination_address
+        if self.tcp_pool is None:
+            self.tcp_pool = traptcp.TcpPool()
+        try:
+            sender = traptcp.TcpNotificationSender(self.tcp_pool, plan)
+        except ValueError as e:
+            self.window_error('Error building notification:\n\n%s' % e)
+            return
+        except:
+            self.tcp_send_exception(plan.notification, timer())
+            raise
+        
+        self.statusbar_msg('Sending notification over TCP...')
+        self.outputtab_msg('Sending notification to %s: notification_type="%s" community_string="%s" source_oid="%s"'
+                           % (destination_address, plan.notification_type, plan.notification.community_string,
+                              plan.trap_oid))
+        error_msg = None
+        send_started = timer()
+        try:
+            with self.metrics.timer('encode'):
+                request_id = sender.send(timeout=TCP_SEND_TIMEOUT)
+        except ValueError as e:
+            error_msg = str(e)
+        except:
+            self.tcp_send_exception(plan.notification, send_started)
+            raise
+        else:
+            stage_started = timer()
+            if plan.pdu == 'inform':
+                timed_out = self.tcp_pool.wait([request_id], traptcp.INFORM_TIMEOUT)
+                self.metrics.observe('inform_wait', timer() - stage_started)
+                if timed_out:
+                    self.metrics.increment('inform_timeouts')
+                    error_msg = 'InformRequest packet received no acknowledgment from %s.' % destination_address
+            else:
+                if not self.tcp_pool.flush(TCP_SEND_TIMEOUT, sender.address):
+                    error_msg = 'Unable to connect to %s over TCP: %s' \
+                                % (destination_address, self.tcp_pool.last_error(sender.address))
+                self.metrics.observe('socket', timer() - stage_started)
+            if error_msg:
+                self.tcp_pool.discard(sender.address)  # Reported as failed, so not to be resent on reconnecting
+        self.history_record(plan.notification, error_msg, send_started)
+        if error_msg:
+            self.metrics.increment('errors')
+            self.window_error(error_msg)
+            self.outputtab_msg(error_msg)
+            return
+        self.metrics.increment('sends')
+        self.outputtab_msg("Notification sent successfully")
+        self.statusbar_msg('Notification sent')
+    
+    def tcp_send_exception(self, notification, send_started):
+        """Report an unexpected exception while sending over TCP, as for the PySNMP engine"""
+        self.metrics.increment('errors')
+        self.history_record(notification, 'Exception while sending notification.', send_started)
+        self.window_error('Exception while sending notification.\n\n'
+                          'See log file in current working directory for details.')
+        self.outputtab_msg('Exception while sending notification.')
+    
     # Varbinds table row adjustment methods
     def varbind_add(self):
         """Varbind Add button clicked"""
@@ -910,6 +1220,14 @@ class MainWindow(QtGui.QMainWindow):
         self.ui.tableVarbinds.item(row_count, 1).setText('0')
         self.ui.tableVarbinds.openPersistentEditor(self.ui.tableVarbinds.item(row_count, 1))
     
+    def varbind_oid_changed(self, item):
+        """Fill in the data type of an entered varbind OID from the MIBs, describing its object in a tooltip"""
+        found = self.mib_index.lookup(item.text()) if self.mib_index else None
+        item.setToolTip(self.mib_index.describe(item.text()) if found else '')
+        type_item = self.ui.tableVarbinds.item(item.row(), 1)
+        if found and found[0].datatype is not None and type_item:
+            type_item.setText(str(found[0].datatype))
+    
     def varbind_clearall(self, skip_dialog=False):
         """Varbind Clear All button clicked"""
         row_total = self.ui.tableVarbinds.rowCount()
@@ -966,14 +1284,6 @@ class ComboDelegate(QtGui.QItemDelegate):
         self.commitData.emit(self.sender())
 
 
-def character_test(text, allowed):
-    """Test if the characters in 'text' are all made up of characters in 'allowed'"""
-    if text.strip(allowed):
-        return False
-    else:
-        return True
-
-
 def visible_windows():
     """Returns dictionary of handle:windowname pairs for all visible windows"""
     handles = {}
@@ -1003,8 +1313,13 @@ if __name__ == '__main__':
     except:
         pass
     
-    app = QtGui.QApplication(sys.argv)
-    window = MainWindow()
+    parser = argparse.ArgumentParser(description='Misner Trap Tool')
+    parser.add_argument('filename', nargs='?', metavar='notification.ntf', help='notification file to open')
+    parser.add_argument('--profile', metavar='DIRECTORY', help='profile sends and batch runs into DIRECTORY')
+    args, qt_args = parser.parse_known_args()
+    
+    app = QtGui.QApplication(sys.argv[:1] + qt_args)
+    window = MainWindow(args.filename, args.profile)
     exitcode = app.exec_()
     
     try:
@@ -0,0 +1,551 @@
+#!/usr/bin/env python
+"""
+notification.py - Misner Trap Tool notification helpers
+Copyright (C) 2015-2017 Joe Misner <joe@misner.net>
+http://tools.misner.net/
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software Foundation,
+Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+Notification constants and builders which do not depend on the GUI,
+shared by the main window and the command-line tools.
+
+A Notification holds the same fields as a notification file.  Its
+compile() method validates them and converts the varbinds once into a
+SendPlan, which the PySNMP engine, simulated fleets and snmptrap
+commands are all built from.
+"""
+
+import sys
+import time
+import socket
+import shelve
+import numbers
+from pysnmp.entity.rfc3413.oneliner import ntforg
+from pysnmp.proto import rfc1902
+from pyasn1.type import univ
+
+# Highest resolution wall clock available for measuring durations
+try:
+    from time import perf_counter as timer
+except ImportError:
+    timer = time.clock if sys.platform == 'win32' else time.time
+
+# Text types, which JSON strings decode to on either Python version
+try:
+    TEXT_TYPES = (str, unicode)
+except NameError:
+    TEXT_TYPES = (str,)
+
+SPECIFIC_TRAP_TYPE = '1'
+OID_TYPES = {
+    0: ["Integer", 'i'],
+    1: ["Unsigned", 'u'],
+    2: ["Counter32", 'c'],
+    3: ["String", 's'],
+   #4: ["Hex String", 'x'],
+   #5: ["Decimal String", 'd'],
+    4: ["Null Object", 'n'],
+    5: ["OID", 'o'],
+    6: ["Time Ticks", 't'],
+    7: ["IP Address", 'a']
+  #10: ["Bits", 'b']
+}
+
+# Combobox entries, in the order they appear in misnertraptool.ui; notification files store the indexes
+NOTIFICATION_TYPES = ['SNMPv1 Trap', 'SNMPv2c Trap', 'SNMPv2c Inform', 'SNMPv3 Trap', 'SNMPv3 Inform']
+GENERIC_TRAP_TYPES = ['0 - Cold Start', '1 - Warm Start', '2 - Link Down', '3 - Link Up',
+                      '4 - Authentication Failure', '5 - EGP Neighbor Loss', '6 - Enterprise Specific']
+AUTH_PROTOCOLS = ['None', 'MD5', 'SHA-1']
+PRIV_PROTOCOLS = ['None', 'DES', '3DES', 'AES-128', 'AES-192', 'AES-256']
+
+# PySNMP value types for each OID_TYPES data type
+VARBIND_CONVERTERS = {
+    0: rfc1902.Integer,
+    1: rfc1902.Unsigned32,
+    2: rfc1902.Counter32,
+    3: rfc1902.OctetString,
+    4: lambda data: univ.Null(),  # Any data is ignored
+    5: univ.ObjectIdentifier,
+    6: rfc1902.TimeTicks,
+    7: rfc1902.IpAddress
+}
+
+# Map protocol combobox text to ntforg objects
+USM_AUTH_PROTOCOLS = {
+    'MD5':   ntforg.usmHMACMD5AuthProtocol,
+    'SHA-1': ntforg.usmHMACSHAAuthProtocol
+}
+USM_PRIV_PROTOCOLS = {
+    'DES':     ntforg.usmDESPrivProtocol,
+    '3DES':    ntforg.usm3DESEDEPrivProtocol,
+    'AES-128': ntforg.usmAesCfb128Protocol,
+    'AES-192': ntforg.usmAesCfb192Protocol,
+    'AES-256': ntforg.usmAesCfb256Protocol
+}
+
+# Keys persisted in notification (.ntf) files and the config file
+NTF_FIELDS = ('notification_type', 'community_string', 'agent_address', 'destination_address', 'source_oid',
+              'generic_trap_type', 'specific_trap_type', 'security_name', 'context_name', 'auth_protocol',
+              'auth_key', 'priv_protocol', 'priv_key', 'varbinds')
+
+SNMPTRAP_UNSUPPORTED_PROTOCOLS = ['3DES', 'AES-192', 'AES-256']
+
+
+def character_test(text, allowed):
+    """Test if the characters in 'text' are all made up of characters in 'allowed'"""
+    if text.strip(allowed):
+        return False
+    else:
+        return True
+
+
+def check_notification(notification_type, community_string, agent_address, destination_address, source_oid,
+                       generic_trap_type, specific_trap_type, security_name, auth_protocol, auth_key,
+                       priv_protocol, priv_key):
+    """Check notification field values, returning the source OID to use or raising ValueError"""
+    if not community_string and not 'SNMPv3' in notification_type:
+        raise ValueError('Community string must be filled in.')
+    if not agent_address and notification_type == 'SNMPv1 Trap':
+        raise ValueError('Agent address must be filled in.')
+    if not destination_address:
+        raise ValueError('Destination address must be filled in.')
+    if not source_oid:
+        if 'SNMPv1' in notification_type and generic_trap_type < 6:
+            source_oid = '1.3.6.1.6.3.1.1.5'  # Use default enterprise OID for non-enterprise specific SNMPv1 traps
+        else:
+            raise ValueError('Source OID must be filled in.')
+    if not character_test(source_oid, '0123456789.'):
+        raise ValueError('Source Object ID must be a dotted set of numbers.')
+    if not specific_trap_type.isdigit() and generic_trap_type == 6 and notification_type == 'SNMPv1 Trap':
+        raise ValueError('Specific trap type must be numeric.')
+    if not security_name and 'SNMPv3' in notification_type:
+        raise ValueError('User / Security Name must be filled in.')
+    if len(auth_key) < 8 and auth_protocol != 'None' and 'SNMPv3' in notification_type:
+        raise ValueError('Authentication key must be at least 8 characters.')
+    if len(priv_key) < 8 and auth_protocol != 'None' and priv_protocol != 'None' and 'SNMPv3' in notification_type:
+        raise ValueError('Privacy key must be at least 8 characters.')
+    return source_oid
+
+
+def build_varbind(oid, datatype, data, row=0):
+    """Return a PySNMP (oid, value) varbind from table values, raising ValueError if invalid"""
+    if not character_test(oid, '0123456789.'):
+        raise ValueError('OID in varbind row %s must be a single dotted set of numbers.' % str(row + 1))
+    try:
+        return (oid, VARBIND_CONVERTERS[int(datatype)](data))
+    except Exception:
+        raise ValueError('Varbind row %s contains an invalid data value.' % str(row + 1))
+
+
+def parse_destination(destination_address):
+    """Return the (transport, host, port) of a destination address, raising ValueError if the port is invalid
+
+    A tcp: or udp: prefix selects the transport, as with Net-SNMP.
+    """
+    transport = 'udp'
+    if destination_address[:4].lower() in ('tcp:', 'udp:'):
+        transport = destination_address[:3].lower()
+        destination_address = destination_address[4:]
+    if ':' in destination_address:
+        host, port = destination_address.split(':', 1)
+        if not port.isdigit():
+            raise ValueError('Port number is not valid.')
+        return transport, host, int(port)
+    return transport, destination_address, 162
+
+
+def error_indication(result):
+    """Return the error indication from a PySNMP sendNotification() result
+
+    Depending on the PySNMP version, InformRequests return an
+    (errorIndication, errorStatus, errorIndex, varBinds) tuple.
+    """
+    if isinstance(result, tuple):
+        return result[0]
+    return result
+
+
+def open_ntf(filename):
+    """Return the fields of a notification file as a dictionary"""
+    ntf_file = shelve.open(filename, 'r')
+    try:
+        return dict((key, ntf_file[key]) for key in NTF_FIELDS)
+    finally:
+        ntf_file.close()
+
+
+def save_ntf(filename, ntf):
+    """Save a notification dictionary to a notification file"""
+    ntf_file = shelve.open(filename)
+    try:
+        for key in NTF_FIELDS:
+            ntf_file[key] = ntf[key]
+    finally:
+        ntf_file.close()
+
+
+def snmptrap_options(notification_type, community_string, agent_address, destination_address, source_oid,
+                     generic_trap_type, specific_trap_type, security_name, context_name,
+                     auth_protocol, auth_key, priv_protocol, priv_key, uptime=0, quote=None):
+    """Return the snmptrap options string for a notification, raising ValueError if it can't be built
+
+    With a quote function, as for varbind values, every field entered by
+    the user is quoted with it; otherwise only the context name is.
+    """
+    # Trap or Inform PDU; needed to build the options string
+    if 'Trap' in notification_type:
+        pdu = ''
+    if 'Inform' in notification_type:
+        pdu = '-Ci '
+
+    # Quote the user's fields for the shell the command will be run from
+    if quote is None:
+        context_name = '"%s"' % context_name
+    else:
+        community_string, agent_address, destination_address, source_oid, specific_trap_type, \
+            security_name, context_name, auth_key, priv_key = \
+            [quote('%s' % field) for field in (community_string, agent_address, destination_address, source_oid,
+                                               specific_trap_type, security_name, context_name, auth_key, priv_key)]
+
+    # Build a string made up of the form values, making up the trap options
+    if 'SNMPv1' in notification_type:
+        options = "-v 1 -c %s %s %s %s %s %s %s" % (community_string, destination_address, source_oid,
+                                                    agent_address, generic_trap_type, specific_trap_type, uptime)
+    if 'SNMPv2c' in notification_type:
+        options = "%s-v 2c -c %s %s %s %s" % (pdu, community_string, destination_address, uptime, source_oid)
+    if 'SNMPv3' in notification_type:
+        # Translate protocols to terms snmptrap understands
+        if auth_protocol == 'SHA-1':   auth_protocol = 'SHA'
+        if priv_protocol == 'AES-128': priv_protocol = 'AES'
+        # Make security level as required by snmptrap '-l' argument
+        if auth_protocol == 'None' and priv_protocol == 'None':
+            security_level = 'noAuthNoPriv'
+            options = "%s-v 3 -n %s -u %s -l %s %s %s %s"\
+                      % (pdu, context_name, security_name, security_level, destination_address, uptime, source_oid)
+        if auth_protocol != 'None' and priv_protocol == 'None':
+            security_level = 'authNoPriv'
+            options = "%s-v 3 -n %s -u %s -l %s -a %s -A %s %s %s %s"\
+                      % (pdu, context_name, security_name, security_level,
+                         auth_protocol, auth_key, destination_address, uptime, source_oid)
+        if auth_protocol != 'None' and priv_protocol != 'None':
+            if priv_protocol in SNMPTRAP_UNSUPPORTED_PROTOCOLS:
+                raise ValueError('%s protocol is not supported by snmptrap.' % priv_protocol)
+            security_level = 'authPriv'
+            options = "%s-v 3 -n %s -u %s -l %s -a %s -A %s -x %s -X %s %s %s %s"\
+                      % (pdu, context_name, security_name, security_level, auth_protocol,
+                         auth_key, priv_protocol, priv_key, destination_address, uptime, source_oid)
+    return options
+
+
+def quote_default(data):
+    """Quote a varbind value the way the Output tab always has"""
+    return '"%s"' % data
+
+
+def snmptrap_varbinds(varbinds, quote=quote_default):
+    """Return the snmptrap varbind arguments for a list of Varbinds or [oid, datatype, data] rows"""
+    arguments = []
+    for row, varbind in enumerate(varbinds):
+        if not isinstance(varbind, Varbind):
+            varbind = Varbind(*varbind)
+        arguments.append(varbind.snmptrap(row, quote))
+    return ' '.join(arguments)
+
+
+class Varbind(object):
+    """One row of the varbinds table, as entered or stored in a notification file"""
+    __slots__ = ('oid', 'datatype', 'data')
+
+    def __init__(self, oid, datatype, data):
+        self.oid = oid
+        self.datatype = datatype  # OID_TYPES key, as text in notification files
+        self.data = data
+
+    def row(self):
+        """Return the [oid, datatype, data] row stored in notification files"""
+        return [self.oid, str(self.datatype), self.data]
+
+    def pysnmp(self, row=0):
+        """Return the PySNMP (oid, value) varbind, raising ValueError if invalid"""
+        oid = self.oid.strip()
+        try:
+            data = str(self.data.strip())
+        except UnicodeError:
+            raise ValueError('Varbind row %s contains an invalid data value.' % str(row + 1))
+        if character_test(oid, '0123456789.'):
+            oid = str(oid)  # pyasn1 on Python 2 only parses dotted OIDs given as str
+        return build_varbind(oid, self.datatype, data, row)
+
+    def snmptrap(self, row=0, quote=quote_default):
+        """Return the snmptrap arguments for the varbind, raising ValueError if invalid"""
+        oid = self.oid.strip()
+        if ' ' in oid:
+            raise ValueError('OID in varbind row %s contains multiple values.' % str(row + 1))
+        return '%s %s %s' % (oid, OID_TYPES[int(self.datatype)][1], quote(self.data.strip()))
+
+
+class Notification(object):
+    """Notification fields independent of the GUI, as stored in notification files
+
+    Combobox fields hold the selected index, the same as notification
+    files.  The uptime in TimeTicks is only used by snmptrap commands.
+    """
+    __slots__ = NTF_FIELDS + ('uptime',)
+
+    def __init__(self, notification_type=1, community_string='', agent_address='', destination_address='',
+                 source_oid='', generic_trap_type=6, specific_trap_type='', security_name='', context_name='',
+                 auth_protocol=0, auth_key='', priv_protocol=0, priv_key='', varbinds=(), uptime=0):
+        """Executed when the Notification() object is created"""
+        self.notification_type = notification_type
+        self.community_string = community_string
+        self.agent_address = agent_address
+        self.destination_address = destination_address
+        self.source_oid = source_oid
+        self.generic_trap_type = generic_trap_type
+        self.specific_trap_type = specific_trap_type
+        self.security_name = security_name
+        self.context_name = context_name
+        self.auth_protocol = auth_protocol
+        self.auth_key = auth_key
+        self.priv_protocol = priv_protocol
+        self.priv_key = priv_key
+        self.varbinds = [varbind if isinstance(varbind, Varbind) else Varbind(*varbind) for varbind in varbinds]
+        self.uptime = uptime
+
+    @classmethod
+    def from_ntf(cls, ntf):
+        """Return a Notification from a notification file dictionary or shelf"""
+        fields = dict((key, ntf[key]) for key in NTF_FIELDS)
+        return cls(uptime=ntf.get('uptime', 0), **fields)
+
+    @classmethod
+    def from_dict(cls, fields):
+        """Return a Notification from a dictionary of notification file fields, such as decoded JSON
+
+        Unlike from_ntf, missing fields take their defaults, and combobox
+        fields and varbind data types may be given as their text (for
+        example "SNMPv2c Inform", "SHA-1" or "Counter32") as well as by
+        index.  Raises ValueError if a field or value is not recognized.
+        """
+        if not isinstance(fields, dict):
+            raise ValueError('Notification must be an object of notification file fields.')
+        unknown = sorted(set(fields) - set(cls.__slots__))
+        if unknown:
+            raise ValueError('Unknown notification field: %s' % ', '.join(unknown))
+        fields = dict(fields)
+        indexes = (('notification_type', NOTIFICATION_TYPES), ('generic_trap_type', GENERIC_TRAP_TYPES),
+                   ('auth_protocol', AUTH_PROTOCOLS), ('priv_protocol', PRIV_PROTOCOLS))
+        for key, names in indexes:
+            value = fields.get(key)
+            if value is None:
+                continue
+            if isinstance(value, TEXT_TYPES) and value in names:
+                fields[key] = names.index(value)
+                continue
+            if key == 'generic_trap_type' and isinstance(value, TEXT_TYPES) and value.isdigit():
+                value = int(value)
+            if isinstance(value, numbers.Integral) and not isinstance(value, bool) and 0 <= value < len(names):
+                fields[key] = int(value)
+            else:
+                raise ValueError('Value of %s is not valid: %s' % (key, value))
+        for key in cls.__slots__:
+            value = fields.get(key)
+            if key == 'varbinds' or key in dict(indexes) or value is None or isinstance(value, TEXT_TYPES):
+                continue
+            if isinstance(value, numbers.Number) and not isinstance(value, bool):
+                fields[key] = str(value)  # e.g. a specific trap type given as a JSON number
+            else:
+                raise ValueError('Value of %s is not valid: %s' % (key, value))
+        datatypes = {}
+        for key, (name, letter) in OID_TYPES.items():
+            datatypes[name] = datatypes[letter] = datatypes[str(key)] = datatypes[key] = str(key)
+        if not isinstance(fields.get('varbinds') or [], (list, tuple)):
+            raise ValueError('Varbinds must be a list of [oid, data type, data] lists.')
+        varbinds = []
+        for row, varbind in enumerate(fields.get('varbinds') or ()):
+            try:
+                oid, datatype, data = varbind
+                datatype = datatypes[datatype]
+                if not isinstance(oid, TEXT_TYPES):
+                    raise TypeError
+            except (TypeError, ValueError, KeyError):
+                raise ValueError('Varbind row %s must be an [oid, data type, data] list.' % str(row + 1))
+            if isinstance(data, numbers.Number) and not isinstance(data, bool):
+                data = str(data)  # JSON numbers, the natural form of Integer, Counter32 and such
+            elif not isinstance(data, TEXT_TYPES):
+                raise ValueError('Varbind row %s contains an invalid data value.' % str(row + 1))
+            varbinds.append(Varbind(oid, datatype, data))
+        fields['varbinds'] = varbinds
+        return cls(**fields)
+
+    @classmethod
+    def open(cls, filename):
+        """Return the Notification saved in a notification file"""
+        return cls.from_ntf(open_ntf(filename))
+
+    def to_ntf(self):
+        """Return the notification file dictionary of the notification"""
+        ntf = dict((key, getattr(self, key)) for key in NTF_FIELDS)
+        ntf['varbinds'] = [varbind.row() for varbind in self.varbinds]
+        return ntf
+
+    def save(self, filename):
+        """Save the notification to a notification file"""
+        save_ntf(filename, self.to_ntf())
+
+    def copy(self, **changes):
+        """Return a copy of the notification with some fields changed, sharing the Varbinds"""
+        fields = dict((key, getattr(self, key)) for key in self.__slots__)
+        fields.update(changes)
+        return Notification(**fields)
+
+    @property
+    def version(self):
+        """'SNMPv1', 'SNMPv2c' or 'SNMPv3'"""
+        return NOTIFICATION_TYPES[self.notification_type].split()[0]
+
+    @property
+    def inform(self):
+        """True for InformRequests; False for Traps or an invalid notification type"""
+        try:
+            return 'Inform' in NOTIFICATION_TYPES[self.notification_type]
+        except (IndexError, TypeError):
+            return False
+
+    def compile(self, resolve=True, pysnmp=True, metrics=None):
+        """Validate the notification and convert it to a SendPlan, raising ValueError if invalid
+
+        resolve looks up the destination and agent addresses, and pysnmp
+        converts the varbinds to PySNMP values; snmptrap commands run on
+        another host need neither.  metrics, if given, records the validate,
+        dns and varbinds stages.
+        """
+        return SendPlan(self, resolve, pysnmp, metrics)
+
+
+class SendPlan(object):
+    """A validated Notification with its values converted once, ready to send"""
+    __slots__ = ('notification', 'notification_type', 'version', 'pdu', 'snmp_model', 'transport', 'host', 'port',
+                 'agent_address', 'source_oid', 'trap_oid', 'enterprise_oid', 'specific_trap_type',
+                 'auth_protocol', 'priv_protocol', 'varbinds')
+
+    def __init__(self, notification, resolve=True, pysnmp=True, metrics=None):
+        """Executed when the SendPlan() object is created, by Notification.compile()"""
+        stage_started = timer()
+        self.notification = notification
+        try:
+            self.notification_type = NOTIFICATION_TYPES[notification.notification_type]
+            auth_protocol = AUTH_PROTOCOLS[notification.auth_protocol]
+            priv_protocol = PRIV_PROTOCOLS[notification.priv_protocol]
+        except (IndexError, TypeError):
+            raise ValueError('Notification type or protocol is not valid.')
+        self.version = self.notification_type.split()[0]
+        self.pdu = 'inform' if 'Inform' in self.notification_type else 'trap'
+        generic_trap_type = notification.generic_trap_type
+        self.specific_trap_type = notification.specific_trap_type or SPECIFIC_TRAP_TYPE
+        self.source_oid = check_notification(self.notification_type, notification.community_string,
+                                             notification.agent_address, notification.destination_address,
+                                             notification.source_oid, generic_trap_type, self.specific_trap_type,
+                                             notification.security_name, auth_protocol, notification.auth_key,
+                                             priv_protocol, notification.priv_key)
+
+        self.transport, self.host, self.port = parse_destination(notification.destination_address)
+        self.agent_address = notification.agent_address
+
+        # If using SNMPv1, integrate the generic and specific trap types into the trap OID,
+        # and separate the enterprise OID
+        if self.version == 'SNMPv1':
+            self.snmp_model = 0
+            enterprise_oid = self.source_oid
+            if generic_trap_type < 6:
+                trap_oid = '1.3.6.1.6.3.1.1.5.%s' % (generic_trap_type + 1)
+            else:
+                trap_oid = '%s.0.%s' % (enterprise_oid, self.specific_trap_type)
+        else:
+            self.snmp_model = 1 if self.version == 'SNMPv2c' else None
+            enterprise_oid = ''
+            trap_oid = self.source_oid
+        # Avoid "pyasn1.error.PyAsn1Error: Invalid sub-ID" exception by converting OIDs to string
+        self.trap_oid = str(trap_oid)
+        self.enterprise_oid = str(enterprise_oid)
+
+        self.auth_protocol = USM_AUTH_PROTOCOLS.get(auth_protocol)
+        self.priv_protocol = USM_PRIV_PROTOCOLS.get(priv_protocol) if self.auth_protocol else None
+        if metrics:
+            metrics.observe('validate', timer() - stage_started)
+
+        # Resolve host DNS, checking address validity in the process
+        if resolve:
+            stage_started = timer()
+            try:
+                self.host = socket.gethostbyname(self.host)
+            except (socket.error, UnicodeError):
+                raise ValueError('Destination address is not valid.')
+            try:
+                self.agent_address = socket.gethostbyname(self.agent_address)
+            except (socket.error, UnicodeError):
+                raise ValueError('Agent address is not valid.')
+            if metrics:
+                metrics.observe('dns', timer() - stage_started)
+
+        self.varbinds = None
+        if pysnmp:
+            stage_started = timer()
+            self.varbinds = [varbind.pysnmp(row) for row, varbind in enumerate(notification.varbinds)]
+            if metrics:
+                metrics.observe('varbinds', timer() - stage_started)
+
+    def transport_target(self):
+        """Return the ntforg UDP transport target of the destination"""
+        return ntforg.UdpTransportTarget((self.host, self.port))
+
+    def authentication(self, credential=None):
+        """Return the ntforg CommunityData or UsmUserData, optionally for another community or user"""
+        notification = self.notification
+        if self.snmp_model is not None:
+            return ntforg.CommunityData(credential or notification.community_string, mpModel=self.snmp_model)
+        security_name = credential or notification.security_name
+        if self.auth_protocol is None:  # No authentication, no privacy
+            return ntforg.UsmUserData(security_name)
+        if self.priv_protocol is None:  # Authentication, no privacy
+            return ntforg.UsmUserData(security_name, notification.auth_key, authProtocol=self.auth_protocol)
+        return ntforg.UsmUserData(security_name, notification.auth_key, notification.priv_key,
+                                  authProtocol=self.auth_protocol, privProtocol=self.priv_protocol)
+
+    def standard_varbinds(self):
+        """Return the standard varbinds PySNMP needs appended (SNMPv1 only)"""
+        if self.version != 'SNMPv1':
+            return []
+        return [('1.3.6.1.2.1.1.3.0', 0),                       # SNMPv1 Time Stamp / Uptime (always zero)
+                ('1.3.6.1.6.3.18.1.3.0', self.agent_address),   # SNMPv1 Agent Address
+                ('1.3.6.1.6.3.1.1.4.3.0', self.enterprise_oid)]  # SNMPv1 Enterprise OID
+
+    def snmptrap_options(self, uptime=None, quote=None):
+        """Return the snmptrap options string, with fields quoted by quote if given; raises ValueError"""
+        notification = self.notification
+        return snmptrap_options(self.notification_type, notification.community_string, self.agent_address,
+                                notification.destination_address, self.source_oid, notification.generic_trap_type,
+                                self.specific_trap_type, notification.security_name, notification.context_name,
+                                AUTH_PROTOCOLS[notification.auth_protocol], notification.auth_key,
+                                PRIV_PROTOCOLS[notification.priv_protocol], notification.priv_key,
+                                notification.uptime if uptime is None else uptime, quote)
+
+    def snmptrap_arguments(self, uptime=None, quote=quote_default):
+        """Return the snmptrap options and varbind arguments, every field quoted by quote; raises ValueError"""
+        options = self.snmptrap_options(uptime, quote)
+        varbinds = snmptrap_varbinds(self.notification.varbinds, quote)
+        if varbinds:
+            return '%s %s' % (options, varbinds)
+        return options
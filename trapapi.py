@@ -0,0 +1,576 @@
+#!/usr/bin/env python
+"""
+trapapi.py - Misner Trap Tool local HTTP/JSON send service
+Copyright (C) 2015-2017 Joe Misner <joe@misner.net>
+http://tools.misner.net/
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software Foundation,
+Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+Accepts notifications as JSON over HTTP on localhost and sends them from
+a pool of sender threads, each holding one long-lived PySNMP engine
+which is warmed up with a throwaway send before the first request
+arrives.  Submissions go into a bounded queue; a batch which does not
+fit is refused with 503 so clients can back off, rather than piling up
+in memory.
+
+Endpoints:
+- POST /notifications          queue one notification object, a list of
+                               them, or {"defaults": {...},
+                               "notifications": [...]}; returns a job ID
+- POST /notifications?wait=1   as above, but responds once every
+                               notification of the job has been sent,
+                               or with 202 and the job if still pending
+                               after WAIT_TIMEOUT seconds
+- GET /jobs/ID                 per-notification results of a job
+- GET /stats                   queue depth, sends in progress and send counters
+
+Notification objects use the notification file field names; see
+Notification.from_dict() in notification.py.
+
+Notifications are sent fairly across destinations within the flow
+limits set by --rate, --burst, --max-inflight and --limit; see trapflow.py.
+
+python trapapi.py [--bind ADDRESS] [--port PORT] [--senders N] [--queue N]
+                  [--rate N] [--burst N] [--max-inflight N]
+                  [--limit DEST=RATE[,BURST[,INFLIGHT]]] [--no-adaptive]
+                  [--history history.sqlite]
+"""
+
+import sys
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+from collections import OrderedDict
+try:
+    import queue
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+except ImportError:
+    import Queue as queue
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+from pysnmp.entity import engine, config
+from pysnmp.entity.rfc3413 import context
+from pysnmp.entity.rfc3413.oneliner import ntforg
+from pysnmp.error import PySnmpError
+from notification import Notification, error_indication, timer
+import trapflow
+import traphistory
+import traptcp
+
+API_ADDRESS = '127.0.0.1'
+API_PORT = 8162
+SENDERS = 4                   # Sender threads, each with its own PySNMP engine
+QUEUE_SIZE = 10000            # Notifications waiting to be sent
+MAX_BATCH = 10000             # Notifications per submission
+MAX_BODY = 16 * 1024 * 1024   # Bytes per submission
+JOB_HISTORY = 1000            # Finished and pending jobs kept for GET /jobs/ID
+WAIT_TIMEOUT = 60             # Seconds a ?wait=1 submission waits for its job
+RETRY_AFTER = 1               # Seconds clients are asked to back off when the queue is full
+TCP_SEND_TIMEOUT = 5
+
+WARM_UP_OID = '1.3.6.1.6.3.1.1.5.1'  # coldStart
+
+
+class SenderError(Exception):
+    """Raised by SendService() when sender threads are unable to set up their engines"""
+
+def parse_submission(document):
+    """Return the Notifications of a decoded JSON submission, raising ValueError if any is invalid"""
+    defaults = {}
+    items = document
+    if isinstance(document, dict) and 'notifications' in document:
+        defaults = document.get('defaults') or {}
+        items = document['notifications']
+        if not isinstance(defaults, dict):
+            raise ValueError('Defaults must be an object of notification file fields.')
+    elif isinstance(document, dict):
+        items = [document]
+    if not isinstance(items, list) or not items:
+        raise ValueError('Submission must be a notification object or a non-empty list of them.')
+    if len(items) > MAX_BATCH:
+        raise ValueError('Submission contains more than %s notifications.' % MAX_BATCH)
+    notifications = []
+    for index, item in enumerate(items):
+        fields = dict(defaults)
+        if isinstance(item, dict):
+            fields.update(item)
+        else:
+            fields = item
+        try:
+            notifications.append(Notification.from_dict(fields))
+        except ValueError as e:
+            raise ValueError('Notification %s: %s' % (index, e))
+    return notifications
+
+
+class Job(object):
+    """A submitted batch of notifications and the result of each"""
+    def __init__(self, job_id, count):
+        """Executed when the Job() object is created"""
+        self.id = job_id
+        self.submitted = time.time()
+        self.results = [None] * count  # (error or None, seconds) once sent
+        self.remaining = count
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def complete(self, index, error, seconds):
+        """Record the result of one notification of the job"""
+        with self.lock:
+            self.results[index] = (error, seconds)
+            self.remaining -= 1
+            finished = not self.remaining
+        if finished:
+            self.done.set()
+
+    def to_dict(self):
+        """Return the job status and per-notification results, for JSON responses"""
+        with self.lock:
+            results = list(self.results)
+            remaining = self.remaining
+        entries = []
+        errors = 0
+        for index, result in enumerate(results):
+            if result is None:
+                entries.append({'index': index, 'status': 'queued'})
+                continue
+            error, seconds = result
+            entry = {'index': index, 'status': 'error' if error else 'sent', 'seconds': round(seconds, 6)}
+            if error:
+                entry['error'] = error
+                errors += 1
+            entries.append(entry)
+        return {'job': self.id, 'status': 'pending' if remaining else 'done', 'count': len(results),
+                'sent': len(results) - remaining - errors, 'errors': errors, 'results': entries}
+
+
+class EngineSender(object):
+    """Sends Notifications through one long-lived PySNMP engine, owned by a single sender thread"""
+    def __init__(self, tcp_pool, metrics=None):
+        """Executed when the EngineSender() object is created"""
+        self.tcp_pool = tcp_pool
+        self.metrics = metrics
+        self.snmpEngine = engine.SnmpEngine()
+        self.snmpContext = context.SnmpContext(self.snmpEngine)
+        self.context_names = set()
+        self.context_users = set()
+        self.ntfOrg = ntforg.NotificationOriginator(self.snmpEngine, self.snmpContext)
+        self.warm_up()
+
+    def warm_up(self):
+        """Send one trap to a throwaway local socket, so the engine's first-send setup is not paid by a request
+
+        An engine's first send loads MIB modules and sets up its
+        transport, which takes far longer than any later send.
+        """
+        sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sink.bind(('127.0.0.1', 0))
+            self.ntfOrg.sendNotification(ntforg.CommunityData('warm-up', mpModel=1),
+                                         ntforg.UdpTransportTarget(sink.getsockname()), 'trap', WARM_UP_OID)
+        finally:
+            sink.close()
+
+    def send(self, notification):
+        """Send one Notification, returning (error message or None once sent, congestion)
+
+        congestion is trapflow.TIMEOUT or trapflow.UNREACHABLE when the
+        destination should be slowed down, otherwise None.
+        """
+        destination_address = notification.destination_address
+        try:
+            plan = notification.compile(metrics=self.metrics)
+            if plan.transport == 'tcp':
+                return self.send_tcp(plan)
+            send_options = {}
+            authentication = plan.authentication()
+            context_name = notification.context_name
+            if context_name != '' and plan.version == 'SNMPv3':  # Custom context name when using SNMPv3
+                if context_name not in self.context_names:
+                    self.snmpContext.registerContextName(context_name, self.snmpContext.getMibInstrum())
+                    self.context_names.add(context_name)
+                # PySNMP only allows a user to notify in the default context, and silently drops
+                # notifications with varbinds in any other
+                user = (context_name, authentication.securityName, authentication.securityLevel)
+                if user not in self.context_users:
+                    config.addVacmUser(self.snmpEngine, authentication.securityModel, authentication.securityName,
+                                       authentication.securityLevel, notifySubTree=(1, 3, 6), contextName=context_name)
+                    self.context_users.add(user)
+                send_options['contextName'] = context_name
+            varbinds = plan.varbinds + plan.standard_varbinds()
+            errorIndication = error_indication(self.ntfOrg.sendNotification(authentication,
+                                                                            plan.transport_target(), plan.pdu,
+                                                                            plan.trap_oid, *varbinds,
+                                                                            **send_options))
+        except ValueError as e:
+            return str(e), None
+        except Exception as e:  # Report it as this notification's result rather than lose the sender thread
+            name = '' if isinstance(e, PySnmpError) else '%s: ' % type(e).__name__
+            return ('Exception while sending notification: %s%s' % (name, e),
+                    trapflow.UNREACHABLE if trapflow.unreachable(e) else None)
+        if errorIndication:
+            if plan.pdu == 'inform' and str(errorIndication) == 'No SNMP response received before timeout':
+                if self.metrics:
+                    self.metrics.increment('inform_timeouts')
+                return ('InformRequest packet received no acknowledgment from %s.' % destination_address,
+                        trapflow.TIMEOUT)
+            return ('Error building notification: %s' % errorIndication,
+                    trapflow.UNREACHABLE if trapflow.unreachable(errorIndication) else None)
+        return None, None
+
+    def send_tcp(self, plan):
+        """Send a compiled notification over the shared TCP pool, returning (error message or None, congestion)
+
+        Traps count as sent once written to the destination's connections
+        within TCP_SEND_TIMEOUT; InformRequests once acknowledged.  On
+        failure the messages queued to the destination are discarded, and
+        a destination refusing connections is reported as unreachable.
+        """
+        sender = traptcp.TcpNotificationSender(self.tcp_pool, plan)
+        destination_address = plan.notification.destination_address
+        try:
+            request_id = sender.send(timeout=TCP_SEND_TIMEOUT)
+        except ValueError as e:
+            error = str(e)
+        else:
+            if plan.pdu != 'inform':
+                if self.tcp_pool.flush(TCP_SEND_TIMEOUT, sender.address):
+                    return None, None
+                last_error = self.tcp_pool.last_error(sender.address)
+                if last_error:
+                    error = 'Unable to connect to %s over TCP: %s' % (destination_address, last_error)
+                else:
+                    error = 'Notification to %s was not written over TCP within %s seconds.' \
+                            % (destination_address, TCP_SEND_TIMEOUT)
+            elif self.tcp_pool.wait([request_id], traptcp.INFORM_TIMEOUT):
+                if self.metrics:
+                    self.metrics.increment('inform_timeouts')
+                error = 'InformRequest packet received no acknowledgment from %s.' % destination_address
+            else:
+                return None, None
+        refused = trapflow.unreachable(self.tcp_pool.last_error(sender.address))
+        self.tcp_pool.discard(sender.address)
+        return error, trapflow.UNREACHABLE if refused else trapflow.TIMEOUT
+
+
+class SendService(object):
+    """A bounded queue of notifications drained by a pool of sender threads
+
+    The queue is a trapflow.FlowScheduler, which takes destinations in
+    turn and holds each to its flow limits; destination_limits maps
+    destination addresses to their own FlowLimits.  With a traphistory
+    HistoryWriter, every send is recorded with the given origin.
+    """
+    def __init__(self, senders=SENDERS, queue_size=QUEUE_SIZE, metrics=None, limits=None, destination_limits=None,
+                 history=None, origin='api'):
+        """Executed when the SendService() object is created; starts the sender threads"""
+        if senders < 1:
+            raise ValueError('At least one sender is required.')
+        if queue_size < 1:
+            raise ValueError('Queue size must be at least 1.')
+        # Unless limited otherwise, InformRequests to one destination may hold at most half the senders
+        self.queue = trapflow.FlowScheduler(queue_size, self.classify, limits, destination_limits,
+                                            max(senders // 2, 1))
+        self.metrics = metrics
+        self.history = history
+        self.origin = origin
+        self.tcp_pool = traptcp.TcpPool()
+        self.jobs = OrderedDict()
+        self.job_id = 0
+        self.lock = threading.Lock()
+        self.put_lock = threading.Lock()
+        self.counters = dict.fromkeys(('submitted', 'rejected', 'sent', 'errors'), 0)
+        self.sending = 0  # Taken from the queue by a sender and not yet sent
+        self.started = time.time()
+        self.threads = []
+        self.start_errors = []
+        ready = []
+        for _ in range(senders):
+            warmed_up = threading.Event()
+            thread = threading.Thread(target=self.sender_loop, args=(warmed_up,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+            ready.append(warmed_up)
+        for warmed_up in ready:
+            warmed_up.wait()
+        if self.start_errors:
+            self.stop()  # A pool missing senders would leave notifications queued forever
+            raise SenderError('Unable to start %s of %s senders: %s'
+                              % (len(self.start_errors), senders, self.start_errors[0]))
+
+    def submit(self, notifications):
+        """Queue a batch of Notifications as a new Job
+
+        Raises queue.Full, queuing none of them, if the batch does not fit
+        in the queue right now.
+        """
+        if len(notifications) > self.queue.maxsize:
+            raise ValueError('Batch of %s notifications is larger than the send queue.' % len(notifications))
+        with self.put_lock:
+            # The queue is only added to while holding put_lock, so the room found here can only grow
+            if self.queue.qsize() + len(notifications) > self.queue.maxsize:
+                with self.lock:
+                    self.counters['rejected'] += len(notifications)
+                raise queue.Full
+            with self.lock:
+                self.job_id += 1
+                job = Job(str(self.job_id), len(notifications))
+                self.jobs[job.id] = job
+                while len(self.jobs) > JOB_HISTORY:
+                    self.jobs.popitem(last=False)
+                self.counters['submitted'] += len(notifications)
+            for index, notification in enumerate(notifications):
+                self.queue.put_nowait((job, index, notification))
+        return job
+
+    def put(self, notification, job, index=0):
+        """Queue one notification, blocking while the queue is full so a fast producer is held back
+
+        A sender thread calls job.complete(index, error, seconds) once the
+        notification has been sent; job need not be a Job.
+        """
+        with self.put_lock:
+            self.queue.put((job, index, notification))
+        with self.lock:
+            self.counters['submitted'] += 1
+
+    @staticmethod
+    def classify(item):
+        """Return the (destination address, is InformRequest) of a queued item, for the scheduler"""
+        notification = item[2]
+        return notification.destination_address, notification.inform
+
+    def job(self, job_id):
+        """Return a submitted Job by ID, or None if unknown or expired"""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def sender_loop(self, warmed_up):
+        """Sender thread; sends queued notifications through its own engine until the queue is closed"""
+        try:
+            sender = EngineSender(self.tcp_pool, self.metrics)
+        except Exception as e:  # Raised from SendService() once every sender has started or failed
+            with self.lock:
+                self.start_errors.append(e)
+            return
+        finally:
+            warmed_up.set()
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            job, index, notification = item
+            with self.lock:
+                self.sending += 1
+            started = timer()
+            error, congestion = sender.send(notification)
+            seconds = timer() - started
+            self.queue.done(item, congestion)
+            with self.lock:
+                self.sending -= 1
+                self.counters['errors' if error else 'sent'] += 1
+            if self.metrics:
+                self.metrics.increment('errors' if error else 'sends')
+            if self.history:
+                self.history.record(notification, error, seconds, self.origin)
+            job.complete(index, error, seconds)
+
+    def stats(self):
+        """Return the queue depth, sends in progress and send counters"""
+        with self.lock:
+            stats = dict(self.counters)
+            stats['jobs'] = len(self.jobs)
+            stats['sending'] = self.sending
+        stats['queued'] = self.queue.qsize()
+        stats['queue_size'] = self.queue.maxsize
+        stats['senders'] = len(self.threads)
+        stats['uptime'] = round(time.time() - self.started, 3)
+        stats['destinations'] = self.queue.stats()
+        return stats
+
+    def stop(self, discard=False):
+        """Send what is queued, then stop the sender threads and close TCP connections
+
+        With discard, queued notifications are dropped rather than sent,
+        without their jobs being told, and only the sends in progress are
+        waited for.  Returns the number of notifications dropped.
+        """
+        discarded = self.queue.clear() if discard else 0
+        self.queue.close()
+        for thread in self.threads:
+            thread.join()
+        self.tcp_pool.close()
+        return discarded
+
+
+class ApiRequestHandler(BaseHTTPRequestHandler):
+    """Handles the JSON endpoints of an ApiServer"""
+    protocol_version = 'HTTP/1.1'  # Keep-alive, so busy clients reuse one connection
+    disable_nagle_algorithm = True
+    server_version = 'MisnerTrapTool'
+
+    def log_message(self, format, *args):
+        """Pass request log lines to the server's log callback rather than stderr"""
+        if self.server.log:
+            self.server.log('%s %s' % (self.address_string(), format % args))
+
+    def send_json(self, status, document, headers=()):
+        """Write a JSON response"""
+        body = json.dumps(document, sort_keys=True).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """GET /jobs/ID or /stats"""
+        path = self.path.split('?', 1)[0].rstrip('/')
+        service = self.server.service
+        if path == '/stats':
+            self.send_json(200, service.stats())
+        elif path.startswith('/jobs/'):
+            job = service.job(path[len('/jobs/'):])
+            if job is None:
+                self.send_json(404, {'error': 'Unknown job.'})
+            else:
+                self.send_json(200, job.to_dict())
+        else:
+            self.send_json(404, {'error': 'Not found.'})
+
+    def do_POST(self):
+        """POST /notifications"""
+        path, _, query = self.path.partition('?')
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0 or length > MAX_BODY:
+            self.close_connection = True
+            self.send_json(413 if length > 0 else 400, {'error': 'Request body length is not valid.'})
+            return
+        body = self.rfile.read(length)
+        if path.rstrip('/') != '/notifications':
+            self.send_json(404, {'error': 'Not found.'})
+            return
+        try:
+            notifications = parse_submission(json.loads(body.decode('utf-8')))
+            job = self.server.service.submit(notifications)
+        except ValueError as e:  # Includes invalid JSON and UTF-8
+            self.send_json(400, {'error': str(e)})
+            return
+        except queue.Full:
+            self.send_json(503, {'error': 'Send queue is full; retry later.'}, [('Retry-After', str(RETRY_AFTER))])
+            return
+        if parse_qs(query).get('wait', ['0'])[-1] not in ('0', ''):
+            job.done.wait(WAIT_TIMEOUT)
+            if job.done.is_set():
+                self.send_json(200, job.to_dict())
+            else:
+                self.send_json(202, job.to_dict(), [('Location', '/jobs/%s' % job.id)])
+        else:
+            self.send_json(202, {'job': job.id, 'count': len(notifications), 'status': 'pending'},
+                           [('Location', '/jobs/%s' % job.id)])
+
+
+class ApiServer(ThreadingMixIn, HTTPServer):
+    """Localhost HTTP server in front of a SendService"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=(API_ADDRESS, API_PORT), senders=SENDERS, queue_size=QUEUE_SIZE,
+                 metrics=None, log=None, limits=None, destination_limits=None, history=None):
+        """Executed when the ApiServer() object is created; binds the address and starts the senders"""
+        HTTPServer.__init__(self, address, ApiRequestHandler)
+        self.address = self.server_address[:2]
+        self.log = log
+        try:
+            self.service = SendService(senders, queue_size, metrics, limits, destination_limits, history)
+        except Exception:
+            self.server_close()
+            raise
+        self.thread = None
+
+    def start(self):
+        """Serve requests in a background thread"""
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop accepting requests, send what is queued and release the port"""
+        if self.thread:
+            self.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.server_close()
+        self.service.stop()
+
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description='Send notifications submitted as JSON over a local HTTP API.')
+    parser.add_argument('--bind', default=API_ADDRESS, help='address to listen on (default %(default)s)')
+    parser.add_argument('--port', type=int, default=API_PORT, help='port to listen on (default %(default)s)')
+    parser.add_argument('--senders', type=int, default=SENDERS,
+                        help='sender threads, each with its own engine (default %(default)s)')
+    parser.add_argument('--queue', type=int, default=QUEUE_SIZE,
+                        help='notifications waiting to be sent (default %(default)s)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log each request to standard error')
+    parser.add_argument('--history', metavar='FILE', help='record every send in this history database')
+    trapflow.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    log = None
+    if args.verbose:
+        log = lambda line: sys.stderr.write(line + '\n')
+    history = None
+    try:
+        if args.history:
+            history = traphistory.HistoryWriter(args.history)
+            history.start()
+        limits, destination_limits = trapflow.limits_from_arguments(args)
+        server = ApiServer((args.bind, args.port), args.senders, args.queue, log=log,
+                           limits=limits, destination_limits=destination_limits, history=history)
+    except (ValueError, EnvironmentError, sqlite3.Error, SenderError) as e:
+        print('Error: %s' % e)
+        if history:
+            history.stop()
+        return 1
+    print('Listening on http://%s:%s/ with %s senders' % (server.address[0], server.address[1], args.senders))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    server.service.stop()
+    if history:
+        history.stop()
+    stats = server.service.stats()
+    print('%s sent, %s errors, %s rejected' % (stats['sent'], stats['errors'], stats['rejected']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,432 @@
+#!/usr/bin/env python
+"""
+trapbench.py - Misner Trap Tool benchmark suite
+Copyright (C) 2015-2017 Joe Misner <joe@misner.net>
+http://tools.misner.net/
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software Foundation,
+Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+Benchmarks the build, encode and send hot paths separately: field
+validation, varbind construction per OID type, PDU encoding per SNMP
+version, engine sends per security level, notification file load/save
+and loopback trap/inform throughput, along with the fast BER encoder in
+trapber.py for each PDU shape.  Results are written as JSON, and
+a previous results file can be compared against to catch regressions.
+
+python trapbench.py [-o results.json] [--compare baseline.json]
+                    [--threshold PERCENT] [--filter NAME] [--quick]
+"""
+
+import os
+import sys
+import json
+import socket
+import shutil
+import argparse
+import platform
+import tempfile
+import time
+from pysnmp import __version__ as pysnmp_version
+from pysnmp.proto import api, rfc1902
+from pysnmp.proto.mpmod.rfc3412 import ScopedPDU
+from pysnmp.entity.rfc3413.oneliner import ntforg
+from pyasn1.codec.ber import encoder
+from pyasn1.type import univ
+from notification import OID_TYPES, timer, build_varbind, character_test, check_notification, open_ntf, save_ntf
+from notification import Notification
+import trapber
+import trapreceiver
+
+RESULTS_FORMAT = 1
+MIN_REPEAT_TIME = 0.2       # Seconds each timed repeat should run for at least
+REPEATS = 5
+QUICK_REPEATS = 2
+LOOPBACK_COUNT = 2000
+QUICK_LOOPBACK_COUNT = 200
+DEFAULT_THRESHOLD = 10.0    # Percent slowdown reported as a regression
+
+SAMPLE_SOURCE_OID = '1.3.6.1.4.1.3.1.1'
+SAMPLE_VARBINDS = {
+    'Integer':     ('1.3.6.1.4.1.3.1.1.1.1', '-42'),
+    'Unsigned':    ('1.3.6.1.4.1.3.1.1.1.2', '42'),
+    'Counter32':   ('1.3.6.1.4.1.3.1.1.1.3', '4294967295'),
+    'String':      ('1.3.6.1.4.1.3.1.1.1.4', 'Link to core switch went down on port 24'),
+    'Null Object': ('1.3.6.1.4.1.3.1.1.1.5', ''),
+    'OID':         ('1.3.6.1.4.1.3.1.1.1.6', '1.3.6.1.2.1.2.2.1.1.24'),
+    'Time Ticks':  ('1.3.6.1.4.1.3.1.1.1.7', '123456789'),
+    'IP Address':  ('1.3.6.1.4.1.3.1.1.1.8', '192.168.1.10')
+}
+SECURITY_LEVELS = {
+    'noauth':      (None, None),
+    'md5':         (ntforg.usmHMACMD5AuthProtocol, None),
+    'sha':         (ntforg.usmHMACSHAAuthProtocol, None),
+    'md5_des':     (ntforg.usmHMACMD5AuthProtocol, ntforg.usmDESPrivProtocol),
+    'sha_aes128':  (ntforg.usmHMACSHAAuthProtocol, ntforg.usmAesCfb128Protocol)
+}
+SAMPLE_KEY = 'benchmark-key'
+ENCODE_SHAPES = ('v1_trap', 'v2c_trap', 'v2c_inform', 'v3_scoped_pdu')
+
+
+def sample_varbinds():
+    """Return one PySNMP varbind of each OID type"""
+    names = dict((OID_TYPES[key][0], key) for key in OID_TYPES)
+    return [build_varbind(oid, names[name], data) for name, (oid, data) in sorted(SAMPLE_VARBINDS.items())]
+
+
+def sample_ntf():
+    """Return a notification file dictionary with one varbind of each OID type"""
+    names = dict((OID_TYPES[key][0], key) for key in OID_TYPES)
+    return {
+        'notification_type': 1, 'community_string': 'public', 'agent_address': '127.0.0.1',
+        'destination_address': 'localhost:162', 'source_oid': SAMPLE_SOURCE_OID, 'generic_trap_type': 6,
+        'specific_trap_type': '1', 'security_name': '', 'context_name': '', 'auth_protocol': 0,
+        'auth_key': '', 'priv_protocol': 0, 'priv_key': '',
+        'varbinds': [[oid, str(names[name]), data] for name, (oid, data) in sorted(SAMPLE_VARBINDS.items())]
+    }
+
+
+# PySNMP/pyasn1 message builders for the notification shapes this tool sends
+def v1_trap_message(varbinds, community='public', agent_address='127.0.0.1', uptime=0):
+    """Return an SNMPv1 Trap-PDU message"""
+    pMod = api.protoModules[api.protoVersion1]
+    pdu = pMod.TrapPDU()  # Every field is set below; PySNMP 4.3 apiTrapPDU.setDefaults() fails after its first call
+    pMod.apiTrapPDU.setEnterprise(pdu, univ.ObjectIdentifier(SAMPLE_SOURCE_OID))
+    pMod.apiTrapPDU.setAgentAddr(pdu, pMod.IpAddress(agent_address))
+    pMod.apiTrapPDU.setGenericTrap(pdu, 6)
+    pMod.apiTrapPDU.setSpecificTrap(pdu, 1)
+    pMod.apiTrapPDU.setTimeStamp(pdu, uptime)
+    pMod.apiTrapPDU.setVarBinds(pdu, varbinds)
+    message = pMod.Message()
+    pMod.apiMessage.setDefaults(message)
+    pMod.apiMessage.setCommunity(message, community)
+    pMod.apiMessage.setPDU(message, pdu)
+    return message
+
+
+def v2c_pdu(varbinds, inform=False, request_id=1, uptime=0):
+    """Return an SNMPv2-Trap-PDU or InformRequest-PDU with the standard leading varbinds"""
+    pMod = api.protoModules[api.protoVersion2c]
+    pdu = pMod.InformRequestPDU() if inform else pMod.SNMPv2TrapPDU()
+    pMod.apiPDU.setDefaults(pdu)
+    pMod.apiPDU.setRequestID(pdu, request_id)
+    pMod.apiPDU.setVarBinds(pdu, [('1.3.6.1.2.1.1.3.0', rfc1902.TimeTicks(uptime)),
+                                  ('1.3.6.1.6.3.1.1.4.1.0', univ.ObjectIdentifier(SAMPLE_SOURCE_OID + '.0.1'))]
+                                 + list(varbinds))
+    return pdu
+
+
+def v2c_message(varbinds, inform=False, community='public', request_id=1, uptime=0):
+    """Return an SNMPv2c Trap or InformRequest message"""
+    pMod = api.protoModules[api.protoVersion2c]
+    message = pMod.Message()
+    pMod.apiMessage.setDefaults(message)
+    pMod.apiMessage.setCommunity(message, community)
+    pMod.apiMessage.setPDU(message, v2c_pdu(varbinds, inform, request_id, uptime))
+    return message
+
+
+def v3_scoped_pdu(varbinds, inform=False, context_engine_id=trapreceiver.LOOPBACK_SENDER_ENGINE_ID,
+                  context_name='', request_id=1, uptime=0):
+    """Return an SNMPv3 scopedPDU carrying a Trap or InformRequest"""
+    pdu = v2c_pdu(varbinds, inform, request_id, uptime)
+    scoped_pdu = ScopedPDU()
+    scoped_pdu.setComponentByPosition(0, univ.OctetString(hexValue=context_engine_id))
+    scoped_pdu.setComponentByPosition(1, context_name)
+    scoped_pdu.setComponentByPosition(2)
+    try:
+        scoped_pdu.getComponentByPosition(2).setComponentByType(pdu.getTagSet(), pdu, verifyConstraints=False,
+                                                                matchTags=False, matchConstraints=False)
+    except TypeError:  # pyasn1 0.1, as used by PySNMP 4.3, matches neither
+        scoped_pdu.getComponentByPosition(2).setComponentByType(pdu.getTagSet(), pdu, verifyConstraints=False)
+    return scoped_pdu
+
+
+class UdpSink(object):
+    """Bound local UDP socket that notifications can be sent to without a receiver or ICMP errors"""
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.address = self.sock.getsockname()
+
+    def drain(self):
+        """Discard anything queued on the socket"""
+        self.sock.setblocking(False)
+        try:
+            while True:
+                self.sock.recv(65535)
+        except socket.error:
+            pass
+
+    def close(self):
+        self.sock.close()
+
+
+def measure(func, repeats=REPEATS):
+    """Time func, returning per-call seconds for each repeat of a calibrated iteration count"""
+    number = 1
+    while True:
+        started = timer()
+        for _ in range(number):
+            func()
+        elapsed = timer() - started
+        if elapsed >= MIN_REPEAT_TIME or number >= 1 << 24:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(MIN_REPEAT_TIME / elapsed) + 1))
+    times = [elapsed / number]
+    for _ in range(repeats - 1):
+        started = timer()
+        for _ in range(number):
+            func()
+        times.append((timer() - started) / number)
+    return times, number
+
+
+def summarize(times, number, unit='call'):
+    """Return the JSON result entry for a list of per-call times"""
+    best = min(times)
+    return {
+        'unit': unit,
+        'iterations': number,
+        'repeats': len(times),
+        'best_us': best * 1e6,
+        'mean_us': sum(times) / len(times) * 1e6,
+        'ops_per_sec': 1.0 / best if best else 0.0
+    }
+
+
+# Benchmark definitions; each returns a zero argument callable to be timed
+def bench_validate():
+    ntf = sample_ntf()
+    def run():
+        check_notification('SNMPv2c Trap', ntf['community_string'], ntf['agent_address'], ntf['destination_address'],
+                           ntf['source_oid'], 6, ntf['specific_trap_type'], '', 'None', '', 'None', '')
+        for oid, datatype, data in ntf['varbinds']:
+            character_test(oid, '0123456789.')
+    return run
+
+
+def bench_compile():
+    """Validation and varbind conversion of a Notification into a SendPlan, without DNS"""
+    notification = Notification.from_ntf(sample_ntf())
+    return lambda: notification.compile(resolve=False)
+
+
+def bench_varbind(name):
+    key = dict((OID_TYPES[k][0], k) for k in OID_TYPES)[name]
+    oid, data = SAMPLE_VARBINDS[name]
+    return lambda: build_varbind(oid, key, data)
+
+
+def bench_encode(shape):
+    varbinds = sample_varbinds()
+    if shape == 'v1_trap':
+        return lambda: encoder.encode(v1_trap_message(varbinds))
+    if shape == 'v2c_trap':
+        return lambda: encoder.encode(v2c_message(varbinds))
+    if shape == 'v2c_inform':
+        return lambda: encoder.encode(v2c_message(varbinds, inform=True))
+    if shape == 'v3_scoped_pdu':
+        return lambda: encoder.encode(v3_scoped_pdu(varbinds))
+
+
+def bench_fast_encode(shape):
+    varbinds = sample_varbinds()
+    if shape == 'v1_trap':
+        return lambda: trapber.v1_trap_message(varbinds)
+    if shape == 'v2c_trap':
+        return lambda: trapber.v2c_message(varbinds)
+    if shape == 'v2c_inform':
+        return lambda: trapber.v2c_message(varbinds, inform=True)
+    if shape == 'v3_scoped_pdu':
+        return lambda: trapber.v3_scoped_pdu(varbinds)
+
+
+def bench_fast_table(table):
+    """Varbind table rows to an encoded SNMPv2c trap, through PySNMP values or straight to BER"""
+    keys = dict((OID_TYPES[key][0], key) for key in OID_TYPES)
+    rows = [(oid, keys[name], data) for name, (oid, data) in sorted(SAMPLE_VARBINDS.items())]
+    if table == 'pyasn1':
+        return lambda: encoder.encode(v2c_message([build_varbind(*row) for row in rows]))
+    return lambda: trapber.v2c_message([trapber.table_varbind(*row) for row in rows])
+
+
+def bench_engine(version, level, sink):
+    """Full PySNMP engine trap send (build, encode, USM, socket) to a local sink"""
+    ntfOrg = ntforg.NotificationOriginator(trapreceiver.loopback_engine())
+    transport_target = ntforg.UdpTransportTarget(sink.address)
+    varbinds = sample_varbinds()
+    if version == 'v1':
+        authentication = ntforg.CommunityData('public', mpModel=0)
+        varbinds += [('1.3.6.1.6.3.18.1.3.0', '127.0.0.1'), ('1.3.6.1.6.3.1.1.4.3.0', SAMPLE_SOURCE_OID)]
+    elif version == 'v2c':
+        authentication = ntforg.CommunityData('public', mpModel=1)
+    else:
+        auth_protocol, priv_protocol = SECURITY_LEVELS[level]
+        if auth_protocol is None:
+            authentication = ntforg.UsmUserData('benchmark')
+        elif priv_protocol is None:
+            authentication = ntforg.UsmUserData('benchmark', SAMPLE_KEY, authProtocol=auth_protocol)
+        else:
+            authentication = ntforg.UsmUserData('benchmark', SAMPLE_KEY, SAMPLE_KEY,
+                                                authProtocol=auth_protocol, privProtocol=priv_protocol)
+    source_oid = SAMPLE_SOURCE_OID + '.0.1'
+    def run():
+        ntfOrg.sendNotification(authentication, transport_target, 'trap', source_oid, *varbinds)
+        sink.drain()
+    return run
+
+
+def bench_ntf_save(directory):
+    ntf = sample_ntf()
+    filename = os.path.join(directory, 'save.ntf')
+    return lambda: save_ntf(filename, ntf)
+
+
+def bench_ntf_load(directory):
+    filename = os.path.join(directory, 'load.ntf')
+    save_ntf(filename, sample_ntf())
+    return lambda: open_ntf(filename)
+
+
+def run_loopback(notification_type, count):
+    """Loopback send throughput through the local receiver, returning a result entry"""
+    receiver = trapreceiver.TrapReceiver((trapreceiver.LOOPBACK_ADDRESS, 0))
+    port = receiver.port()
+    receiver.start()
+    try:
+        started = timer()
+        errors = trapreceiver.send_loopback(count, notification_type, port, tracker=receiver.tracker)
+        elapsed = timer() - started
+        deadline = time.time() + 2
+        while receiver.tracker.report()['lost'] and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        receiver.stop()
+    report = receiver.tracker.report()
+    result = summarize([elapsed / count], count, 'notification')
+    result.update(dict((key, report[key]) for key in ('sent', 'received', 'lost', 'reordered', 'mismatched')))
+    result['send_errors'] = errors
+    result['latency_p50_us'] = report.get('latency_p50', 0) * 1e6
+    result['latency_p99_us'] = report.get('latency_p99', 0) * 1e6
+    return result
+
+
+def benchmarks(directory, sink):
+    """Generator of (name, callable factory) pairs for the timed benchmarks"""
+    yield 'validate', bench_validate
+    yield 'compile', bench_compile
+    for key in sorted(OID_TYPES):
+        name = OID_TYPES[key][0]
+        yield 'varbind_%s' % name.lower().replace(' ', '_'), lambda name=name: bench_varbind(name)
+    for shape in ENCODE_SHAPES:
+        yield 'encode_%s' % shape, lambda shape=shape: bench_encode(shape)
+        yield 'fast_encode_%s' % shape, lambda shape=shape: bench_fast_encode(shape)
+    yield 'table_encode_pyasn1', lambda: bench_fast_table('pyasn1')
+    yield 'table_encode_fast', lambda: bench_fast_table('fast')
+    yield 'engine_v1_trap', lambda: bench_engine('v1', None, sink)
+    yield 'engine_v2c_trap', lambda: bench_engine('v2c', None, sink)
+    for level in sorted(SECURITY_LEVELS):
+        yield 'engine_v3_trap_%s' % level, lambda level=level: bench_engine('v3', level, sink)
+    yield 'ntf_save', lambda: bench_ntf_save(directory)
+    yield 'ntf_load', lambda: bench_ntf_load(directory)
+
+
+def run_benchmarks(name_filter=None, quick=False, progress=None):
+    """Run the benchmark suite, returning the results dictionary"""
+    repeats = QUICK_REPEATS if quick else REPEATS
+    loopback_count = QUICK_LOOPBACK_COUNT if quick else LOOPBACK_COUNT
+    results = {}
+    directory = tempfile.mkdtemp(prefix='trapbench')
+    sink = UdpSink()
+    try:
+        for name, factory in benchmarks(directory, sink):
+            if name_filter and name_filter not in name:
+                continue
+            times, number = measure(factory(), repeats)
+            results[name] = summarize(times, number)
+            if progress:
+                progress(name, results[name])
+        for name, notification_type in (('loopback_v2c_trap', 'SNMPv2c Trap'),
+                                        ('loopback_v2c_inform', 'SNMPv2c Inform'),
+                                        ('loopback_v3_inform', 'SNMPv3 Inform')):
+            if name_filter and name_filter not in name:
+                continue
+            results[name] = run_loopback(notification_type, loopback_count)
+            if progress:
+                progress(name, results[name])
+    finally:
+        sink.close()
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        'format': RESULTS_FORMAT,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pysnmp': pysnmp_version,
+        'platform': platform.platform(),
+        'results': results
+    }
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """Compare two results dictionaries, returning (lines, regression names)"""
+    lines = ['%-28s %12s %12s %8s' % ('benchmark', 'baseline us', 'current us', 'change')]
+    regressions = []
+    for name in sorted(current['results']):
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['best_us']
+        after = current['results'][name]['best_us']
+        change = (after - before) / before * 100 if before else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        lines.append('%-28s %12.2f %12.2f %+7.1f%%%s' % (name, before, after, change, flag))
+    return lines, regressions
+
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description='Benchmark the notification build, encode and send paths.')
+    parser.add_argument('-o', '--output', help='write results to this JSON file')
+    parser.add_argument('--compare', metavar='BASELINE', help='compare against a previous results JSON file')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='percent slowdown counted as a regression (default %(default)s)')
+    parser.add_argument('--filter', help='only run benchmarks whose name contains this text')
+    parser.add_argument('--quick', action='store_true', help='fewer repeats and loopback notifications')
+    args = parser.parse_args(argv)
+
+    def progress(name, result):
+        print('%-28s %12.2f us %14.0f /s' % (name, result['best_us'], result['ops_per_sec']))
+
+    current = run_benchmarks(args.filter, args.quick, progress)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        lines, regressions = compare(baseline, current, args.threshold)
+        print('')
+        for line in lines:
+            print(line)
+        if regressions:
+            print('%s regression(s) over %s%%: %s' % (len(regressions), args.threshold, ', '.join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,480 @@
+#!/usr/bin/env python
+"""
+trapber.py - Misner Trap Tool fast BER encoder
+Copyright (C) 2015-2017 Joe Misner <joe@misner.net>
+http://tools.misner.net/
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software Foundation,
+Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+Encodes the notification shapes this tool sends (SNMPv1 Trap-PDU,
+SNMPv2c Trap and InformRequest messages and SNMPv3 scopedPDUs) straight
+to BER bytes with bytearray assembly, skipping the pyasn1 object tree.
+OID encodings are cached, and table_varbind() encodes a varbind table
+row without building any pyasn1 values at all.  Output is byte-identical
+to the pyasn1 encoder, which running this module checks against a
+conformance suite before timing both.  A few decoding helpers split a
+stream of messages and read PDU request IDs, e.g. for SNMP over TCP.
+
+python trapber.py [--no-timing]
+"""
+
+import sys
+import socket
+import argparse
+from notification import OID_TYPES, character_test
+try:
+    from pyasn1.codec.ber import encoder as pyasn1_encoder
+    from pyasn1.type import univ as pyasn1_univ
+except ImportError:
+    pyasn1_encoder = None
+
+OID_CACHE_SIZE = 10000
+
+# pyasn1 0.4 sizes negative integers from their magnitude, padding powers of two such as -128 with an
+# extra ff octet, where pyasn1 0.1 (used by PySNMP 4.3) encodes them minimally; match whichever is installed
+NEGATIVE_PADDED = bool(pyasn1_encoder) and len(pyasn1_encoder.encode(pyasn1_univ.Integer(-128))) == 4
+
+# BER tags
+INTEGER = 0x02
+OCTET_STRING = 0x04
+NULL = 0x05
+OBJECT_IDENTIFIER = 0x06
+SEQUENCE = 0x30
+IP_ADDRESS = 0x40
+COUNTER32 = 0x41
+UNSIGNED32 = 0x42      # Gauge32
+TIME_TICKS = 0x43
+OPAQUE = 0x44
+COUNTER64 = 0x46
+RESPONSE_PDU = 0xa2
+INFORM_REQUEST_PDU = 0xa6
+SNMPV2_TRAP_PDU = 0xa7
+TRAP_PDU = 0xa4        # SNMPv1
+
+INTEGER32_MIN = -2147483648
+INTEGER32_MAX = 2147483647
+UNSIGNED32_MAX = 4294967295
+OCTET_STRING_MAX = 65535
+
+SYS_UPTIME_OID = '1.3.6.1.2.1.1.3.0'
+SNMP_TRAP_OID = '1.3.6.1.6.3.1.1.4.1.0'
+
+# Varbind table data type name: BER tag
+TABLE_TYPES = {
+    'Integer':     INTEGER,
+    'Unsigned':    UNSIGNED32,
+    'Counter32':   COUNTER32,
+    'String':      OCTET_STRING,
+    'Null Object': NULL,
+    'OID':         OBJECT_IDENTIFIER,
+    'Time Ticks':  TIME_TICKS,
+    'IP Address':  IP_ADDRESS
+}
+
+_oid_cache = {}
+
+
+def _length(length):
+    """Return the BER definite length octets for a content length"""
+    if length < 0x80:
+        return bytearray((length,))
+    octets = bytearray()
+    while length:
+        octets.insert(0, length & 0xff)
+        length >>= 8
+    octets.insert(0, 0x80 | len(octets))
+    return octets
+
+
+def tlv(tag, content):
+    """Return a tag-length-value encoding as a bytearray"""
+    length = len(content)
+    if length < 0x80:
+        octets = bytearray((tag, length))
+    else:
+        octets = bytearray((tag,))
+        octets += _length(length)
+    octets += content
+    return octets
+
+
+def integer_content(value):
+    """Return the two's complement content octets of an integer, sized as the installed pyasn1 does"""
+    if 0 <= value < 0x80:
+        return bytearray((value,))
+    if value >= 0:
+        size = (value.bit_length() >> 3) + 1
+    elif NEGATIVE_PADDED:
+        size = (abs(value).bit_length() >> 3) + 1  # Sized from the magnitude, so -128 is ff80
+    else:
+        size = ((~value).bit_length() >> 3) + 1  # Minimal, so -128 is 80
+    octets = bytearray(size)
+    for index in range(size - 1, -1, -1):
+        octets[index] = value & 0xff
+        value >>= 8
+    return octets
+
+
+def octets(value):
+    """Return text or bytes as bytes, encoding text the way pysnmp's OctetString does"""
+    if isinstance(value, bytearray):
+        return bytes(value)
+    if isinstance(value, bytes):
+        return value
+    try:
+        return value.encode('iso-8859-1')
+    except (UnicodeError, AttributeError):
+        raise ValueError('Cannot encode %r as an OCTET STRING.' % (value,))
+
+
+def oid_arcs(oid):
+    """Return the arcs of a dotted string or sequence OID as a tuple of integers"""
+    if isinstance(oid, (tuple, list)):
+        return tuple(oid)
+    try:
+        arcs = tuple(int(arc) for arc in oid.split('.') if arc)  # Empty arcs are skipped, as by pyasn1
+    except (AttributeError, ValueError):
+        try:
+            return tuple(oid)  # pyasn1 ObjectIdentifier
+        except TypeError:
+            raise ValueError('Invalid OID %r.' % (oid,))
+    return arcs
+
+
+def oid_content(arcs):
+    """Return the content octets of an OBJECT IDENTIFIER"""
+    if len(arcs) < 2 or arcs[0] > 2 or (arcs[0] < 2 and arcs[1] > 39) or min(arcs) < 0:
+        raise ValueError('Invalid OID %s.' % '.'.join(str(arc) for arc in arcs))
+    octets = bytearray()
+    for arc in (arcs[0] * 40 + arcs[1],) + tuple(arcs[2:]):
+        if arc < 0x80:
+            octets.append(arc)
+        else:
+            chunk = bytearray((arc & 0x7f,))
+            arc >>= 7
+            while arc:
+                chunk.insert(0, 0x80 | (arc & 0x7f))
+                arc >>= 7
+            octets += chunk
+    return octets
+
+
+def encode_oid(oid):
+    """Return the cached OBJECT IDENTIFIER encoding of a dotted string or sequence OID"""
+    try:
+        return _oid_cache[oid]
+    except KeyError:
+        pass
+    except TypeError:
+        oid = oid_arcs(oid)  # Unhashable, e.g. a list
+        if oid in _oid_cache:
+            return _oid_cache[oid]
+    encoded = bytes(tlv(OBJECT_IDENTIFIER, oid_content(oid_arcs(oid))))
+    if len(_oid_cache) >= OID_CACHE_SIZE:
+        _oid_cache.clear()
+    _oid_cache[oid] = encoded
+    return encoded
+
+
+def encode_value(value):
+    """Return the BER encoding of a PySNMP/pyasn1 varbind value"""
+    tag = value.tagSet[0]
+    tag = tag[0] | tag[1] | tag[2]  # Class, format and number; pyasn1 0.1 tags have no named attributes
+    if tag == OBJECT_IDENTIFIER:
+        return encode_oid(tuple(value))
+    if tag == NULL:
+        return b'\x05\x00'
+    if tag in (INTEGER, COUNTER32, UNSIGNED32, TIME_TICKS, COUNTER64):
+        return tlv(tag, integer_content(int(value)))
+    return tlv(tag, value.asOctets())
+
+
+def encode_varbind(oid, value):
+    """Return the VarBind SEQUENCE encoding of an (oid, PySNMP value) pair"""
+    value = encode_value(value)
+    name = encode_oid(oid)
+    length = len(name) + len(value)
+    if length < 0x80:
+        octets = bytearray((SEQUENCE, length))
+    else:
+        octets = bytearray((SEQUENCE,))
+        octets += _length(length)
+    octets += name
+    octets += value
+    return octets
+
+
+def table_value(datatype, data):
+    """Return the BER encoding of a varbind table value, raising ValueError if invalid
+
+    Accepts and rejects the same values as the PySNMP types build_varbind()
+    uses, so it is a drop-in for encoding table rows.
+    """
+    tag = TABLE_TYPES[datatype]
+    if tag == OCTET_STRING:
+        content = octets(data)
+        if len(content) > OCTET_STRING_MAX:
+            raise ValueError('String longer than %s octets.' % OCTET_STRING_MAX)
+        return tlv(tag, content)
+    if tag == NULL:
+        return b'\x05\x00'  # Any table data is ignored
+    if tag == OBJECT_IDENTIFIER:
+        return encode_oid(data)
+    if tag == IP_ADDRESS:
+        if len(data) == 4:
+            content = octets(data)  # Four characters are taken as raw octets, as PySNMP does
+        else:
+            content = bytearray(int(x) for x in data.split('.'))
+        if len(content) != 4:
+            raise ValueError('Bad IP address syntax %s' % data)
+        return tlv(tag, content)
+    value = int(data)
+    if tag == INTEGER:
+        if not INTEGER32_MIN <= value <= INTEGER32_MAX:
+            raise ValueError('Integer out of range.')
+    elif not 0 <= value <= UNSIGNED32_MAX:
+        raise ValueError('Unsigned value out of range.')
+    return tlv(tag, integer_content(value))
+
+
+def table_varbind(oid, datatype, data, row=0):
+    """Return an encoded varbind from table values, raising ValueError like build_varbind()"""
+    if not character_test(oid, '0123456789.'):
+        raise ValueError('OID in varbind row %s must be a single dotted set of numbers.' % str(row + 1))
+    datatype = OID_TYPES[int(datatype)][0]
+    try:
+        value = table_value(datatype, data)
+        name = encode_oid(oid)
+    except Exception:
+        raise ValueError('Varbind row %s contains an invalid data value.' % str(row + 1))
+    return tlv(SEQUENCE, name + value)
+
+
+def varbind_list(varbinds):
+    """Return the VarBindList SEQUENCE of encoded varbinds or (oid, value) pairs"""
+    content = bytearray()
+    for varbind in varbinds:
+        if isinstance(varbind, tuple):
+            content += encode_varbind(*varbind)
+        else:
+            content += varbind
+    return tlv(SEQUENCE, content)
+
+
+def v1_trap_message(varbinds, community='public', enterprise='1.3.6.1.4.1.3.1.1', agent_address='127.0.0.1',
+                    generic_trap=6, specific_trap=1, uptime=0):
+    """Return an encoded SNMPv1 Trap-PDU message"""
+    pdu = bytearray(encode_oid(enterprise))
+    pdu += tlv(IP_ADDRESS, socket.inet_aton(agent_address))
+    pdu += tlv(INTEGER, integer_content(generic_trap))
+    pdu += tlv(INTEGER, integer_content(specific_trap))
+    pdu += tlv(TIME_TICKS, integer_content(uptime))
+    pdu += varbind_list(varbinds)
+    message = bytearray(b'\x02\x01\x00')  # version-1
+    message += tlv(OCTET_STRING, octets(community))
+    message += tlv(TRAP_PDU, pdu)
+    return bytes(tlv(SEQUENCE, message))
+
+
+def v2c_pdu(varbinds, inform=False, request_id=1, uptime=0, trap_oid='1.3.6.1.4.1.3.1.1.0.1'):
+    """Return an encoded SNMPv2-Trap-PDU or InformRequest-PDU with the standard leading varbinds"""
+    content = bytearray(tlv(SEQUENCE, encode_oid(SYS_UPTIME_OID) + tlv(TIME_TICKS, integer_content(uptime))))
+    content += tlv(SEQUENCE, encode_oid(SNMP_TRAP_OID) + encode_oid(trap_oid))
+    for varbind in varbinds:
+        if isinstance(varbind, tuple):
+            content += encode_varbind(*varbind)
+        else:
+            content += varbind
+    pdu = tlv(INTEGER, integer_content(request_id))
+    pdu += b'\x02\x01\x00\x02\x01\x00'  # error-status, error-index
+    pdu += tlv(SEQUENCE, content)
+    return tlv(INFORM_REQUEST_PDU if inform else SNMPV2_TRAP_PDU, pdu)
+
+
+def v2c_message(varbinds, inform=False, community='public', request_id=1, uptime=0,
+                trap_oid='1.3.6.1.4.1.3.1.1.0.1'):
+    """Return an encoded SNMPv2c Trap or InformRequest message"""
+    message = bytearray(b'\x02\x01\x01')  # version-2c
+    message += tlv(OCTET_STRING, octets(community))
+    message += v2c_pdu(varbinds, inform, request_id, uptime, trap_oid)
+    return bytes(tlv(SEQUENCE, message))
+
+
+def v3_scoped_pdu(varbinds, inform=False, context_engine_id='8000000001020305', context_name='',
+                  request_id=1, uptime=0, trap_oid='1.3.6.1.4.1.3.1.1.0.1'):
+    """Return an encoded SNMPv3 scopedPDU, ready for USM processing, from a hex context engine ID"""
+    scoped_pdu = tlv(OCTET_STRING, bytearray.fromhex(context_engine_id))
+    scoped_pdu += tlv(OCTET_STRING, octets(context_name))
+    scoped_pdu += v2c_pdu(varbinds, inform, request_id, uptime, trap_oid)
+    return bytes(tlv(SEQUENCE, scoped_pdu))
+
+
+def read_tlv(buffer, offset=0):
+    """Return (tag, content offset, end offset) of the TLV at offset in a bytearray, or None if incomplete"""
+    available = len(buffer) - offset
+    if available < 2:
+        return None
+    tag = buffer[offset]
+    length = buffer[offset + 1]
+    start = offset + 2
+    if length & 0x80:
+        count = length & 0x7f
+        if count == 0 or count > 4:
+            raise ValueError('Unsupported BER length encoding.')  # Indefinite or absurdly long
+        if available < 2 + count:
+            return None
+        length = 0
+        for octet in buffer[start:start + count]:
+            length = length << 8 | octet
+        start += count
+    if start + length > len(buffer):
+        return None
+    return tag, start, start + length
+
+
+def integer_value(content):
+    """Return the value of INTEGER content octets"""
+    value = 0
+    for octet in content:
+        value = value << 8 | octet
+    if content and content[0] & 0x80:
+        value -= 1 << (8 * len(content))
+    return value
+
+
+def oid_text(content):
+    """Return the dotted string of OBJECT IDENTIFIER content octets, raising ValueError if malformed"""
+    arcs = []
+    arc = 0
+    for octet in content:
+        arc = arc << 7 | octet & 0x7f
+        if not octet & 0x80:
+            arcs.append(arc)
+            arc = 0
+    if not arcs or content[-1] & 0x80:
+        raise ValueError('Malformed OID.')
+    first = min(arcs[0] // 40, 2)
+    return '.'.join(str(arc) for arc in [first, arcs[0] - first * 40] + arcs[1:])
+
+
+def pdu_offset(message):
+    """Return the offset of the PDU in an SNMPv1/v2c message, raising ValueError if malformed"""
+    try:
+        tag, start, end = read_tlv(message)
+        tag, version_start, version_end = read_tlv(message, start)   # version
+        tag, community_start, community_end = read_tlv(message, version_end)  # community
+    except TypeError:
+        raise ValueError('Truncated SNMP message.')
+    if message[0] != SEQUENCE or message[start] != INTEGER or message[version_end] != OCTET_STRING:
+        raise ValueError('Not an SNMPv1/v2c message.')
+    return community_end
+
+
+def pdu_request_id(message):
+    """Return the (PDU tag, request-id) of an SNMPv1/v2c message held in a bytearray"""
+    offset = pdu_offset(message)
+    try:
+        tag, start, end = read_tlv(message, offset)
+        integer_tag, id_start, id_end = read_tlv(message, start)
+    except TypeError:
+        raise ValueError('Truncated SNMP message.')
+    if tag == TRAP_PDU:
+        return tag, None  # SNMPv1 Trap-PDUs have no request-id
+    return tag, integer_value(message[id_start:id_end])
+
+
+def conformance_cases():
+    """Generator of (name, pyasn1 message factory, fast encoder factory) conformance cases"""
+    from pysnmp.proto import rfc1902
+    from pyasn1.type import univ
+    import trapbench
+
+    sample = trapbench.sample_varbinds()
+    keys = dict((OID_TYPES[key][0], key) for key in OID_TYPES)
+    rows = [(oid, keys[name], data) for name, (oid, data) in sorted(trapbench.SAMPLE_VARBINDS.items())]
+    edges = [('1.3.6.1.4.1.3.1.1.2.%s' % n, value) for n, value in enumerate([
+        rfc1902.Integer(0), rfc1902.Integer(127), rfc1902.Integer(128), rfc1902.Integer(-1),
+        rfc1902.Integer(-128), rfc1902.Integer(-129), rfc1902.Integer(INTEGER32_MAX),
+        rfc1902.Integer(INTEGER32_MIN), rfc1902.Unsigned32(0), rfc1902.Counter32(UNSIGNED32_MAX),
+        rfc1902.TimeTicks(0x800000), rfc1902.OctetString(''),
+        rfc1902.OctetString('x' * 127), rfc1902.OctetString('x' * 300), rfc1902.OctetString('x' * 65535),
+        rfc1902.IpAddress('0.0.0.0'), rfc1902.IpAddress('255.255.255.255'), univ.Null(''),
+        univ.ObjectIdentifier('0.39'), univ.ObjectIdentifier('2.999.4294967295.16383.16384'),
+        rfc1902.Opaque('\x9f\x78\x04\x42\xf6\x00\x00'), rfc1902.Bits('\x80')])]
+    v2_edges = edges + [('1.3.6.1.4.1.3.1.1.2.99', rfc1902.Counter64(2 ** 64 - 1))]  # Not in SNMPv1
+    many = [('1.3.6.1.4.1.3.1.1.3.%s.%s' % (n, n * 1000), rfc1902.Integer(n)) for n in range(200)]
+
+    for label, varbinds in (('sample', sample), ('edges', edges), ('many', many), ('empty', [])):
+        yield ('v1_trap_%s' % label, lambda v=varbinds: trapbench.v1_trap_message(v),
+               lambda v=varbinds: v1_trap_message(v))
+        if varbinds is edges:
+            varbinds = v2_edges
+        for inform in (False, True):
+            shape = 'inform' if inform else 'trap'
+            yield ('v2c_%s_%s' % (shape, label), lambda v=varbinds, i=inform: trapbench.v2c_message(v, i),
+                   lambda v=varbinds, i=inform: v2c_message(v, i))
+            yield ('v3_%s_%s' % (shape, label), lambda v=varbinds, i=inform: trapbench.v3_scoped_pdu(v, i),
+                   lambda v=varbinds, i=inform: v3_scoped_pdu(v, i))
+    yield ('v1_trap_fields', lambda: trapbench.v1_trap_message(sample, 'c' * 200, '10.20.30.40', 0xffffffff),
+           lambda: v1_trap_message(sample, 'c' * 200, agent_address='10.20.30.40', uptime=0xffffffff))
+    yield ('v2c_inform_fields', lambda: trapbench.v2c_message(sample, True, '', INTEGER32_MIN, 1),
+           lambda: v2c_message(sample, True, '', INTEGER32_MIN, 1))
+    yield ('v3_inform_fields',
+           lambda: trapbench.v3_scoped_pdu(sample, True, '80001f8880e9630000d61ff449', 'ctx', INTEGER32_MAX, 99),
+           lambda: v3_scoped_pdu(sample, True, '80001f8880e9630000d61ff449', 'ctx', INTEGER32_MAX, 99))
+    yield ('v2c_trap_table_rows', lambda: trapbench.v2c_message(sample),
+           lambda: v2c_message([table_varbind(oid, key, data) for oid, key, data in rows]))
+
+
+def check_conformance():
+    """Compare the fast encoder against pyasn1 on every conformance case, returning failure lines"""
+    from pyasn1.codec.ber import encoder
+    failures = []
+    for name, reference, fast in conformance_cases():
+        expected = encoder.encode(reference())
+        actual = fast()
+        if actual != expected:
+            failures.append('%s: expected %d octets %r..., got %d octets %r...'
+                            % (name, len(expected), expected[:32], len(actual), actual[:32]))
+    return failures
+
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description='Check the fast BER encoder against pyasn1 and time both.')
+    parser.add_argument('--no-timing', action='store_true', help='only run the conformance suite')
+    args = parser.parse_args(argv)
+
+    failures = check_conformance()
+    for line in failures:
+        print(line)
+    if failures:
+        print('%s conformance case(s) failed' % len(failures))
+        return 1
+    print('All conformance cases byte-identical to pyasn1')
+    if args.no_timing:
+        return 0
+
+    import trapbench
+    print('%-28s %12s %12s %8s' % ('shape', 'pyasn1 us', 'fast us', 'speedup'))
+    for shape in trapbench.ENCODE_SHAPES:
+        reference = min(trapbench.measure(trapbench.bench_encode(shape))[0])
+        fast = min(trapbench.measure(trapbench.bench_fast_encode(shape))[0])
+        print('%-28s %12.2f %12.2f %7.1fx' % (shape, reference * 1e6, fast * 1e6, reference / fast))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+"""
+trapexport.py - Misner Trap Tool bulk snmptrap script export
+Copyright (C) 2015-2017 Joe Misner <joe@misner.net>
+http://tools.misner.net/
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software Foundation,
+Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+Streams notifications into a shell script or batch file of snmptrap
+commands, for running on remote hosts.  Each stage is a generator, so
+only one notification is held in memory at a time regardless of how
+many lines the script ends up with.  A file which can't be opened as
+a notification file is skipped and reported, and the export goes on.
+
+python trapexport.py [-o script.sh] [-f sh|bat] [--count N]
+                     [--fleet N] [--destination host:port] notification.ntf ...
+"""
+
+import sys
+import argparse
+from notification import Notification
+
+WRITE_BUFFER = 1 << 16
+SCRIPT_HEADERS = {
+    'sh':  ['#!/bin/sh', '# Generated by Misner Trap Tool'],
+    'bat': ['@echo off', 'rem Generated by Misner Trap Tool']
+}
+SCRIPT_COMMENTS = {'sh': '# ', 'bat': 'rem '}
+SCRIPT_LINE_ENDINGS = {'sh': '\n', 'bat': '\r\n'}
+
+
+def quote_sh(data):
+    """Quote a field or varbind value for a POSIX shell"""
+    return "'%s'" % data.replace("'", "'\\''")
+
+
+def quote_bat(data):
+    """Quote a field or varbind value for a Windows batch file"""
+    return '"%s"' % data.replace('%', '%%').replace('"', '\\"')
+
+
+SCRIPT_QUOTES = {'sh': quote_sh, 'bat': quote_bat}
+
+
+def iter_ntf_files(filenames, skipped=None):
+    """Generator of Notifications loaded one file at a time
+
+    A file which can't be opened is passed to the skipped callback, if
+    given, as skipped(filename, error); otherwise the error is raised.
+    """
+    for filename in filenames:
+        try:
+            ntf = Notification.open(filename)
+        except Exception as e:  # shelve raises a different error per dbm module
+            if skipped is None:
+                raise
+            skipped(filename, e)
+            continue
+        yield ntf
+
+
+def repeat_notifications(notifications, count):
+    """Generator repeating each notification count times"""
+    for ntf in notifications:
+        for _ in range(count):
+            yield ntf
+
+
+def override_destination(notifications, destination_address):
+    """Generator replacing the destination address of each notification"""
+    for ntf in notifications:
+        yield ntf.copy(destination_address=destination_address)
+
+
+def fleet_notifications(notifications, fleet, count):
+    """Generator sending each notification count times from devices of a simulated fleet
+
+    Each copy takes its agent address, community string or SNMPv3 user and
+    uptime from the next fleet device.
+    """
+    for ntf in notifications:
+        credential_key = 'security_name' if ntf.notification_type >= 3 else 'community_string'
+        for device in fleet.devices(count):
+            yield ntf.copy(agent_address=fleet.agent_address(device), uptime=fleet.uptime(device),
+                           **{credential_key: fleet.credential(device)})
+
+
+def snmptrap_commands(notifications, script_format='sh', snmptrap='snmptrap'):
+    """Generator of snmptrap command lines, with a comment line in place of invalid notifications"""
+    quote = SCRIPT_QUOTES[script_format]
+    for number, ntf in enumerate(notifications, 1):
+        try:
+            arguments = ntf.compile(resolve=False, pysnmp=False).snmptrap_arguments(quote=quote)
+        except (ValueError, KeyError, IndexError) as e:
+            yield '%sSkipped notification %s: %s' % (SCRIPT_COMMENTS[script_format], number, e)
+        else:
+            yield '%s %s' % (snmptrap, arguments)
+
+
+def write_script(lines, fileobj, script_format='sh', progress=None, progress_interval=10000):
+    """Write a script header followed by lines to a binary file object, returning the line count
+
+    The progress callback, if given, is called as progress(count) every
+    progress_interval lines.
+    """
+    line_ending = SCRIPT_LINE_ENDINGS[script_format]
+    count = 0
+    for line in SCRIPT_HEADERS[script_format]:
+        fileobj.write((line + line_ending).encode('utf-8'))
+    for line in lines:
+        fileobj.write((line + line_ending).encode('utf-8'))
+        count += 1
+        if progress and count % progress_interval == 0:
+            progress(count)
+    return count
+
+
+def iter_export(filenames, count=1, destination_address=None, fleet=None, skipped=None):
+    """Generator pipeline of the notifications exported from notification files"""
+    notifications = iter_ntf_files(filenames, skipped)
+    if destination_address:
+        notifications = override_destination(notifications, destination_address)
+    if fleet:
+        notifications = fleet_notifications(notifications, fleet, count)
+    elif count > 1:
+        notifications = repeat_notifications(notifications, count)
+    return notifications
+
+
+def export_script(filenames, output, script_format='sh', count=1, destination_address=None, fleet=None,
+                  snmptrap='snmptrap', progress=None, skipped=None):
+    """Export notification files to a script file, returning the number of lines written"""
+    notifications = iter_export(filenames, count, destination_address, fleet, skipped)
+    lines = snmptrap_commands(notifications, script_format, snmptrap)
+    with open(output, 'wb', WRITE_BUFFER) as fileobj:
+        return write_script(lines, fileobj, script_format, progress)
+
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description='Export notification files as a script of snmptrap commands.')
+    parser.add_argument('filenames', nargs='+', metavar='notification.ntf', help='notification files to export')
+    parser.add_argument('-o', '--output', help='script file to write (default: standard output)')
+    parser.add_argument('-f', '--format', choices=sorted(SCRIPT_HEADERS), default='sh', help='script format')
+    parser.add_argument('-n', '--count', type=int, default=1, help='commands per notification file')
+    parser.add_argument('--destination', help='override destination address, as host[:port]')
+    parser.add_argument('--snmptrap', default='snmptrap', help='snmptrap command name or path')
+    parser.add_argument('--fleet', type=int, metavar='SIZE',
+                        help='source the commands from a simulated fleet of SIZE devices')
+    parser.add_argument('--fleet-address', default='10.0.0.1', help='first agent address of the fleet')
+    parser.add_argument('--fleet-credentials', default='public',
+                        help='comma separated community strings or SNMPv3 users of the fleet')
+    args = parser.parse_args(argv)
+
+    fleet = None
+    if args.fleet:
+        import trapfleet
+        fleet = trapfleet.Fleet(args.fleet, args.fleet_address, args.fleet_credentials.split(','))
+
+    failures = []
+
+    def skipped(filename, error):
+        failures.append(filename)
+        sys.stderr.write('Skipped %s: unable to open notification file: %s\n' % (filename, error))
+
+    if args.output:
+        count = export_script(args.filenames, args.output, args.format, args.count, args.destination,
+                              fleet, args.snmptrap, skipped=skipped)
+        sys.stderr.write('Wrote %s commands to %s\n' % (count, args.output))
+    else:
+        notifications = iter_export(args.filenames, args.count, args.destination, fleet, skipped)
+        stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+        write_script(snmptrap_commands(notifications, args.format, args.snmptrap), stdout, args.format)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
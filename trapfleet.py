@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+"""
+trapfleet.py - Misner Trap Tool simulated agent fleet
+Copyright (C) 2015-2017 Joe Misner <joe@misner.net>
+http://tools.misner.net/
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software Foundation,
+Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+Simulates a large fleet of SNMP agents, each with its own agent address,
+community string or SNMPv3 user, sysUpTime and notification counter.
+Per-device state is held in flat array.array columns indexed by device
+number rather than one object per device, so a 100k device fleet costs
+a couple of megabytes rather than hundreds.
+"""
+
+import time
+import random
+import socket
+import struct
+from array import array
+from pysnmp.entity import engine, config
+from pysnmp.entity.rfc3413 import context
+from pysnmp.entity.rfc3413.oneliner import ntforg
+from pysnmp.proto import rfc1902
+from notification import error_indication
+
+MAX_FLEET_SIZE = 1000000
+MAX_UPTIME = 8640000 * 30      # Initial uptimes are spread over 30 days, in TimeTicks
+COUNTER32_MAX = 4294967296
+
+SYS_UPTIME_OID = '1.3.6.1.2.1.1.3.0'
+SNMP_TRAP_ADDRESS_OID = '1.3.6.1.6.3.18.1.3.0'
+SNMP_TRAP_ENTERPRISE_OID = '1.3.6.1.6.3.1.1.4.3.0'
+
+
+def _uint_array(size):
+    """Return a zero filled array of at least 32-bit unsigned integers"""
+    typecode = 'I' if array('I').itemsize >= 4 else 'L'
+    return array(typecode, [0]) * size
+
+
+class DeviceUptime(rfc1902.TimeTicks):
+    """Engine sysUpTime.0 value reporting the uptime of the device being sent for, rather than the engine's
+
+    PySNMP puts its engine's sysUpTime.0 in the first varbind of every
+    SNMPv2c and SNMPv3 notification, and a sysUpTime.0 varbind given with
+    the notification is added after it rather than replacing it.
+    """
+    ticks = 0
+
+    def clone(self, *args, **kwargs):
+        if not args and 'value' not in kwargs:
+            args = (self.ticks,)
+        return rfc1902.TimeTicks.clone(self, *args, **kwargs)
+
+
+class Fleet(object):
+    """Array-backed state for a fleet of simulated SNMP agents"""
+    def __init__(self, size, base_address='10.0.0.1', credentials=('public',), seed=None):
+        """Executed when the Fleet() object is created"""
+        if size < 1 or size > MAX_FLEET_SIZE:
+            raise ValueError('Fleet size must be between 1 and %s.' % MAX_FLEET_SIZE)
+        if not credentials:
+            raise ValueError('At least one community string or user must be given.')
+        try:
+            base = struct.unpack('!I', socket.inet_aton(base_address))[0]
+        except (socket.error, OSError):
+            raise ValueError('Base agent address must be an IPv4 address.')
+        if base + size > COUNTER32_MAX:
+            raise ValueError('Fleet does not fit in the address range after %s.' % base_address)
+
+        self.size = size
+        self.credentials = list(credentials)
+        self.started = time.time()
+        rng = random.Random(seed)
+
+        # One column per attribute; device N is the Nth element of every column
+        self.addresses = _uint_array(size)
+        self.uptime_offsets = _uint_array(size)
+        self.counters = _uint_array(size)
+        if len(self.credentials) <= 0xffff:
+            self.credential_index = array('H', [0]) * size
+        else:
+            self.credential_index = _uint_array(size)
+        credential_total = len(self.credentials)
+        for device in range(size):
+            self.addresses[device] = base + device
+            self.uptime_offsets[device] = rng.randrange(MAX_UPTIME)
+            self.credential_index[device] = device % credential_total
+
+    def __len__(self):
+        return self.size
+
+    def nbytes(self):
+        """Return the number of bytes used by the per-device state columns"""
+        columns = (self.addresses, self.uptime_offsets, self.counters, self.credential_index)
+        return sum(column.itemsize * len(column) for column in columns)
+
+    def agent_address(self, device):
+        """Return the dotted IPv4 agent address of a device"""
+        return socket.inet_ntoa(struct.pack('!I', self.addresses[device]))
+
+    def credential(self, device):
+        """Return the community string or SNMPv3 user of a device"""
+        return self.credentials[self.credential_index[device]]
+
+    def uptime(self, device, now=None):
+        """Return the sysUpTime of a device in TimeTicks (hundredths of a second)"""
+        if now is None:
+            now = time.time()
+        return (self.uptime_offsets[device] + int((now - self.started) * 100)) % COUNTER32_MAX
+
+    def increment(self, device):
+        """Increment and return the Counter32 notification counter of a device"""
+        value = (self.counters[device] + 1) % COUNTER32_MAX
+        self.counters[device] = value
+        return value
+
+    def reboot(self, device, now=None):
+        """Reset a device's sysUpTime to zero, as if the agent restarted"""
+        if now is None:
+            now = time.time()
+        self.uptime_offsets[device] = (COUNTER32_MAX - int((now - self.started) * 100)) % COUNTER32_MAX
+
+    def devices(self, count, order='sequential', seed=None):
+        """Generator of device numbers for count notifications, cycling through the fleet"""
+        if order == 'random':
+            rng = random.Random(seed)
+            for _ in range(count):
+                yield rng.randrange(self.size)
+        else:
+            for n in range(count):
+                yield n % self.size
+
+
+class FleetSender(object):
+    """Sends notifications on behalf of fleet devices through one long-lived PySNMP engine"""
+    def __init__(self, fleet, transport_target, pdu, source_oid, varbinds,
+                 snmp_model=None, enterprise_oid='', auth_key=None, priv_key=None,
+                 auth_protocol=None, priv_protocol=None, context_name='', counter_oid=None):
+        """Executed when the FleetSender() object is created
+
+        snmp_model is 0 (SNMPv1) or 1 (SNMPv2c) for community based
+        notifications, or None for SNMPv3 where the fleet credentials are
+        security names sharing the given keys and protocols.
+        """
+        self.fleet = fleet
+        self.transport_target = transport_target
+        self.pdu = pdu
+        self.source_oid = source_oid
+        self.varbinds = list(varbinds)
+        self.snmp_model = snmp_model
+        self.enterprise_oid = enterprise_oid
+        self.context_name = context_name
+        self.counter_oid = counter_oid
+
+        # Authentication objects are built once per credential, not once per device
+        self.authentication = []
+        for credential in fleet.credentials:
+            if snmp_model is not None:
+                self.authentication.append(ntforg.CommunityData(credential, mpModel=snmp_model))
+            elif auth_protocol is None:
+                self.authentication.append(ntforg.UsmUserData(credential))
+            elif priv_protocol is None:
+                self.authentication.append(ntforg.UsmUserData(credential, auth_key, authProtocol=auth_protocol))
+            else:
+                self.authentication.append(ntforg.UsmUserData(credential, auth_key, priv_key,
+                                                              authProtocol=auth_protocol,
+                                                              privProtocol=priv_protocol))
+
+        if context_name and snmp_model is None:  # Custom context name when using SNMPv3
+            snmpEngine = engine.SnmpEngine()
+            snmpContext = context.SnmpContext(snmpEngine)
+            snmpContext.registerContextName(context_name, snmpContext.getMibInstrum())
+            # PySNMP only allows each user to notify in the default context, and silently
+            # drops notifications with varbinds in any other
+            for authentication in self.authentication:
+                config.addVacmUser(snmpEngine, authentication.securityModel, authentication.securityName,
+                                   authentication.securityLevel, notifySubTree=(1, 3, 6), contextName=context_name)
+            self.ntfOrg = ntforg.NotificationOriginator(snmpEngine, snmpContext)
+        else:
+            self.ntfOrg = ntforg.NotificationOriginator()
+
+        # The engine's sysUpTime.0 is set to each device's uptime before sending for it
+        self.uptime = DeviceUptime(0)
+        mibBuilder = self.ntfOrg.snmpEngine.msgAndPduDsp.mibInstrumController.mibBuilder
+        sysUpTime, = mibBuilder.importSymbols('__SNMPv2-MIB', 'sysUpTime')
+        sysUpTime.setSyntax(self.uptime)
+
+    @classmethod
+    def from_plan(cls, fleet, plan, counter_oid=None):
+        """Return a FleetSender for a notification.SendPlan compiled with PySNMP varbinds"""
+        notification = plan.notification
+        return cls(fleet, plan.transport_target(), plan.pdu, plan.trap_oid, plan.varbinds,
+                   snmp_model=plan.snmp_model, enterprise_oid=plan.enterprise_oid,
+                   auth_key=notification.auth_key, priv_key=notification.priv_key,
+                   auth_protocol=plan.auth_protocol, priv_protocol=plan.priv_protocol,
+                   context_name=notification.context_name, counter_oid=counter_oid)
+
+    def device_varbinds(self, device, now=None):
+        """Return the full varbind list for a notification sourced from device
+
+        The device's uptime goes in the engine's leading sysUpTime.0, and
+        for SNMPv1 also in the time stamp; SNMPv2c and SNMPv3 notifications
+        carry the device's agent address as snmpTrapAddress.0.
+        """
+        self.uptime.ticks = self.fleet.uptime(device, now)
+        varbinds = list(self.varbinds)
+        if self.counter_oid:
+            varbinds.append((self.counter_oid, rfc1902.Counter32(self.fleet.increment(device))))
+        else:
+            self.fleet.increment(device)
+        if self.snmp_model == 0:
+            varbinds.append((SYS_UPTIME_OID, rfc1902.TimeTicks(self.uptime.ticks)))
+            varbinds.append((SNMP_TRAP_ADDRESS_OID, self.fleet.agent_address(device)))
+            varbinds.append((SNMP_TRAP_ENTERPRISE_OID, self.enterprise_oid))
+        else:
+            varbinds.append((SNMP_TRAP_ADDRESS_OID, rfc1902.IpAddress(self.fleet.agent_address(device))))
+        return varbinds
+
+    def send(self, device):
+        """Send one notification from device, returning the PySNMP error indication if any"""
+        authentication = self.authentication[self.fleet.credential_index[device]]
+        varbinds = self.device_varbinds(device)
+        if self.context_name and self.snmp_model is None:
+            return error_indication(self.ntfOrg.sendNotification(authentication, self.transport_target, self.pdu,
+                                                                 self.source_oid, *varbinds,
+                                                                 contextName=self.context_name))
+        return error_indication(self.ntfOrg.sendNotification(authentication, self.transport_target, self.pdu,
+                                                             self.source_oid, *varbinds))
+
+    def run(self, count, rate=0, order='sequential', progress=None, progress_interval=1000):
+        """Send count notifications across the fleet, optionally limited to rate per second
+
+        The progress callback, if given, is called as progress(sent, errors)
+        every progress_interval notifications and may return False to stop.
+        Returns a (sent, errors, elapsed) tuple.
+        """
+        sent = errors = 0
+        started = time.time()
+        for device in self.fleet.devices(count, order):
+            if rate:
+                delay = started + float(sent + errors) / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            if self.send(device):
+                errors += 1
+            else:
+                sent += 1
+            if progress and (sent + errors) % progress_interval == 0:
+                if progress(sent, errors) is False:
+                    break
+        return sent, errors, time.time() - started
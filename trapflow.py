@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+"""
+trapflow.py - Misner Trap Tool per-destination flow control
+Copyright (C) 2015-2017 Joe Misner <joe@misner.net>
+http://tools.misner.net/
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software Foundation,
+Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+Keeps storm tests from overwhelming managers.  Each destination gets a
+token bucket rate and burst size and a limit on InformRequests awaiting
+acknowledgment.  Queued notifications are handed to the senders taking
+destinations in turn, so one slow manager cannot starve the others of a
+multi-target run.
+
+When InformRequests to a destination time out, or the destination is
+reported unreachable (TCP connection refused, or an ICMP error passed up
+through the socket), its rate and InformRequest window are halved, down
+to 1/64; each acknowledged send then restores a little of them.  A
+destination without a rate limit is slowed from the rate it was being
+sent at.  ICMP errors for UDP are only seen where the operating system
+reports them to an unconnected socket, so for UDP traps the slowdown
+mostly relies on Inform timeouts.
+"""
+
+import os
+import time
+import errno
+import threading
+from collections import deque
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+TIMEOUT = 'timeout'
+UNREACHABLE = 'unreachable'
+
+SLOWDOWN = 0.5                # Rate and window multiplier on each timeout or unreachable report
+MIN_FACTOR = 1.0 / 64
+RECOVERY_STEP = 0.01          # Added back to the multiplier on each successful send
+MIN_RATE = 1.0                # Notifications per second a slowed destination is never held below
+MAX_FLOWS = 1000              # Destinations tracked before idle ones are forgotten
+
+UNREACHABLE_ERRNOS = frozenset(getattr(errno, name) for name in
+                               ('ECONNREFUSED', 'ECONNRESET', 'EHOSTUNREACH', 'ENETUNREACH',
+                                'WSAECONNREFUSED', 'WSAECONNRESET', 'WSAEHOSTUNREACH', 'WSAENETUNREACH')
+                               if hasattr(errno, name))
+
+
+def unreachable(error):
+    """Return True if an exception or error indication reports the destination as unreachable"""
+    if getattr(error, 'errno', None) in UNREACHABLE_ERRNOS:
+        return True
+    text = str(error)
+    for number in UNREACHABLE_ERRNOS:
+        if ('Errno %s]' % number) in text or os.strerror(number) in text:
+            return True
+    return False
+
+
+def destination_key(address):
+    """Return a destination address normalized so that equivalent spellings share one flow"""
+    key = ('%s' % address).strip().lower()
+    if key.startswith('udp:'):
+        key = key[4:]
+    if ':' not in (key[4:] if key.startswith('tcp:') else key):
+        key += ':162'
+    return key
+
+
+class FlowLimits(object):
+    """Flow limits of a destination; zero is unlimited"""
+    __slots__ = ('rate', 'burst', 'max_inflight', 'adaptive')
+
+    def __init__(self, rate=0, burst=0, max_inflight=0, adaptive=True):
+        """Executed when the FlowLimits() object is created
+
+        rate is in notifications per second, burst is the most sent at
+        once after an idle spell (default one second's worth of the rate),
+        and max_inflight the most InformRequests awaiting acknowledgment.
+        """
+        if rate < 0 or burst < 0 or max_inflight < 0:
+            raise ValueError('Flow limits must not be negative.')
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_inflight = int(max_inflight)
+        self.adaptive = adaptive
+
+    @classmethod
+    def parse(cls, text, adaptive=True):
+        """Return FlowLimits from RATE[,BURST[,INFLIGHT]] text, raising ValueError if invalid"""
+        values = text.split(',')
+        if len(values) > 3:
+            raise ValueError('Flow limits must be given as RATE[,BURST[,INFLIGHT]].')
+        try:
+            values = [float(value or 0) for value in values]
+        except ValueError:
+            raise ValueError('Flow limits must be given as RATE[,BURST[,INFLIGHT]].')
+        return cls(*values, adaptive=adaptive)
+
+
+class DestinationFlow(object):
+    """Queued items, token bucket, InformRequests in flight and adaptive slowdown of one destination"""
+    def __init__(self, limits, window, now):
+        """Executed when the DestinationFlow() object is created
+
+        window is the InformRequest limit used when limits sets none.
+        """
+        self.limits = limits
+        self.window = limits.max_inflight or window
+        self.queue = deque()
+        self.inflight = 0
+        self.factor = 1.0
+        self.base_rate = limits.rate  # An unlimited destination takes its observed rate when first slowed
+        self.tokens = self.burst()
+        self.updated = now
+        self.rate_started = now
+        self.rate_count = 0
+        self.observed_rate = 0.0
+        self.counters = dict.fromkeys(('completed', 'timeouts', 'unreachable', 'slowdowns'), 0)
+
+    def rate(self):
+        """Return the current rate limit in notifications per second, 0 if unlimited"""
+        if not self.base_rate:
+            return 0.0
+        return max(self.base_rate * self.factor, MIN_RATE)
+
+    def burst(self):
+        """Return the current token bucket size"""
+        return max((self.limits.burst or self.base_rate) * self.factor, 1.0)
+
+    def inflight_limit(self):
+        """Return the current limit of InformRequests awaiting acknowledgment"""
+        return max(int(self.window * self.factor), 1)
+
+    def ready_at(self, now):
+        """Return when the next queued item may be sent, or None while the InformRequest window is full"""
+        if self.queue[0][1] and self.inflight >= self.inflight_limit():
+            return None
+        rate = self.rate()
+        if not rate:
+            return now
+        self.tokens = min(self.tokens + (now - self.updated) * rate, self.burst())
+        self.updated = now
+        if self.tokens >= 1:
+            return now
+        return now + (1 - self.tokens) / rate
+
+    def dispatched(self, now, inform):
+        """Account for an item handed to a sender"""
+        if self.base_rate:
+            self.tokens -= 1
+        if inform:
+            self.inflight += 1
+        self.rate_count += 1
+        if now - self.rate_started >= 1:
+            self.observed_rate = self.rate_count / (now - self.rate_started)
+            self.rate_started = now
+            self.rate_count = 0
+
+    def completed(self, now, inform, congestion=None):
+        """Account for a sent item, slowing down on TIMEOUT or UNREACHABLE and otherwise recovering"""
+        if inform:
+            self.inflight -= 1
+        if congestion == TIMEOUT:
+            self.counters['timeouts'] += 1
+        elif congestion == UNREACHABLE:
+            self.counters['unreachable'] += 1
+        else:
+            self.counters['completed'] += 1
+        if not self.limits.adaptive:
+            return
+        if congestion:
+            if not self.base_rate:
+                partial = self.rate_count / max(now - self.rate_started, 0.001)
+                self.base_rate = max(self.observed_rate or partial, MIN_RATE)
+                self.tokens = min(self.tokens, self.burst())
+            self.factor = max(self.factor * SLOWDOWN, MIN_FACTOR)
+            self.counters['slowdowns'] += 1
+        elif self.factor < 1:
+            self.factor = min(self.factor + RECOVERY_STEP, 1.0)
+            if self.factor == 1 and not self.limits.rate:
+                self.base_rate = 0.0
+
+    def idle(self):
+        """Return True if nothing is queued or in flight and no slowdown is in effect"""
+        return not self.queue and not self.inflight and self.factor == 1
+
+    def stats(self):
+        """Return the flow's queue, limits and counters"""
+        stats = dict(self.counters)
+        stats.update({'queued': len(self.queue), 'inflight': self.inflight, 'inflight_limit': self.inflight_limit(),
+                      'rate': round(self.rate(), 3), 'factor': round(self.factor, 4)})
+        return stats
+
+
+class FlowScheduler(object):
+    """A bounded queue shared fairly between destinations, each held to its FlowLimits
+
+    Offers the queue.Queue methods the send service uses.  put() blocks
+    while full; get() returns the next item due, taking destinations in
+    turn and skipping any whose token bucket is empty or whose
+    InformRequest window is full.  Senders report each result with done().
+    classify(item) returns the item's (destination address, is InformRequest).
+    """
+    def __init__(self, maxsize, classify, limits=None, destination_limits=None, window=1):
+        """Executed when the FlowScheduler() object is created"""
+        self.maxsize = maxsize
+        self.classify = classify
+        self.limits = limits or FlowLimits()
+        self.destination_limits = dict((destination_key(destination), destination_limit)
+                                       for destination, destination_limit in (destination_limits or {}).items())
+        self.window = window
+        self.flows = {}
+        self.ring = deque()  # Keys of destinations with queued items, in turn order
+        self.count = 0
+        self.closed = False
+        self.condition = threading.Condition(threading.Lock())
+
+    def flow(self, key):
+        """Return the flow of a destination key, creating it if new; called with the condition held"""
+        flow = self.flows.get(key)
+        if flow is None:
+            if len(self.flows) >= MAX_FLOWS:
+                for idle in [k for k, f in self.flows.items() if f.idle()]:
+                    del self.flows[idle]
+            flow = self.flows[key] = DestinationFlow(self.destination_limits.get(key, self.limits),
+                                                     self.window, time.time())
+        return flow
+
+    def qsize(self):
+        """Return the number of items queued"""
+        with self.condition:
+            return self.count
+
+    def put(self, item, block=True, timeout=None):
+        """Queue an item, blocking while the queue is full; raises queue.Full if not blocking or on timeout"""
+        destination, inform = self.classify(item)
+        key = destination_key(destination)
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while self.count >= self.maxsize:
+                remaining = None if deadline is None else deadline - time.time()
+                if not block or remaining is not None and remaining <= 0:
+                    raise queue.Full
+                self.condition.wait(remaining)
+            flow = self.flow(key)
+            if not flow.queue:
+                self.ring.append(key)
+            flow.queue.append((item, inform))
+            self.count += 1
+            self.condition.notify_all()
+
+    def put_nowait(self, item):
+        """Queue an item, raising queue.Full if there is no room"""
+        self.put(item, False)
+
+    def get(self):
+        """Return the next item due to be sent, waiting as needed; None once closed and empty"""
+        with self.condition:
+            while True:
+                if not self.count and self.closed:
+                    return None
+                now = time.time()
+                earliest = None
+                for _ in range(len(self.ring)):
+                    key = self.ring[0]
+                    self.ring.rotate(-1)
+                    flow = self.flows[key]
+                    ready = flow.ready_at(now)
+                    if ready is None:
+                        continue
+                    if ready <= now:
+                        item, inform = flow.queue.popleft()
+                        flow.dispatched(now, inform)
+                        if not flow.queue:
+                            self.ring.pop()  # Rotated to the end above
+                        self.count -= 1
+                        self.condition.notify_all()
+                        return item
+                    if earliest is None or ready < earliest:
+                        earliest = ready
+                self.condition.wait(None if earliest is None else earliest - now)
+
+    def done(self, item, congestion=None):
+        """Report that an item from get() was sent; congestion is TIMEOUT, UNREACHABLE or None"""
+        destination, inform = self.classify(item)
+        with self.condition:
+            flow = self.flows.get(destination_key(destination))
+            if flow:
+                flow.completed(time.time(), inform, congestion)
+            self.condition.notify_all()
+
+    def clear(self):
+        """Remove every queued item, returning the number removed"""
+        with self.condition:
+            removed = self.count
+            for flow in self.flows.values():
+                flow.queue.clear()
+            self.ring.clear()
+            self.count = 0
+            self.condition.notify_all()
+            return removed
+
+    def close(self):
+        """Make get() return None to every sender once the queue is empty"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def stats(self):
+        """Return the flow statistics of each destination"""
+        with self.condition:
+            return dict((key, flow.stats()) for key, flow in self.flows.items())
+
+
+def add_arguments(parser):
+    """Add the flow limit options to an argparse parser"""
+    parser.add_argument('--rate', type=float, default=0,
+                        help='notifications per second to each destination, default unlimited')
+    parser.add_argument('--burst', type=float, default=0,
+                        help='notifications sent at once to an idle destination (default one second of --rate)')
+    parser.add_argument('--max-inflight', type=int, default=0,
+                        help='InformRequests awaiting acknowledgment per destination (default half the senders)')
+    parser.add_argument('--limit', action='append', default=[], metavar='DEST=RATE[,BURST[,INFLIGHT]]',
+                        help='flow limits for one destination, overriding the above; may be repeated')
+    parser.add_argument('--no-adaptive', dest='adaptive', action='store_false',
+                        help='do not slow down on Inform timeouts or unreachable destinations')
+
+
+def limits_from_arguments(args):
+    """Return the (FlowLimits, destination FlowLimits dictionary) of parsed options, raising ValueError if invalid"""
+    limits = FlowLimits(args.rate, args.burst, args.max_inflight, args.adaptive)
+    destination_limits = {}
+    for text in args.limit:
+        destination, separator, values = text.rpartition('=')
+        if not separator or not destination:
+            raise ValueError('Destination flow limits must be given as DEST=RATE[,BURST[,INFLIGHT]].')
+        destination_limits[destination] = FlowLimits.parse(values, args.adaptive)
+    return limits, destination_limits
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+"""
+traphistory.py - Misner Trap Tool send history store
+Copyright (C) 2015-2017 Joe Misner <joe@misner.net>
+http://tools.misner.net/
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software Foundation,
+Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+Records every send in an SQLite database: destination, version, PDU,
+source OID, varbind digest, result, latency and time.  Senders only
+queue the notification; a background writer builds the rows and inserts
+them in batches, one transaction per batch, so recording costs the send
+path next to nothing.  If the writer falls behind by more than its
+queue, further sends are counted as dropped rather than slowing senders.
+
+The indexes serve queries by destination host, PDU, result and time,
+such as all failed Informs to one host today, without scanning the
+table however many rows it holds.
+
+python traphistory.py [--db history.sqlite] [--host HOST] [--pdu trap|inform]
+                      [--failed | --succeeded] [--today | --since DATE]
+                      [--limit N] [--count]
+"""
+
+import sys
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+from notification import parse_destination
+
+HISTORY_FILE = 'history.sqlite'
+QUEUE_SIZE = 100000           # Sends waiting to be written before further ones are dropped
+WRITE_BATCH = 1000            # Rows inserted per transaction
+QUERY_LIMIT = 1000
+FLUSH_TIMEOUT = 1             # Seconds the History tab waits for queued sends to be written
+FLUSH_POLL = 0.1              # Seconds between checks that the writer is still running while flushing
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sends (
+    id INTEGER PRIMARY KEY,
+    sent_at REAL NOT NULL,
+    host TEXT NOT NULL,
+    port INTEGER,
+    transport TEXT NOT NULL,
+    version TEXT NOT NULL,
+    pdu TEXT NOT NULL,
+    source_oid TEXT NOT NULL,
+    varbind_digest TEXT NOT NULL,
+    ok INTEGER NOT NULL,
+    error TEXT,
+    latency REAL,
+    origin TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sends_host ON sends (host, pdu, ok, sent_at);
+CREATE INDEX IF NOT EXISTS sends_result ON sends (ok, pdu, sent_at);
+CREATE INDEX IF NOT EXISTS sends_time ON sends (sent_at);
+"""
+COLUMNS = ('sent_at', 'host', 'port', 'transport', 'version', 'pdu', 'source_oid', 'varbind_digest',
+           'ok', 'error', 'latency', 'origin')
+INSERT = 'INSERT INTO sends (%s) VALUES (%s)' % (', '.join(COLUMNS), ', '.join('?' * len(COLUMNS)))
+PDUS = ('trap', 'inform')
+
+
+def _utf8(text):
+    """Return text as UTF-8 bytes; Python 2 str is passed through"""
+    if isinstance(text, bytes):
+        return text
+    return ('%s' % text).encode('utf-8')
+
+
+def varbind_digest(varbinds):
+    """Return a short digest of a notification's varbind rows, equal for sends with the same payload"""
+    digest = hashlib.sha1()
+    for varbind in varbinds:
+        # Stripped after encoding, so data that is not text (e.g. a JSON number) still digests
+        digest.update(b'\t'.join(_utf8(value).strip() for value in (varbind.oid, varbind.datatype, varbind.data)))
+        digest.update(b'\n')
+    return digest.hexdigest()[:16]
+
+
+def history_row(sent_at, notification, error, latency, origin):
+    """Return the sends table row of a recorded send"""
+    destination_address = notification.destination_address.strip()
+    try:
+        transport, host, port = parse_destination(destination_address)
+    except ValueError:
+        transport, host, port = 'udp', destination_address, None
+    try:
+        version = notification.version
+    except (IndexError, TypeError):
+        version = ''
+    return (sent_at, host, port, transport, version, 'inform' if notification.inform else 'trap',
+            notification.source_oid, varbind_digest(notification.varbinds), 0 if error else 1,
+            '%s' % error if error else None, latency, origin)
+
+
+def open_database(filename):
+    """Return a connection to a history database, creating its table and indexes if new"""
+    connection = sqlite3.connect(filename, timeout=30)
+    connection.execute('PRAGMA journal_mode=WAL')  # Readers do not wait for the writer, nor it for them
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def day_start(now=None):
+    """Return the Unix time of local midnight at the start of the day"""
+    return time.mktime(time.localtime(now)[:3] + (0, 0, 0, 0, 0, -1))
+
+
+def _filters(host=None, pdu=None, ok=None, since=None, until=None, source_oid=None):
+    """Return the WHERE clause and arguments of a history query"""
+    clauses = []
+    args = []
+    for column, value in (('host', host), ('pdu', pdu), ('ok', ok), ('source_oid', source_oid)):
+        if value is not None:
+            clauses.append('%s = ?' % column)
+            args.append(int(value) if column == 'ok' else value)
+    # Constrain skipped index columns to every value they can take, so SQLite can still use the
+    # later columns of sends_host and sends_result instead of scanning
+    if pdu is None and ok is not None:
+        clauses.append("pdu IN ('trap', 'inform')")
+    if ok is None and host is None and pdu is not None:
+        clauses.append('ok IN (0, 1)')
+    if since is not None:
+        clauses.append('sent_at >= ?')
+        args.append(since)
+    if until is not None:
+        clauses.append('sent_at < ?')
+        args.append(until)
+    if not clauses:
+        return '', args
+    return ' WHERE ' + ' AND '.join(clauses), args
+
+
+def query(connection, limit=QUERY_LIMIT, **filters):
+    """Return matching sends as dictionaries, newest first
+
+    Filters are host, pdu ('trap' or 'inform'), ok (True for sent, False
+    for failed), since and until (Unix times) and source_oid.
+    """
+    where, args = _filters(**filters)
+    cursor = connection.execute('SELECT %s FROM sends%s ORDER BY sent_at DESC LIMIT ?'
+                                % (', '.join(COLUMNS), where), args + [limit])
+    return [dict(zip(COLUMNS, row)) for row in cursor]
+
+
+def count(connection, **filters):
+    """Return the number of matching sends; filters as for query()"""
+    where, args = _filters(**filters)
+    return connection.execute('SELECT COUNT(*) FROM sends%s' % where, args).fetchone()[0]
+
+
+def display_fields(row):
+    """Return the (time, destination, version, PDU, source OID, latency, result) text of a send"""
+    destination = row['host'] if row['port'] is None else '%s:%s' % (row['host'], row['port'])
+    if row['transport'] == 'tcp':
+        destination = 'tcp:' + destination
+    latency = '' if row['latency'] is None else '%.1f ms' % (row['latency'] * 1000)
+    return (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['sent_at'])), destination, row['version'],
+            row['pdu'], row['source_oid'], latency, 'sent' if row['ok'] else 'FAILED: %s' % row['error'])
+
+
+def format_row(row):
+    """Return one send as a line of text"""
+    return '%s  %-21s %-7s %-6s %-24s %9s  %s' % display_fields(row)
+
+
+class HistoryWriter(threading.Thread):
+    """Background thread writing recorded sends to a history database in batched transactions"""
+    def __init__(self, filename, queue_size=QUEUE_SIZE):
+        """Executed when the HistoryWriter() object is created; raises sqlite3.Error if unusable"""
+        threading.Thread.__init__(self, name='HistoryWriter')
+        self.daemon = True
+        self.filename = filename
+        self.queue = queue.Queue(queue_size)
+        self.written = 0
+        self.dropped = 0
+        self.error = None
+        open_database(filename).close()  # Report an unusable database to the caller, not the thread
+
+    def record(self, notification, error=None, latency=None, origin='gui'):
+        """Queue a send to be written, without blocking; latency is in seconds"""
+        try:
+            self.queue.put_nowait((time.time(), notification, error, latency, origin))
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        """Write queued sends until stopped"""
+        connection = open_database(self.filename)
+        try:
+            while True:
+                batch = [self.queue.get()]
+                while batch[-1] is not None and len(batch) < WRITE_BATCH:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                rows = []
+                for item in batch:
+                    if item is None:
+                        continue
+                    try:
+                        rows.append(history_row(*item))
+                    except Exception as e:  # A send that cannot be recorded is dropped, not the writer
+                        self.error = e
+                        self.dropped += 1
+                if rows:
+                    try:
+                        with connection:  # One transaction per batch
+                            connection.executemany(INSERT, rows)
+                        self.written += len(rows)
+                    except sqlite3.Error as e:
+                        self.error = e
+                        self.dropped += len(rows)
+                for _ in batch:
+                    self.queue.task_done()
+                if batch[-1] is None:
+                    break
+        finally:
+            connection.close()
+
+    def flush(self, timeout=None):
+        """Wait until every queued send has been written, or for timeout seconds; return whether all were"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks and self.is_alive():
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(FLUSH_POLL if remaining is None else min(remaining, FLUSH_POLL))
+            return not self.queue.unfinished_tasks
+
+    def stop(self):
+        """Write what is queued, then stop the thread"""
+        self.queue.put(None)
+        self.join()
+
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description='Query the send history database.')
+    parser.add_argument('--db', default=HISTORY_FILE, help='history database (default %(default)s)')
+    parser.add_argument('--host', help='destination host, as entered')
+    parser.add_argument('--pdu', choices=PDUS, help='only Traps or only InformRequests')
+    result = parser.add_mutually_exclusive_group()
+    result.add_argument('--failed', dest='ok', action='store_false', default=None, help='only failed sends')
+    result.add_argument('--succeeded', dest='ok', action='store_true', default=None, help='only successful sends')
+    period = parser.add_mutually_exclusive_group()
+    period.add_argument('--today', action='store_true', help='only sends since local midnight')
+    period.add_argument('--since', help='only sends since a local date and time, YYYY-MM-DD[ HH:MM]')
+    parser.add_argument('--source-oid', help='only notifications with this source OID')
+    parser.add_argument('--limit', type=int, default=QUERY_LIMIT, help='most rows shown (default %(default)s)')
+    parser.add_argument('--count', action='store_true', help='only show the number of matching sends')
+    args = parser.parse_args(argv)
+
+    since = day_start() if args.today else None
+    if args.since:
+        for date_format in ('%Y-%m-%d %H:%M', '%Y-%m-%d'):
+            try:
+                since = time.mktime(time.strptime(args.since, date_format))
+                break
+            except ValueError:
+                pass
+        else:
+            print('Error: --since must be given as YYYY-MM-DD[ HH:MM]')
+            return 1
+    filters = {'host': args.host, 'pdu': args.pdu, 'ok': args.ok, 'since': since, 'source_oid': args.source_oid}
+    try:
+        connection = open_database(args.db)
+    except sqlite3.Error as e:
+        print('Error: unable to open %s: %s' % (args.db, e))
+        return 1
+    try:
+        if args.count:
+            print(count(connection, **filters))
+        else:
+            for row in query(connection, args.limit, **filters):
+                print(format_row(row))
+    finally:
+        connection.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+"""
+trapmetrics.py - Misner Trap Tool send pipeline metrics
+Copyright (C) 2015-2017 Joe Misner <joe@misner.net>
+http://tools.misner.net/
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software Foundation,
+Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+Per-stage timings and counters for the send pipeline, with exporters
+writing them periodically as a Prometheus text file or as statsd-style
+UDP datagrams.
+
+Stages recorded by the main window:
+- validate:     form field checks
+- varbinds:     varbind conversion from the table
+- dns:          destination and agent address resolution
+- engine_setup: PySNMP engine and context creation
+- encode:       message build, BER encoding and USM processing, including
+                SNMPv3 key localization on an engine's first send
+- socket:       handing the encoded trap to the transport
+- inform_wait:  InformRequest sent until its response arrived
+"""
+
+import os
+import sys
+import socket
+import threading
+from notification import timer
+
+METRICS_PREFIX = 'misnertraptool'
+EXPORT_INTERVAL = 10   # Seconds between exporter flushes
+
+# Upper bounds in seconds of the stage duration histogram buckets
+STAGE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+COUNTERS = ('sends', 'errors', 'retries', 'bytes', 'inform_timeouts')
+
+
+class StageTimer(object):
+    """Context manager recording the duration of a block as a stage"""
+    __slots__ = ('metrics', 'stage', 'started')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(self.stage, timer() - self.started)
+
+
+class Metrics(object):
+    """Thread-safe stage duration histograms and counters"""
+    def __init__(self):
+        """Executed when the Metrics() object is created"""
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clear all recorded values"""
+        with self.lock:
+            self.counters = dict((name, 0) for name in COUNTERS)
+            self.stages = {}  # Stage name: [count, total seconds, max seconds, bucket counts...]
+
+    def increment(self, name, value=1):
+        """Add value to a counter"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, stage, seconds):
+        """Record one duration of a stage"""
+        with self.lock:
+            try:
+                entry = self.stages[stage]
+            except KeyError:
+                entry = self.stages[stage] = [0, 0.0, 0.0] + [0] * len(STAGE_BUCKETS)
+            entry[0] += 1
+            entry[1] += seconds
+            if seconds > entry[2]:
+                entry[2] = seconds
+            for index, bound in enumerate(STAGE_BUCKETS):
+                if seconds <= bound:
+                    entry[3 + index] += 1
+                    break
+
+    def timer(self, stage):
+        """Return a context manager timing a block as stage"""
+        return StageTimer(self, stage)
+
+    def snapshot(self):
+        """Return a copy of the counters and stages as (counters, stages)"""
+        with self.lock:
+            return dict(self.counters), dict((stage, list(entry)) for stage, entry in self.stages.items())
+
+    def summary_lines(self):
+        """Return the metrics as lines of text for the stats panel"""
+        counters, stages = self.snapshot()
+        lines = ['%-16s %8s %10s %10s' % ('Stage', 'Count', 'Avg ms', 'Max ms')]
+        for stage in sorted(stages):
+            count, total, maximum = stages[stage][:3]
+            lines.append('%-16s %8s %10.3f %10.3f' % (stage, count, total / count * 1000, maximum * 1000))
+        lines.append('')
+        for name in sorted(counters):
+            lines.append('%-16s %8s' % (name, counters[name]))
+        return lines
+
+    def prometheus_text(self, prefix=METRICS_PREFIX):
+        """Return the metrics in the Prometheus text exposition format"""
+        counters, stages = self.snapshot()
+        lines = []
+        for name in sorted(counters):
+            lines.append('# TYPE %s_%s_total counter' % (prefix, name))
+            lines.append('%s_%s_total %s' % (prefix, name, counters[name]))
+        lines.append('# HELP %s_stage_seconds Time spent in each send pipeline stage' % prefix)
+        lines.append('# TYPE %s_stage_seconds histogram' % prefix)
+        for stage in sorted(stages):
+            entry = stages[stage]
+            cumulative = 0
+            for index, bound in enumerate(STAGE_BUCKETS):
+                cumulative += entry[3 + index]
+                lines.append('%s_stage_seconds_bucket{stage="%s",le="%s"} %s' % (prefix, stage, bound, cumulative))
+            lines.append('%s_stage_seconds_bucket{stage="%s",le="+Inf"} %s' % (prefix, stage, entry[0]))
+            lines.append('%s_stage_seconds_sum{stage="%s"} %.9f' % (prefix, stage, entry[1]))
+            lines.append('%s_stage_seconds_count{stage="%s"} %s' % (prefix, stage, entry[0]))
+        return '\n'.join(lines) + '\n'
+
+
+class EngineObserver(object):
+    """Splits a PySNMP sendNotification() call into encode, socket and inform_wait stages
+
+    Uses the engine's execution observer: 'rfc3412.sendPdu' fires once the
+    message has been prepared and just before it is passed to the
+    transport, and again for each InformRequest retransmission.
+    """
+    EXECUTION_POINTS = ('rfc3412.sendPdu', 'rfc3412.receiveMessage:response')
+
+    def __init__(self, metrics, snmpEngine):
+        """Executed when the EngineObserver() object is created, just before sending"""
+        self.metrics = metrics
+        self.snmpEngine = snmpEngine
+        self.sent_at = None
+        self.responded_at = None
+        self.transmissions = 0
+        self.started = timer()
+        snmpEngine.observer.registerObserver(self.execution_point, *self.EXECUTION_POINTS)
+
+    def execution_point(self, snmpEngine, execpoint, variables, cbCtx):
+        """PySNMP observer callback"""
+        now = timer()
+        if execpoint == 'rfc3412.sendPdu':
+            if self.sent_at is None:
+                self.metrics.observe('encode', now - self.started)
+                self.sent_at = now
+            self.transmissions += 1
+            try:
+                self.metrics.increment('bytes', len(variables['outgoingMessage']))
+            except (KeyError, TypeError):
+                pass
+        elif self.responded_at is None:
+            self.responded_at = now
+
+    def finish(self, inform=False):
+        """Record the remaining stages once sendNotification() has returned"""
+        now = timer()
+        self.snmpEngine.observer.unregisterObserver(self.execution_point)
+        if self.sent_at is None:
+            return
+        if inform:
+            self.metrics.observe('inform_wait', (self.responded_at or now) - self.sent_at)
+            if self.transmissions > 1:
+                self.metrics.increment('retries', self.transmissions - 1)
+        else:
+            self.metrics.observe('socket', now - self.sent_at)
+
+
+class MetricsExporter(threading.Thread):
+    """Background thread flushing metrics every interval seconds"""
+    def __init__(self, metrics, interval=EXPORT_INTERVAL):
+        threading.Thread.__init__(self, name=self.__class__.__name__)
+        self.daemon = True
+        self.metrics = metrics
+        self.interval = interval
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.flush()
+        self.flush()
+
+    def stop(self):
+        """Flush a final time and stop the thread"""
+        self.stopping.set()
+        self.join(self.interval + 5)
+
+    def flush(self):
+        """Export the current metrics; subclasses write them to their destination"""
+        pass
+
+
+class PrometheusFileExporter(MetricsExporter):
+    """Writes the metrics to a Prometheus text file, e.g. for the node_exporter textfile collector"""
+    def __init__(self, metrics, filename, interval=EXPORT_INTERVAL):
+        MetricsExporter.__init__(self, metrics, interval)
+        self.filename = filename
+
+    def flush(self):
+        # Write to a temporary file first so scrapers never read a partial file; renaming over the old file is
+        # atomic on POSIX, but Windows will not rename onto an existing file, so there it is removed first
+        temporary = self.filename + '.tmp'
+        with open(temporary, 'w') as f:
+            f.write(self.metrics.prometheus_text())
+        if sys.platform == 'win32' and os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(temporary, self.filename)
+
+
+class StatsdExporter(MetricsExporter):
+    """Sends counter deltas and stage averages to a statsd-style UDP listener"""
+    def __init__(self, metrics, address, interval=EXPORT_INTERVAL, prefix=METRICS_PREFIX):
+        MetricsExporter.__init__(self, metrics, interval)
+        self.address = address
+        self.prefix = prefix
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.previous = ({}, {})
+
+    def flush(self):
+        counters, stages = self.metrics.snapshot()
+        previous_counters, previous_stages = self.previous
+        self.previous = (counters, stages)
+        lines = []
+        for name in sorted(counters):
+            delta = counters[name] - previous_counters.get(name, 0)
+            if delta:
+                lines.append('%s.%s:%s|c' % (self.prefix, name, delta))
+        for stage in sorted(stages):
+            count, total = stages[stage][:2]
+            previous = previous_stages.get(stage, [0, 0.0])
+            if count > previous[0]:
+                average = (total - previous[1]) / (count - previous[0])
+                lines.append('%s.stage.%s:%.3f|ms' % (self.prefix, stage, average * 1000))
+                lines.append('%s.stage.%s.count:%s|c' % (self.prefix, stage, count - previous[0]))
+        if lines:
+            try:
+                self.sock.sendto('\n'.join(lines).encode('ascii'), self.address)
+            except socket.error:
+                pass
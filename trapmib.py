@@ -0,0 +1,512 @@
+#!/usr/bin/env python
+"""
+trapmib.py - Misner Trap Tool MIB syntax lookup
+Copyright (C) 2015-2017 Joe Misner <joe@misner.net>
+http://tools.misner.net/
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software Foundation,
+Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+Reads the OBJECT-TYPE definitions of the MIB files in the mibs
+directory, with their textual conventions resolved, into a table of
+each object's OID, varbind data type, value ranges, string sizes and
+enumerations.  Only what varbind checking needs is parsed, so all the
+bundled MIBs load in about a tenth of a second.
+
+An OID looks up the object it names or is an instance of, and each
+looked-up OID is cached, so checking the varbinds of a large
+notification is one dictionary lookup per row.  Checking warns of data
+types other than the MIB's, turns enumeration labels such as down or
+down(2) into their numbers, and reports every value outside the MIB's
+ranges, sizes or enumerations at once.
+
+python trapmib.py [--mibs DIRECTORY] [--oid OID ...] [notification.ntf ...]
+"""
+
+import os
+import re
+import sys
+import argparse
+from notification import OID_TYPES, Notification, Varbind, character_test, timer
+
+MIBS_DIRECTORY = 'mibs'
+LOOKUP_CACHE_SIZE = 100000
+MAX_ERRORS = 20               # Varbind errors reported before the rest are only counted
+MAX_ENUMS = 12                # Enumerations described before the rest are elided
+
+TOKEN = re.compile(r'"[^"]*"|--.*?(?:--|$)|::=|\.\.|\'[0-9A-Fa-f]*\'[HhBb]|-?\d+|[A-Za-z](?:-?[A-Za-z0-9_])*|\S',
+                   re.M)
+ENUM_LABEL = re.compile(r'([A-Za-z][\w-]*)(?:\((-?\d+)\))?$')
+
+# Macros whose value is an OID; OBJECT-TYPE also has its syntax read
+OID_MACROS = frozenset(['OBJECT-TYPE', 'MODULE-IDENTITY', 'OBJECT-IDENTITY', 'NOTIFICATION-TYPE', 'OBJECT-GROUP',
+                        'NOTIFICATION-GROUP', 'MODULE-COMPLIANCE', 'AGENT-CAPABILITIES'])
+ROOT_OIDS = {'ccitt': '0', 'iso': '1', 'joint-iso-ccitt': '2'}
+
+# SMI base type: OID_TYPES data type, None where no varbind type can send it
+BASE_TYPES = {
+    'INTEGER':           0,
+    'Integer32':         0,
+    'Unsigned32':        1,
+    'Gauge32':           1,
+    'Gauge':             1,
+    'Counter32':         2,
+    'Counter':           2,
+    'OCTET STRING':      3,
+    'OBJECT IDENTIFIER': 5,
+    'TimeTicks':         6,
+    'IpAddress':         7,
+    'NetworkAddress':    7,
+    'Counter64':         None,
+    'Opaque':            None,
+    'BITS':              None
+}
+INTEGER_RANGES = {0: [(-2147483648, 2147483647)], 1: [(0, 4294967295)], 2: [(0, 4294967295)],
+                  6: [(0, 4294967295)]}
+
+
+def tokens(text):
+    """Return the tokens of MIB text, without comments or quoted text"""
+    return [token for token in TOKEN.findall(text) if token[0] != '"' and token[:2] != '--']
+
+
+def _closing(tokens, start):
+    """Return the index after the bracket closing the one at start"""
+    pairs = {'{': '}', '(': ')', '[': ']'}
+    stack = [pairs[tokens[start]]]
+    index = start + 1
+    while stack and index < len(tokens):
+        token = tokens[index]
+        if token in pairs:
+            stack.append(pairs[token])
+        elif token == stack[-1]:
+            stack.pop()
+        index += 1
+    return index
+
+
+def _value(token):
+    """Return the integer of a range bound: a number, a hex or binary string, or None for MIN and MAX"""
+    if token[0] == "'":
+        return int(token[1:-2] or '0', 16 if token[-1] in 'Hh' else 2)
+    try:
+        return int(token)
+    except ValueError:
+        return None
+
+
+def _ranges(tokens, start, end):
+    """Return the (low, high) ranges between the brackets at start and end, e.g. (0..255 | 300)"""
+    ranges = []
+    for part in ' '.join(tokens[start + 1:end - 1]).split('|'):
+        bounds = [_value(token) for token in part.split() if token != '..']
+        if bounds:
+            ranges.append((bounds[0], bounds[-1]))
+    return ranges
+
+
+def parse_syntax(tokens, index):
+    """Return ((base type, enumerations, ranges, sizes), next index) of the SYNTAX starting at index"""
+    if tokens[index] in ('OCTET', 'OBJECT'):
+        base = '%s %s' % (tokens[index], tokens[index + 1])
+        index += 2
+    elif tokens[index] == 'SEQUENCE':
+        return None, index + 1
+    else:
+        base = tokens[index]
+        index += 1
+    enums = ranges = sizes = None
+    if index < len(tokens) and tokens[index] == '{':
+        end = _closing(tokens, index)
+        enums = {}
+        for position in range(index + 1, end - 3):
+            if tokens[position + 1] == '(' and tokens[position + 3] == ')':
+                enums[tokens[position]] = int(tokens[position + 2])
+        index = end
+    if index < len(tokens) and tokens[index] == '(':
+        end = _closing(tokens, index)
+        if tokens[index + 1] == 'SIZE':
+            sizes = _ranges(tokens, index + 2, _closing(tokens, index + 2))
+        else:
+            ranges = _ranges(tokens, index, end)
+        index = end
+    return (base, enums, ranges, sizes), index
+
+
+def parse_module(tokens, start):
+    """Return (module name, OID assignments, type assignments, object syntaxes, next index) of one module
+
+    OID assignments map a name to its list of {parent component...}
+    tokens; type assignments and object syntaxes map a name to a syntax
+    tuple from parse_syntax().
+    """
+    module = tokens[start]
+    oids = {}
+    types = {}
+    objects = {}
+    index = start + 4  # NAME DEFINITIONS ::= BEGIN
+    length = len(tokens)
+    while index < length and tokens[index] != 'END':
+        token = tokens[index]
+        following = tokens[index + 1] if index + 1 < length else ''
+        if token in ('IMPORTS', 'EXPORTS'):
+            while index < length and tokens[index] != ';':
+                index += 1
+            index += 1
+        elif following == 'MACRO':
+            while index < length and tokens[index] != 'END':  # Macro definitions end with their own END
+                index += 1
+            index += 1
+        elif following == 'OBJECT' and tokens[index + 2:index + 4] == ['IDENTIFIER', '::=']:
+            end = _closing(tokens, index + 4)
+            oids[token] = tokens[index + 5:end - 1]
+            index = end
+        elif following in OID_MACROS or following == 'TRAP-TYPE':
+            syntax = None
+            index += 2
+            while index < length and tokens[index] != '::=':
+                if tokens[index] == 'SYNTAX' and following == 'OBJECT-TYPE' and syntax is None:
+                    syntax, index = parse_syntax(tokens, index + 1)
+                else:
+                    index += 1
+            if index + 1 < length and tokens[index + 1] == '{':
+                end = _closing(tokens, index + 1)
+                oids[token] = tokens[index + 2:end - 1]
+                if syntax:
+                    objects[token] = syntax
+                index = end
+            else:
+                index += 2  # TRAP-TYPE numbers
+        elif following == '::=':
+            index += 2
+            if tokens[index] == 'TEXTUAL-CONVENTION':
+                while index < length and tokens[index] != 'SYNTAX':
+                    index += 1
+                index += 1
+            elif tokens[index] == '[':  # [APPLICATION n] IMPLICIT base type
+                index = _closing(tokens, index)
+                if tokens[index] == 'IMPLICIT':
+                    index += 1
+            if tokens[index] in ('SEQUENCE', 'CHOICE') and tokens[index + 1] == '{':
+                index = _closing(tokens, index + 1)
+            else:
+                types[token], index = parse_syntax(tokens, index)
+        else:
+            index += 1
+    return module, oids, types, objects, index + 1
+
+
+class MibObject(object):
+    """An OBJECT-TYPE's syntax, with the checks it puts on varbind values"""
+    __slots__ = ('module', 'name', 'oid', 'syntax', 'datatype', 'enums', 'labels', 'ranges', 'sizes')
+
+    def __init__(self, module, name, oid, syntax, datatype, enums=None, ranges=None, sizes=None):
+        """Executed when the MibObject() object is created"""
+        self.module = module
+        self.name = name
+        self.oid = oid
+        self.syntax = syntax  # Type name as written in the MIB
+        self.datatype = datatype  # OID_TYPES key, or None if no varbind type can send it
+        self.enums = enums  # Label: number
+        self.labels = dict((number, label) for label, number in enums.items()) if enums else None
+        self.ranges = ranges
+        self.sizes = sizes
+
+    def describe(self):
+        """Return the object's name and syntax, e.g. IF-MIB::ifAdminStatus INTEGER {up(1), down(2), testing(3)}"""
+        text = '%s::%s %s' % (self.module, self.name, self.syntax)
+        if self.enums:
+            text += ' {%s}' % self.enum_text()
+        elif self.ranges:
+            text += ' (%s)' % self.range_text(self.ranges)
+        elif self.sizes:
+            text += ' (SIZE (%s))' % self.range_text(self.sizes)
+        return text
+
+    def enum_text(self):
+        """Return the enumerations as label(number) text, eliding all but the first MAX_ENUMS"""
+        numbers = sorted(self.labels)
+        text = ', '.join('%s(%s)' % (self.labels[number], number) for number in numbers[:MAX_ENUMS])
+        if len(numbers) > MAX_ENUMS:
+            text += ', ... %s more' % (len(numbers) - MAX_ENUMS)
+        return text
+
+    @staticmethod
+    def range_text(ranges):
+        """Return ranges as MIB range text"""
+        return ' | '.join(str(low) if low == high else '%s..%s' % (low, high) for low, high in ranges)
+
+    def type_warning(self, datatype):
+        """Return a warning if a varbind data type is not this object's, otherwise None"""
+        if self.datatype is None or datatype == str(self.datatype):
+            return None  # Counter64, Opaque and BITS have no varbind type to compare with
+        return '%s is %s, so its data type should be %s.' % (self.name, self.syntax, OID_TYPES[self.datatype][0])
+
+    def check(self, data):
+        """Return the data to send for a value of this object's data type, raising ValueError if the MIB
+        does not allow it
+
+        Enumeration labels, alone or as label(number), become numbers.
+        """
+        if self.datatype is None:
+            return data
+        if self.enums:
+            data = data.strip()
+            label = ENUM_LABEL.match(data)
+            if label and label.group(1) in self.enums:
+                number = self.enums[label.group(1)]
+                if label.group(2) is not None and int(label.group(2)) != number:
+                    raise ValueError('%s has %s(%s), not %s.' % (self.name, label.group(1), number, data))
+                return str(number)
+            try:
+                number = int(data)
+            except ValueError:
+                number = None
+            if number not in self.labels:
+                raise ValueError('%s must be one of %s, not %s.' % (self.name, self.enum_text(), data))
+            return data
+        if self.ranges:
+            try:
+                value = int(data)
+            except ValueError:
+                return data  # Left for the data type's own check to report
+            if not any((low is None or low <= value) and (high is None or value <= high)
+                       for low, high in self.ranges):
+                raise ValueError('%s must be in %s, not %s.' % (self.name, self.range_text(self.ranges), value))
+        elif self.sizes:
+            size = len(data)
+            if not any((low is None or low <= size) and (high is None or size <= high) for low, high in self.sizes):
+                raise ValueError('%s must be %s characters long, not %s.'
+                                 % (self.name, self.range_text(self.sizes), size))
+        return data
+
+
+def build_objects(modules):
+    """Return {OID: MibObject} from parse_module() results, resolving names, OIDs and textual conventions"""
+    module_oids = dict((module, oids) for module, oids, types, objects in modules)
+    all_oids = {}
+    all_types = {}
+    for module, oids, types, objects in modules:
+        for name, value in oids.items():
+            all_oids.setdefault(name, (module, value))
+        for name, syntax in types.items():
+            all_types.setdefault(name, syntax)
+    resolved = {}
+
+    def resolve(module, name, depth=0):
+        if name in ROOT_OIDS:
+            return ROOT_OIDS[name]
+        key = (module, name)
+        if key in resolved:
+            return resolved[key]
+        if name in module_oids.get(module, ()):
+            value = module_oids[module][name]
+        elif name in all_oids:
+            module, value = all_oids[name]
+        else:
+            return None
+        arcs = []
+        for position, component in enumerate(value):
+            if component in '()':
+                continue
+            if component.isdigit():
+                arcs.append(component)  # A bare arc, or the number of a name(number) arc
+            elif position == 0 and not (len(value) > 1 and value[1] == '('):
+                if depth > 50:
+                    return None
+                parent = resolve(module, component, depth + 1)
+                if parent is None:
+                    return None
+                arcs.append(parent)
+        resolved[key] = '.'.join(arcs)
+        return resolved[key]
+
+    table = {}
+    for module, oids, types, objects in modules:
+        for name, syntax in objects.items():
+            oid = resolve(module, name)
+            if oid is None or oid in table and table[oid].module != 'RFC1213-MIB':
+                continue  # SMIv1 RFC1213-MIB objects give way to their SMIv2 redefinitions
+            base, enums, ranges, sizes = syntax
+            written = base
+            seen = set()
+            while base not in BASE_TYPES and base in all_types and base not in seen:
+                seen.add(base)
+                base, base_enums, base_ranges, base_sizes = all_types[base]
+                enums = enums or base_enums
+                ranges = ranges or base_ranges
+                sizes = sizes or base_sizes
+            if base not in BASE_TYPES:
+                continue
+            datatype = BASE_TYPES[base]
+            if ranges and datatype not in INTEGER_RANGES:
+                ranges = None  # Ranges on strings and such are sizes written without SIZE, which MIBs should not do
+            table[oid] = MibObject(module, name, oid, written, datatype, enums, ranges, sizes)
+    return table
+
+
+def parse_directory(directory):
+    """Return {OID: MibObject} of every MIB module in the files of a directory"""
+    modules = []
+    for filename in sorted(os.listdir(directory)):
+        path = os.path.join(directory, filename)
+        if not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as mib_file:
+            text = mib_file.read().decode('latin-1')
+        mib_tokens = tokens(text)
+        index = 0
+        while index + 3 < len(mib_tokens):
+            if mib_tokens[index + 1:index + 4] == ['DEFINITIONS', '::=', 'BEGIN']:
+                module, oids, types, objects, index = parse_module(mib_tokens, index)
+                modules.append((module, oids, types, objects))
+            else:
+                index += 1
+    return build_objects(modules)
+
+
+class MibIndex(object):
+    """Looks up the MIB object of varbind OIDs, caching each looked-up OID"""
+    def __init__(self, directory):
+        """Executed when the MibIndex() object is created; raises EnvironmentError if unreadable"""
+        self.directory = directory
+        self.objects = parse_directory(directory)
+        self.lookups = {}
+
+    def lookup(self, oid):
+        """Return (MibObject, instance suffix) of the object an OID names or is an instance of, or None"""
+        oid = oid.strip().lstrip('.')
+        try:
+            return self.lookups[oid]
+        except KeyError:
+            pass
+        found = None
+        prefix = oid
+        suffix = ''
+        while prefix:
+            mib_object = self.objects.get(prefix)
+            if mib_object:
+                found = (mib_object, suffix)
+                break
+            prefix, _, arc = prefix.rpartition('.')
+            suffix = '.' + arc + suffix
+        if len(self.lookups) >= LOOKUP_CACHE_SIZE:
+            self.lookups.clear()
+        self.lookups[oid] = found
+        return found
+
+    def describe(self, oid):
+        """Return the name, instance and syntax of an OID, or None if it is not in the MIBs"""
+        found = self.lookup(oid)
+        if not found:
+            return None
+        mib_object, suffix = found
+        return '%s%s: %s' % (mib_object.name, suffix, mib_object.describe())
+
+    def datatype(self, oid):
+        """Return the OID_TYPES data type of an OID's object, or None if unknown or unsendable"""
+        found = self.lookup(oid)
+        return found[0].datatype if found else None
+
+    def check_varbinds(self, varbinds, fill_types=False):
+        """Return (checked Varbinds, error messages, warning messages) for a list of Varbinds, in one pass
+
+        Enumeration labels become numbers.  A row whose data type differs
+        from the MIB's is only warned about and sent as typed, since the
+        MIB's values do not apply to it; with fill_types, the MIB's data
+        type replaces each row's own instead.  OIDs which are not in the
+        MIBs pass unchecked.
+        """
+        checked = []
+        errors = []
+        warnings = []
+        for row, varbind in enumerate(varbinds):
+            found = self.lookup(varbind.oid) if character_test(varbind.oid.strip(), '0123456789.') else None
+            if not found:
+                checked.append(varbind)
+                continue
+            mib_object = found[0]
+            datatype = varbind.datatype
+            if fill_types and mib_object.datatype is not None:
+                datatype = str(mib_object.datatype)
+            warning = mib_object.type_warning(datatype)
+            if warning:
+                warnings.append('Varbind row %s: %s' % (row + 1, warning))
+                checked.append(varbind)
+                continue
+            try:
+                data = mib_object.check(varbind.data)
+            except ValueError as e:
+                errors.append('Varbind row %s: %s' % (row + 1, e))
+                checked.append(varbind)
+                continue
+            if datatype == varbind.datatype and data == varbind.data:
+                checked.append(varbind)
+            else:
+                checked.append(Varbind(varbind.oid, datatype, data))
+        return checked, errors, warnings
+
+    def check_notification(self, notification, fill_types=False):
+        """Return (copy of a Notification with checked varbinds, warning messages), raising ValueError listing
+        every error
+        """
+        varbinds, errors, warnings = self.check_varbinds(notification.varbinds, fill_types)
+        if errors:
+            shown = errors[:MAX_ERRORS]
+            if len(errors) > MAX_ERRORS:
+                shown.append('... and %s more.' % (len(errors) - MAX_ERRORS))
+            raise ValueError('\n'.join(shown))
+        return notification.copy(varbinds=varbinds), warnings
+
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description='Look up OIDs and check notification varbinds against MIBs.')
+    parser.add_argument('notifications', nargs='*', metavar='notification.ntf', help='notification files to check')
+    parser.add_argument('--mibs', default=MIBS_DIRECTORY, help='MIB directory (default %(default)s)')
+    parser.add_argument('--oid', action='append', default=[], help='OID to look up; may be repeated')
+    args = parser.parse_args(argv)
+
+    started = timer()
+    try:
+        index = MibIndex(args.mibs)
+    except EnvironmentError as e:
+        print('Error: unable to read MIBs from %s: %s' % (args.mibs, e))
+        return 1
+    print('%s MIB objects loaded in %.3f seconds' % (len(index.objects), timer() - started))
+    for oid in args.oid:
+        print('%s = %s' % (oid, index.describe(oid) or 'not found in the MIBs'))
+    status = 0
+    for filename in args.notifications:
+        try:
+            notification = Notification.open(filename)
+        except Exception as e:  # shelve raises a different error per dbm module
+            print('Error: unable to open %s: %s' % (filename, e))
+            status = 1
+            continue
+        started = timer()
+        varbinds, errors, warnings = index.check_varbinds(notification.varbinds)
+        print('%s: %s varbinds checked in %.3f seconds, %s errors, %s warnings'
+              % (filename, len(varbinds), timer() - started, len(errors), len(warnings)))
+        for error in errors:
+            print('  ' + error)
+        for warning in warnings:
+            print('  Warning: ' + warning)
+        if errors:
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+trapprofile.py - Misner Trap Tool on-demand profiling
+Copyright (C) 2015-2017 Joe Misner <joe@misner.net>
+http://tools.misner.net/
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software Foundation,
+Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+Wraps sends and batch runs in the cProfile deterministic profiler, and
+where the tracemalloc module is available (Python 3.4 and later) takes
+allocation snapshots before and after; on Python 2.7, live object counts
+by type from the garbage collector are compared instead.  Each run is
+dumped to the profile directory as NNNN-name.prof (load with pstats or
+snakeviz) and NNNN-name.tracemalloc (load with tracemalloc.Snapshot.load),
+and a short summary of the hottest functions is returned for the Output
+tab.
+"""
+
+import os
+import gc
+import time
+import cProfile
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+PROFILE_TOP = 10
+ALLOCATION_TOP = 5
+TRACEMALLOC_FRAMES = 10
+
+
+def object_counts():
+    """Return the number of live objects tracked by the garbage collector, by type name"""
+    gc.collect()
+    counts = {}
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+def function_name(func):
+    """Return a short file:line(function) label for a pstats function key"""
+    filename, line, name = func
+    if filename == '~':
+        return name  # Built-in functions
+    return '%s:%s(%s)' % (os.path.basename(filename), line, name)
+
+
+class Profiler(object):
+    """Profiles callables, dumping each run into a directory"""
+    def __init__(self, directory, top=PROFILE_TOP):
+        """Executed when the Profiler() object is created"""
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.top = top
+        self.runs = 0
+
+    def run(self, name, func, *args, **kwargs):
+        """Call func under the profiler, returning (result, summary lines)"""
+        self.runs += 1
+        basename = os.path.join(self.directory, '%04d-%s' % (self.runs, name))
+
+        started_tracemalloc = False
+        before = None
+        if tracemalloc:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                started_tracemalloc = True
+            before = tracemalloc.take_snapshot()
+        else:
+            counts_before = object_counts()
+
+        profile = cProfile.Profile()
+        started = time.time()
+        try:
+            result = profile.runcall(func, *args, **kwargs)
+        finally:
+            elapsed = time.time() - started
+            profile.dump_stats(basename + '.prof')
+            lines = ['Profile %s took %.3f seconds, saved to %s.prof' % (name, elapsed, basename)]
+            lines.extend(self.hot_functions(profile))
+            if before is not None:
+                after = tracemalloc.take_snapshot()
+                after.dump(basename + '.tracemalloc')
+                lines.extend(self.allocations(before, after))
+                if started_tracemalloc:
+                    tracemalloc.stop()
+            elif not tracemalloc:
+                lines.extend(self.object_growth(counts_before, object_counts()))
+        return result, lines
+
+    def hot_functions(self, profile):
+        """Return summary lines of the functions with the most time spent in themselves"""
+        profile.create_stats()
+        entries = sorted(profile.stats.items(), key=lambda item: item[1][2], reverse=True)
+        lines = ['%10s %10s %9s  %s' % ('self ms', 'total ms', 'calls', 'function')]
+        for func, (primitive_calls, calls, self_time, total_time, callers) in entries[:self.top]:
+            lines.append('%10.2f %10.2f %9s  %s' % (self_time * 1000, total_time * 1000, calls, function_name(func)))
+        return lines
+
+    def allocations(self, before, after):
+        """Return summary lines of the source lines allocating the most memory during the run"""
+        lines = ['Top allocations:']
+        for stat in after.compare_to(before, 'lineno')[:ALLOCATION_TOP]:
+            frame = stat.traceback[0]
+            lines.append('%10.1f KB %+9s blocks  %s:%s' % (stat.size_diff / 1024.0, stat.count_diff,
+                                                          os.path.basename(frame.filename), frame.lineno))
+        return lines
+
+    def object_growth(self, before, after):
+        """Return summary lines of the object types whose live count grew the most during the run"""
+        growth = [(after[name] - before.get(name, 0), name) for name in after]
+        lines = ['Top object count growth (objects tracked by the garbage collector):']
+        for count, name in sorted(growth, reverse=True)[:ALLOCATION_TOP]:
+            if count > 0:
+                lines.append('%+10d objects  %s' % (count, name))
+        return lines
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+"""
+trapreceiver.py - Misner Trap Tool loopback notification receiver
+Copyright (C) 2015-2017 Joe Misner <joe@misner.net>
+http://tools.misner.net/
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software Foundation,
+Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+Lightweight SNMPv1/v2c/v3 trap and InformRequest receiver, run on its own
+thread and normally bound to localhost.  Sent notifications carry an
+extra sequence varbind; the receiver matches each arrival against what
+was sent to report end-to-end latency, loss, reordering, duplicates and
+payload mismatches without needing an external SNMP manager.
+
+python trapreceiver.py [--count N] [--version 1|2c|3] [--inform] [--port N]
+"""
+
+import sys
+import time
+import argparse
+import threading
+from array import array
+from pysnmp.entity import engine, config
+from pysnmp.entity.rfc3413 import ntfrcv
+from pysnmp.entity.rfc3413.oneliner import ntforg
+from pysnmp.carrier.asyncore.dgram import udp
+from pysnmp.proto import rfc1902
+from pyasn1.type import univ
+from notification import error_indication, timer
+
+LOOPBACK_ADDRESS = '127.0.0.1'
+LOOPBACK_PORT = 16162
+LOOPBACK_COMMUNITY = 'public'
+LOOPBACK_USER = 'loopback'
+
+# Fixed engine IDs so SNMPv3 traps from the loopback sender can be authenticated by the receiver
+LOOPBACK_RECEIVER_ENGINE_ID = '8000000001020304'
+LOOPBACK_SENDER_ENGINE_ID = '8000000001020305'
+
+# Varbind injected into each tracked notification, under the tool's default enterprise OID
+SEQUENCE_OID = '1.3.6.1.4.1.3.1.1.255.1.0'
+
+# Varbinds added by the SNMP engine or by SNMPv1 to SNMPv2 translation, not part of the payload
+STANDARD_OIDS = frozenset([
+    '1.3.6.1.2.1.1.3.0',      # sysUpTime
+    '1.3.6.1.6.3.1.1.4.1.0',  # snmpTrapOID
+    '1.3.6.1.6.3.18.1.3.0',   # snmpTrapAddress
+    '1.3.6.1.6.3.18.1.4.0',   # snmpTrapCommunity
+    '1.3.6.1.6.3.1.1.4.3.0',  # snmpTrapEnterprise
+    SEQUENCE_OID
+])
+
+SECURITY_MODELS = {1: 'SNMPv1', 2: 'SNMPv2c', 3: 'SNMPv3'}
+
+
+def varbinds_digest(varbinds):
+    """Return a digest of the payload varbinds, comparable between sent and received notifications"""
+    payload = []
+    for oid, value in varbinds:
+        oid = str(univ.ObjectIdentifier(oid))
+        if oid not in STANDARD_OIDS:
+            payload.append((oid, value.tagSet, value.prettyPrint()))
+    return hash(tuple(payload))
+
+
+def loopback_engine():
+    """Return a PySNMP engine using the loopback sender engine ID, for sending SNMPv3 traps to the receiver"""
+    return engine.SnmpEngine(snmpEngineID=rfc1902.OctetString(hexValue=LOOPBACK_SENDER_ENGINE_ID))
+
+
+class DeliveryTracker(object):
+    """Matches received notifications to sent ones by sequence number"""
+    def __init__(self):
+        """Executed when the DeliveryTracker() object is created"""
+        self.lock = threading.Lock()
+        self.pending = {}  # Sequence number: (time sent, payload digest)
+        self.next_sequence = 1
+        self.highest_received = 0
+        self.sent = 0
+        self.received = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.mismatched = 0
+        self.unmatched = 0
+        self.versions = {}
+        self.latencies = array('d')
+        self.started = timer()
+
+    def register(self, digest):
+        """Record a notification about to be sent, returning the sequence number to inject"""
+        with self.lock:
+            sequence = self.next_sequence
+            self.next_sequence += 1
+            self.sent += 1
+            self.pending[sequence] = (timer(), digest)
+        return sequence
+
+    def receive(self, sequence, digest, version=None):
+        """Record an arriving notification"""
+        now = timer()
+        with self.lock:
+            if version:
+                self.versions[version] = self.versions.get(version, 0) + 1
+            if sequence is None or sequence >= self.next_sequence:
+                self.unmatched += 1
+                return
+            try:
+                sent_time, sent_digest = self.pending.pop(sequence)
+            except KeyError:
+                self.duplicates += 1
+                return
+            self.received += 1
+            self.latencies.append(now - sent_time)
+            if sequence < self.highest_received:
+                self.reordered += 1
+            else:
+                self.highest_received = sequence
+            if digest != sent_digest:
+                self.mismatched += 1
+
+    def report(self):
+        """Return a dictionary of delivery statistics; notifications still pending count as lost"""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            report = {
+                'sent': self.sent,
+                'received': self.received,
+                'lost': len(self.pending),
+                'duplicates': self.duplicates,
+                'reordered': self.reordered,
+                'mismatched': self.mismatched,
+                'unmatched': self.unmatched,
+                'versions': dict(self.versions),
+                'elapsed': timer() - self.started
+            }
+        if latencies:
+            report['latency_min'] = latencies[0]
+            report['latency_avg'] = sum(latencies) / len(latencies)
+            for percentile in (50, 95, 99):
+                report['latency_p%s' % percentile] = latencies[min(len(latencies) - 1,
+                                                                   len(latencies) * percentile // 100)]
+            report['latency_max'] = latencies[-1]
+        return report
+
+
+def format_report(report):
+    """Return a delivery report as lines of text for the Output tab or console"""
+    lines = ['Sent %(sent)s, received %(received)s, lost %(lost)s, duplicates %(duplicates)s, '
+             'reordered %(reordered)s, mismatched %(mismatched)s, unmatched %(unmatched)s' % report]
+    if 'latency_avg' in report:
+        lines.append('Latency ms: min %.3f, avg %.3f, p50 %.3f, p95 %.3f, p99 %.3f, max %.3f'
+                     % tuple(report[key] * 1000 for key in ('latency_min', 'latency_avg', 'latency_p50',
+                                                           'latency_p95', 'latency_p99', 'latency_max')))
+    if report['versions']:
+        lines.append('Received by version: %s'
+                     % ', '.join('%s %s' % item for item in sorted(report['versions'].items())))
+    return lines
+
+
+class TrapReceiver(object):
+    """Notification receiver running a PySNMP engine on a background thread"""
+    def __init__(self, address=(LOOPBACK_ADDRESS, LOOPBACK_PORT), communities=(LOOPBACK_COMMUNITY,),
+                 users=((LOOPBACK_USER, None, None, None, None),), tracker=None):
+        """Executed when the TrapReceiver() object is created
+
+        users is a list of (security name, auth protocol, auth key, priv
+        protocol, priv key) tuples, using None for unused protocols.
+        """
+        self.address = address
+        self.tracker = tracker or DeliveryTracker()
+        self.thread = None
+        self.snmpEngine = engine.SnmpEngine(snmpEngineID=rfc1902.OctetString(hexValue=LOOPBACK_RECEIVER_ENGINE_ID))
+        self.transport = udp.UdpTransport().openServerMode(address)
+        config.addTransport(self.snmpEngine, udp.domainName, self.transport)
+        for index, community in enumerate(communities):
+            config.addV1System(self.snmpEngine, 'loopback-%s' % index, community)
+        for security_name, auth_protocol, auth_key, priv_protocol, priv_key in users:
+            # Informs authenticate against this engine's ID, traps against the sender's
+            for engine_id in (None, rfc1902.OctetString(hexValue=LOOPBACK_SENDER_ENGINE_ID)):
+                config.addV3User(self.snmpEngine, security_name,
+                                 auth_protocol or config.usmNoAuthProtocol, auth_key,
+                                 priv_protocol or config.usmNoPrivProtocol, priv_key,
+                                 securityEngineId=engine_id)
+        ntfrcv.NotificationReceiver(self.snmpEngine, self.notification_received)
+
+    def notification_received(self, snmpEngine, stateReference, contextEngineId, contextName, varBinds, cbCtx):
+        """PySNMP callback for each decoded notification"""
+        sequence = None
+        for oid, value in varBinds:
+            if str(oid) == SEQUENCE_OID:
+                sequence = int(value)
+                break
+        try:
+            execution_context = snmpEngine.observer.getExecutionContext('rfc3412.receiveMessage:request')
+            version = SECURITY_MODELS.get(int(execution_context['securityModel']))
+        except Exception:
+            version = None
+        self.tracker.receive(sequence, varbinds_digest(varBinds), version)
+
+    def port(self):
+        """Return the local port being received on, useful when bound to port 0"""
+        return self.transport.socket.getsockname()[1]
+
+    def start(self):
+        """Start receiving on a background thread"""
+        self.snmpEngine.transportDispatcher.jobStarted(1)
+        self.thread = threading.Thread(target=self.snmpEngine.transportDispatcher.runDispatcher,
+                                       name='TrapReceiver')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop receiving and close the listening socket"""
+        self.snmpEngine.transportDispatcher.jobFinished(1)
+        if self.thread:
+            self.thread.join(5)
+        self.snmpEngine.transportDispatcher.closeDispatcher()
+
+
+def send_loopback(count, notification_type='SNMPv2c Trap', port=LOOPBACK_PORT, varbind_total=4,
+                  tracker=None, auth_protocol=None, auth_key=None, priv_protocol=None, priv_key=None):
+    """Send count tracked notifications to a loopback receiver, returning the number of send errors"""
+    ntfOrg = ntforg.NotificationOriginator(loopback_engine())
+    transport_target = ntforg.UdpTransportTarget((LOOPBACK_ADDRESS, port), timeout=1, retries=0)
+    pdu = 'inform' if 'Inform' in notification_type else 'trap'
+    source_oid = '1.3.6.1.4.1.3.1.1.0.1'
+    if 'SNMPv3' in notification_type:
+        if auth_protocol is None:
+            authentication = ntforg.UsmUserData(LOOPBACK_USER)
+        elif priv_protocol is None:
+            authentication = ntforg.UsmUserData(LOOPBACK_USER, auth_key, authProtocol=auth_protocol)
+        else:
+            authentication = ntforg.UsmUserData(LOOPBACK_USER, auth_key, priv_key,
+                                                authProtocol=auth_protocol, privProtocol=priv_protocol)
+    else:
+        authentication = ntforg.CommunityData(LOOPBACK_COMMUNITY,
+                                              mpModel=0 if 'SNMPv1' in notification_type else 1)
+    payload = [('1.3.6.1.4.1.3.1.1.1.%s' % n, rfc1902.OctetString('loopback payload %s' % n))
+               for n in range(varbind_total)]
+    digest = varbinds_digest(payload)
+    errors = 0
+    for _ in range(count):
+        varbinds = list(payload)
+        if tracker:
+            varbinds.append((SEQUENCE_OID, rfc1902.Unsigned32(tracker.register(digest))))
+        if 'SNMPv1' in notification_type:
+            varbinds.append(('1.3.6.1.6.3.18.1.3.0', LOOPBACK_ADDRESS))
+            varbinds.append(('1.3.6.1.6.3.1.1.4.3.0', '1.3.6.1.4.1.3.1.1'))
+        if error_indication(ntfOrg.sendNotification(authentication, transport_target, pdu, source_oid, *varbinds)):
+            errors += 1
+    return errors
+
+
+def main(argv=None):
+    """Command-line entry point running a loopback send and receive benchmark"""
+    parser = argparse.ArgumentParser(description='Send notifications to a local receiver and report delivery.')
+    parser.add_argument('-n', '--count', type=int, default=1000, help='notifications to send')
+    parser.add_argument('-v', '--version', choices=['1', '2c', '3'], default='2c', help='SNMP version')
+    parser.add_argument('--inform', action='store_true', help='send InformRequests instead of traps')
+    parser.add_argument('--port', type=int, default=LOOPBACK_PORT, help='local receiver port')
+    parser.add_argument('--varbinds', type=int, default=4, help='payload varbinds per notification')
+    parser.add_argument('--wait', type=float, default=2.0, help='seconds to wait for late arrivals')
+    args = parser.parse_args(argv)
+
+    notification_type = 'SNMPv%s %s' % (args.version, 'Inform' if args.inform else 'Trap')
+    if notification_type == 'SNMPv1 Inform':
+        parser.error('SNMPv1 does not support InformRequests')
+
+    receiver = TrapReceiver((LOOPBACK_ADDRESS, args.port))
+    receiver.start()
+    try:
+        started = timer()
+        errors = send_loopback(args.count, notification_type, args.port, args.varbinds, receiver.tracker)
+        elapsed = timer() - started
+        time.sleep(args.wait)
+    finally:
+        receiver.stop()
+
+    print('%s: %s sent in %.2f seconds (%.0f/s), %s send errors'
+          % (notification_type, args.count, elapsed, args.count / max(elapsed, 0.001), errors))
+    for line in format_report(receiver.tracker.report()):
+        print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,697 @@
+#!/usr/bin/env python
+"""
+trapreplay.py - Misner Trap Tool capture replay
+Copyright (C) 2015-2017 Joe Misner <joe@misner.net>
+http://tools.misner.net/
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software Foundation,
+Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+Replays captured notifications through the trapapi SendService, at their
+original timing, sped up by --speed, or as fast as possible with
+--speed 0.  Captures are read one record at a time, so files of any
+size replay in constant memory:
+
+- tcpdump or Wireshark captures (pcap or pcapng, optionally gzipped) of
+  SNMPv1 and SNMPv2c notifications over UDP to --port (default 162);
+  SNMPv3 notifications cannot be decoded without the agent's keys and,
+  like IP fragments, are skipped
+- snmptrapd logs in its default output format, logged with -On so that
+  OIDs are numeric; timestamps have one second resolution, and lines
+  carry no community or PDU type, so notifications are replayed as
+  SNMPv2c Traps with --community (default public)
+
+Each notification goes to its original destination and community unless
+rewritten with --destination and --community.  Uptime, SNMPv2c request
+IDs and the sender's address are those of this tool, not the capture.
+Once done, the original time span is reported against the achieved one,
+along with how late each notification was sent against its schedule.
+
+python trapreplay.py [--speed FACTOR] [--destination ADDRESS]
+                     [--community COMMUNITY] [--port N] [--senders N]
+                     [--interval SECONDS] [--history history.sqlite]
+                     [--rate N] [--burst N] [--max-inflight N]
+                     capture.pcap | capture.pcapng | snmptrapd.log
+"""
+
+import re
+import sys
+import gzip
+import time
+import random
+import socket
+import struct
+import sqlite3
+import argparse
+import itertools
+import threading
+from array import array
+from notification import GENERIC_TRAP_TYPES, OID_TYPES, Notification, character_test, timer
+import trapapi
+import trapber
+import trapflow
+import traphistory
+
+REPLAY_QUEUE_SIZE = 1000      # Notifications due but not yet sent
+PROGRESS_INTERVAL = 5         # Seconds between progress lines
+MAX_SKIP_REASONS = 20         # Skip reasons counted separately before being counted together
+LAG_SAMPLES = 10000           # Send lags kept for percentiles
+TRAP_PORT = 162
+
+PCAP_MAGIC = {  # Magic number: (byte order, timestamp units)
+    b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+    b'\xd4\xc3\xb2\xa1': ('<', 1e-6),
+    b'\xa1\xb2\x3c\x4d': ('>', 1e-9),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e-9)
+}
+PCAPNG_MAGIC = b'\x0a\x0d\x0d\x0a'
+PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+PCAPNG_INTERFACE_BLOCK = 1
+PCAPNG_OBSOLETE_PACKET_BLOCK = 2
+PCAPNG_ENHANCED_PACKET_BLOCK = 6
+PCAPNG_TSRESOL_OPTION = 9
+
+# Link-layer header types
+LINKTYPE_NULL = 0             # BSD loopback, host byte order address family
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108           # OpenBSD loopback, network byte order address family
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+ETHERTYPE_VLAN = (0x8100, 0x88a8)
+IP_PROTOCOL_UDP = 17
+
+SNMP_VERSIONS = {0: 'SNMPv1', 1: 'SNMPv2c', 3: 'SNMPv3'}
+
+# BER tag: (OID_TYPES data type, unsigned)
+BER_DATA_TYPES = {
+    trapber.INTEGER:           (0, False),
+    trapber.UNSIGNED32:        (1, True),
+    trapber.COUNTER32:         (2, True),
+    trapber.OCTET_STRING:      (3, False),
+    trapber.NULL:              (4, False),
+    trapber.OBJECT_IDENTIFIER: (5, False),
+    trapber.TIME_TICKS:        (6, True),
+    trapber.IP_ADDRESS:        (7, False)
+}
+
+# snmptrapd log value type: OID_TYPES data type
+LOG_DATA_TYPES = {
+    'INTEGER':   0,
+    'Gauge32':   1,
+    'Unsigned32': 1,
+    'Counter32': 2,
+    'STRING':    3,
+    'Hex-STRING': 3,
+    'NULL':      4,
+    'OID':       5,
+    'Timeticks': 6,
+    'IpAddress': 7
+}
+LOG_SYMBOLIC_OIDS = {
+    'DISMAN-EVENT-MIB::sysUpTimeInstance': trapber.SYS_UPTIME_OID,
+    'SNMPv2-MIB::sysUpTime.0': trapber.SYS_UPTIME_OID,
+    'SNMPv2-MIB::snmpTrapOID.0': trapber.SNMP_TRAP_OID
+}
+LOG_HEADER = re.compile(r'(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d) (\S+) \[(.*)\]:[ \t]*(.*)$')
+LOG_TRANSPORT = re.compile(r'\[([^\]]+)\]:(\d+)->\[([^\]]+)\]:(\d+)')
+LOG_V1_TRAP = re.compile(r'\s*(.+) Trap \((\d+)\) Uptime:')
+LOG_LABELLED_INTEGER = re.compile(r'.*\((-?\d+)\)$')
+GENERIC_TRAP_NAMES = dict((name.split(' - ', 1)[1], index) for index, name in enumerate(GENERIC_TRAP_TYPES))
+
+
+def open_capture(filename):
+    """Return a binary file object reading a capture or log, decompressing .gz files"""
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def iter_pcap(stream, magic):
+    """Generator of (timestamp, link type, frame) from a pcap file whose 4 byte magic number has been read"""
+    byte_order, units = PCAP_MAGIC[magic]
+    header = stream.read(20)
+    if len(header) < 20:
+        raise ValueError('Truncated pcap file header.')
+    linktype = struct.unpack(byte_order + 'HHiIII', header)[5] & 0xffff
+    record = struct.Struct(byte_order + 'IIII')
+    while True:
+        header = stream.read(16)
+        if len(header) < 16:
+            break
+        seconds, fraction, captured, _ = record.unpack(header)
+        frame = stream.read(captured)
+        if len(frame) < captured:
+            break  # Capture cut short while being written
+        yield seconds + fraction * units, linktype, frame
+
+
+def pcapng_interface(body, byte_order):
+    """Return the (link type, timestamp units) of a pcapng interface description block body"""
+    linktype = struct.unpack(byte_order + 'H', body[:2])[0]
+    units = 1e-6
+    offset = 8
+    while offset + 4 <= len(body):
+        code, length = struct.unpack(byte_order + 'HH', body[offset:offset + 4])
+        if code == 0:
+            break
+        if code == PCAPNG_TSRESOL_OPTION and length == 1:
+            resolution = struct.unpack('B', body[offset + 4:offset + 5])[0]
+            units = 2.0 ** -(resolution & 0x7f) if resolution & 0x80 else 10.0 ** -resolution
+        offset += 4 + (length + 3) // 4 * 4
+    return linktype, units
+
+
+def iter_pcapng(stream, magic):
+    """Generator of (timestamp, link type, frame) from a pcapng file whose 4 byte magic number has been read"""
+    byte_order = '<'
+    interfaces = []  # (link type, timestamp units) by interface ID
+    block_type = magic
+    while len(block_type) == 4:
+        if block_type == PCAPNG_MAGIC:  # Section header block, setting the byte order of its section
+            header = stream.read(8)
+            if len(header) < 8:
+                break
+            byte_order = '<' if struct.unpack('<I', header[4:])[0] == PCAPNG_BYTE_ORDER_MAGIC else '>'
+            length = struct.unpack(byte_order + 'I', header[:4])[0]
+            stream.read(length - 12)
+            interfaces = []
+        else:
+            header = stream.read(4)
+            if len(header) < 4:
+                break
+            length = struct.unpack(byte_order + 'I', header)[0]
+            if length < 12:
+                raise ValueError('Malformed pcapng block.')
+            body = stream.read(length - 8)
+            if len(body) < length - 8:
+                break  # Capture cut short while being written
+            kind = struct.unpack(byte_order + 'I', block_type)[0]
+            if kind == PCAPNG_INTERFACE_BLOCK:
+                interfaces.append(pcapng_interface(body, byte_order))
+            elif kind in (PCAPNG_ENHANCED_PACKET_BLOCK, PCAPNG_OBSOLETE_PACKET_BLOCK):
+                if kind == PCAPNG_ENHANCED_PACKET_BLOCK:
+                    interface, high, low, captured = struct.unpack(byte_order + 'IIII', body[:16])
+                else:
+                    interface, _, high, low, captured = struct.unpack(byte_order + 'HHIII', body[:16])
+                try:
+                    linktype, units = interfaces[interface]
+                except IndexError:
+                    raise ValueError('Malformed pcapng packet block.')
+                yield (high << 32 | low) * units, linktype, body[20:20 + captured]
+        block_type = stream.read(4)
+
+
+def udp_datagram(linktype, frame):
+    """Return (source, destination, destination port, payload) of a frame holding a UDP datagram, else None
+
+    Addresses are None for IPv6.  The payload is None for the first
+    fragment of a fragmented datagram; later fragments return None.
+    """
+    if linktype == LINKTYPE_ETHERNET:
+        ethertype, = struct.unpack('!H', frame[12:14])
+        offset = 14
+        while ethertype in ETHERTYPE_VLAN:
+            ethertype, = struct.unpack('!H', frame[offset + 2:offset + 4])
+            offset += 4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        ethertype, = struct.unpack('!H', frame[14:16])
+        offset = 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        ethertype, = struct.unpack('!H', frame[:2])
+        offset = 20
+    elif linktype in (LINKTYPE_NULL, LINKTYPE_LOOP, LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        offset = 4 if linktype in (LINKTYPE_NULL, LINKTYPE_LOOP) else 0
+        ip_version = struct.unpack('B', frame[offset:offset + 1])[0] >> 4
+        ethertype = {4: ETHERTYPE_IPV4, 6: ETHERTYPE_IPV6}.get(ip_version)
+    else:
+        return None
+
+    fragmented = False
+    if ethertype == ETHERTYPE_IPV4:
+        version_length, fragment, protocol = struct.unpack('!B5xHxB', frame[offset:offset + 10])
+        if protocol != IP_PROTOCOL_UDP or fragment & 0x1fff:
+            return None
+        fragmented = fragment & 0x2000
+        source = socket.inet_ntoa(frame[offset + 12:offset + 16])
+        destination = socket.inet_ntoa(frame[offset + 16:offset + 20])
+        offset += (version_length & 0x0f) * 4
+    elif ethertype == ETHERTYPE_IPV6:
+        if struct.unpack('B', frame[offset + 6:offset + 7])[0] != IP_PROTOCOL_UDP:
+            return None
+        source = destination = None
+        offset += 40
+    else:
+        return None
+    destination_port, length = struct.unpack('!2xHH', frame[offset:offset + 6])
+    if fragmented:
+        return source, destination, destination_port, None
+    return source, destination, destination_port, frame[offset + 8:offset + max(length, 8)]
+
+
+def _elements(message, start, end):
+    """Generator of (tag, content start, content end) of the TLVs between start and end of a bytearray"""
+    offset = start
+    while offset < end:
+        element = trapber.read_tlv(message, offset)
+        if element is None or element[2] > end:
+            raise ValueError('Truncated SNMP message.')
+        yield element
+        offset = element[2]
+
+
+def ber_value(tag, content):
+    """Return the (OID_TYPES data type name, data) of a BER varbind value; raises ValueError if unsupported"""
+    try:
+        datatype, unsigned = BER_DATA_TYPES[tag]
+    except KeyError:
+        raise ValueError('Varbind type 0x%02x cannot be replayed.' % tag)
+    if datatype == 3:
+        data = bytes(content).decode('iso-8859-1')  # As OctetString encodes text, so any octets survive
+    elif datatype == 4:
+        data = ''
+    elif datatype == 5:
+        data = trapber.oid_text(content)
+    elif datatype == 7:
+        if len(content) != 4:
+            raise ValueError('Malformed IpAddress varbind.')
+        data = socket.inet_ntoa(bytes(content))
+    else:
+        value = trapber.integer_value(content)
+        if unsigned and value < 0:
+            value += 1 << (8 * len(content))
+        data = str(value)
+    return OID_TYPES[datatype][0], data
+
+
+def decode_message(message):
+    """Return the notification fields of an SNMPv1/v2c notification message, or None for other PDUs
+
+    The fields are those of Notification.from_dict(), less the
+    destination address.  Raises ValueError if the message is malformed
+    or cannot be replayed.
+    """
+    message = bytearray(message)
+    top = trapber.read_tlv(message)
+    if top is None or top[0] != trapber.SEQUENCE:
+        raise ValueError('Not an SNMP message.')
+    header = list(_elements(message, top[1], top[2]))
+    if len(header) != 3 or header[0][0] != trapber.INTEGER or header[1][0] != trapber.OCTET_STRING:
+        if header and header[0][0] == trapber.INTEGER and trapber.integer_value(
+                message[header[0][1]:header[0][2]]) == 3:
+            raise ValueError('SNMPv3 notification, which cannot be decoded without its keys.')
+        raise ValueError('Not an SNMPv1/v2c message.')
+    version = SNMP_VERSIONS.get(trapber.integer_value(message[header[0][1]:header[0][2]]))
+    pdu_tag, pdu_start, pdu_end = header[2]
+    pdu = list(_elements(message, pdu_start, pdu_end))
+
+    if version == 'SNMPv1' and pdu_tag == trapber.TRAP_PDU:
+        if len(pdu) != 6 or pdu[0][0] != trapber.OBJECT_IDENTIFIER:
+            raise ValueError('Malformed SNMPv1 Trap-PDU.')
+        generic_trap_type = trapber.integer_value(message[pdu[2][1]:pdu[2][2]])
+        if not 0 <= generic_trap_type < len(GENERIC_TRAP_TYPES):
+            raise ValueError('Malformed SNMPv1 Trap-PDU.')
+        fields = {'notification_type': 'SNMPv1 Trap',
+                  'source_oid': trapber.oid_text(message[pdu[0][1]:pdu[0][2]]),
+                  'agent_address': ber_value(pdu[1][0], message[pdu[1][1]:pdu[1][2]])[1],
+                  'generic_trap_type': generic_trap_type,
+                  'specific_trap_type': str(trapber.integer_value(message[pdu[3][1]:pdu[3][2]]))}
+    elif version == 'SNMPv2c' and pdu_tag in (trapber.SNMPV2_TRAP_PDU, trapber.INFORM_REQUEST_PDU):
+        if len(pdu) != 4:
+            raise ValueError('Malformed SNMPv2c notification PDU.')
+        fields = {'notification_type': 'SNMPv2c Inform' if pdu_tag == trapber.INFORM_REQUEST_PDU
+                                       else 'SNMPv2c Trap'}
+    else:
+        return None  # Responses and other PDUs
+
+    varbinds = []
+    for _, varbind_start, varbind_end in _elements(message, pdu[-1][1], pdu[-1][2]):
+        parts = list(_elements(message, varbind_start, varbind_end))
+        if len(parts) != 2 or parts[0][0] != trapber.OBJECT_IDENTIFIER:
+            raise ValueError('Malformed varbind.')
+        oid = trapber.oid_text(message[parts[0][1]:parts[0][2]])
+        tag, value_start, value_end = parts[1]
+        if version == 'SNMPv2c' and oid in (trapber.SYS_UPTIME_OID, trapber.SNMP_TRAP_OID):
+            if oid == trapber.SNMP_TRAP_OID and tag == trapber.OBJECT_IDENTIFIER:
+                fields['source_oid'] = trapber.oid_text(message[value_start:value_end])
+            continue  # Sent by this tool's engine in their place
+        varbinds.append([oid] + list(ber_value(tag, message[value_start:value_end])))
+    if 'source_oid' not in fields:
+        raise ValueError('Notification has no snmpTrapOID.0 varbind.')
+    fields['community_string'] = bytes(message[header[1][1]:header[1][2]]).decode('iso-8859-1')
+    fields['varbinds'] = varbinds
+    return fields
+
+
+def capture_records(stream, magic, ports=(TRAP_PORT,)):
+    """Generator of (timestamp, notification fields or None, skip reason or None) from a pcap or pcapng capture"""
+    frames = iter_pcapng(stream, magic) if magic == PCAPNG_MAGIC else iter_pcap(stream, magic)
+    for timestamp, linktype, frame in frames:
+        try:
+            datagram = udp_datagram(linktype, frame)
+        except (struct.error, socket.error):
+            continue  # Truncated headers
+        if datagram is None or datagram[2] not in ports:
+            continue
+        source, destination, port, payload = datagram
+        if payload is None:
+            yield timestamp, None, 'Fragmented datagram, which is not reassembled.'
+            continue
+        try:
+            fields = decode_message(payload)
+        except ValueError as e:
+            yield timestamp, None, str(e)
+            continue
+        if fields is not None:
+            fields['destination_address'] = '%s:%s' % (destination, port) if destination else ''
+            yield timestamp, fields, None
+
+
+def log_oid(text):
+    """Return the numeric OID of an snmptrapd log OID, raising ValueError if symbolic"""
+    text = text.strip()
+    oid = LOG_SYMBOLIC_OIDS.get(text, text.lstrip('.'))
+    if not oid or not character_test(oid, '0123456789.'):
+        raise ValueError('OID is not numeric; log with snmptrapd -On.')
+    return oid
+
+
+def log_varbind(text):
+    """Return the (OID, OID_TYPES data type, data) of an snmptrapd log varbind; raises ValueError if unsupported"""
+    oid, separator, value = text.partition(' = ')
+    if not separator:
+        raise ValueError('Malformed varbind.')
+    oid = log_oid(oid)
+    value_type, separator, data = value.partition(': ')
+    if not separator:
+        value_type, data = {'""': ('STRING', '""'), 'NULL': ('NULL', '')}.get(value.strip(), (value, ''))
+    value_type = value_type.strip()
+    try:
+        datatype = LOG_DATA_TYPES[value_type]
+    except KeyError:
+        raise ValueError('Varbind type %s cannot be replayed.' % value_type)
+    data = data.strip()
+    if value_type == 'STRING':
+        if len(data) > 1 and data[0] == data[-1] == '"':
+            data = data[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+    elif value_type == 'Hex-STRING':
+        try:
+            data = bytes(bytearray(int(octet, 16) for octet in data.split())).decode('iso-8859-1')
+        except ValueError:
+            raise ValueError('Malformed Hex-STRING varbind.')
+    elif value_type == 'OID':
+        data = log_oid(data)
+    elif value_type in ('INTEGER', 'Timeticks'):
+        # Enumerations are logged as label(value) and time ticks as (value) days, h:mm:ss
+        labelled = LOG_LABELLED_INTEGER.match(data) or re.match(r'\((\d+)\)', data)
+        if labelled:
+            data = labelled.group(1)
+    return oid, datatype, data
+
+
+def log_record(header, body):
+    """Return (timestamp, notification fields or None, skip reason or None) of an snmptrapd log entry"""
+    timestamp = time.mktime(time.strptime(header.group(1), '%Y-%m-%d %H:%M:%S'))
+    fields = {'notification_type': 'SNMPv2c Trap', 'destination_address': ''}
+    transport = LOG_TRANSPORT.search(header.group(3))
+    if transport:
+        fields['agent_address'] = transport.group(1)
+        fields['destination_address'] = '%s:%s' % (transport.group(3), transport.group(4))
+    enterprise = header.group(4).strip()
+    try:
+        if enterprise:  # SNMPv1 entries name the enterprise, then the trap type on the next line
+            trap = LOG_V1_TRAP.match(body[0]) if body else None
+            if not trap or trap.group(1).strip() not in GENERIC_TRAP_NAMES:
+                raise ValueError('SNMPv1 trap type line is missing.')
+            fields.update(notification_type='SNMPv1 Trap', source_oid=log_oid(enterprise),
+                          generic_trap_type=GENERIC_TRAP_NAMES[trap.group(1).strip()],
+                          specific_trap_type=trap.group(2))
+            body = body[1:]
+        varbinds = []
+        for text in '\n'.join(body).split('\t'):  # Values may hold newlines, but varbinds are tab separated
+            if not text.strip():
+                continue
+            oid, datatype, data = log_varbind(text)
+            if not enterprise and oid in (trapber.SYS_UPTIME_OID, trapber.SNMP_TRAP_OID):
+                if oid == trapber.SNMP_TRAP_OID:
+                    fields['source_oid'] = data
+                continue
+            varbinds.append([oid, OID_TYPES[datatype][0], data])
+    except ValueError as e:
+        return timestamp, None, str(e)
+    if 'source_oid' not in fields:
+        return timestamp, None, 'Notification has no snmpTrapOID.0 varbind.'
+    fields['varbinds'] = varbinds
+    return timestamp, fields, None
+
+
+def log_records(lines):
+    """Generator of (timestamp, notification fields or None, skip reason or None) from snmptrapd log lines"""
+    header = None
+    body = []
+    for line in lines:
+        line = line.decode('utf-8', 'replace').rstrip('\r\n')
+        match = LOG_HEADER.match(line)
+        if match:
+            if header:
+                yield log_record(header, body)
+            header, body = match, []
+        elif header:
+            body.append(line)
+    if header:
+        yield log_record(header, body)
+
+
+def read_records(filename, ports=(TRAP_PORT,)):
+    """Generator of (timestamp, notification fields or None, skip reason or None) from a capture or snmptrapd log"""
+    stream = open_capture(filename)
+    try:
+        magic = stream.read(4)
+        if magic in PCAP_MAGIC or magic == PCAPNG_MAGIC:
+            records = capture_records(stream, magic, ports)
+        else:
+            first_line = magic + stream.readline() if magic else b''
+            records = log_records(itertools.chain([first_line], iter(stream.readline, b'')))
+        for record in records:
+            yield record
+    finally:
+        stream.close()
+
+
+class ReplayProgress(object):
+    """Counts replayed notifications and compares when each was sent with when it was due"""
+    def __init__(self, speed=1.0, max_reasons=MAX_SKIP_REASONS, lag_samples=LAG_SAMPLES):
+        """Executed when the ReplayProgress() object is created"""
+        self.speed = speed
+        self.max_reasons = max_reasons
+        self.lock = threading.Lock()
+        self.random = random.Random(0)
+        self.started = None
+        self.read = 0
+        self.sent = 0
+        self.errors = 0
+        self.skipped = {}  # Skip reason: count
+        self.last_error = None
+        self.original_span = 0.0
+        self.first_send = None
+        self.last_send = None
+        self.lag_count = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.lags = array('d')  # Reservoir sample of lags, for percentiles in constant memory
+        self.lag_samples = lag_samples
+
+    def start(self):
+        """Start the replay clock, at the first notification"""
+        self.started = timer()
+
+    def skip(self, reason):
+        """Count a record which could not be replayed"""
+        with self.lock:
+            if reason not in self.skipped and len(self.skipped) >= self.max_reasons:
+                reason = 'Other reasons'
+            self.skipped[reason] = self.skipped.get(reason, 0) + 1
+
+    def complete(self, offset, error, seconds):
+        """SendService callback once a notification has been sent; offset is its original time offset
+
+        Timing is taken as the send completes rather than when it started,
+        so the achieved span and lag include the time each send took.
+        """
+        sent = timer() - self.started
+        with self.lock:
+            if error:
+                self.errors += 1
+                self.last_error = error
+            else:
+                self.sent += 1
+            if self.first_send is None or sent < self.first_send:
+                self.first_send = sent
+            if self.last_send is None or sent > self.last_send:
+                self.last_send = sent
+            if self.speed:
+                lag = sent - offset / self.speed
+                self.lag_count += 1
+                self.lag_total += lag
+                self.lag_max = max(self.lag_max, lag)
+                if len(self.lags) < self.lag_samples:
+                    self.lags.append(lag)
+                else:
+                    index = self.random.randrange(self.lag_count)
+                    if index < self.lag_samples:
+                        self.lags[index] = lag
+
+    def line(self, queued=0, sending=0):
+        """Return a progress line"""
+        with self.lock:
+            line = ('read %s, sent %s, errors %s, skipped %s, queued %s, sending %s'
+                    % (self.read, self.sent, self.errors, sum(self.skipped.values()), queued, sending))
+            if self.started is not None:
+                line += ', capture time +%.1fs after %.1fs' % (self.original_span, timer() - self.started)
+            if self.lag_count:
+                line += ', %.1f ms average lag' % (self.lag_total / self.lag_count * 1000)
+        return line
+
+    def report_lines(self):
+        """Return the summary lines of a finished replay"""
+        lines = ['%s notifications replayed: %s sent, %s errors, %s records skipped'
+                 % (self.read, self.sent, self.errors, sum(self.skipped.values()))]
+        for reason, count in sorted(self.skipped.items(), key=lambda item: -item[1]):
+            lines.append('  %s skipped: %s' % (count, reason))
+        if self.last_error:
+            lines.append('Last error: %s' % self.last_error)
+        if self.first_send is None:
+            return lines
+        achieved = self.last_send - self.first_send
+        line = 'Original span %.3f s, achieved %.3f s' % (self.original_span, achieved)
+        if self.speed:
+            line += ' against %.3f s due at %gx' % (self.original_span / self.speed, self.speed)
+        if achieved > 0:
+            line += ', effective speed %.2fx' % (self.original_span / achieved)
+        lines.append(line)
+        if self.lag_count:
+            lags = sorted(self.lags)
+            lines.append('Sent behind schedule: average %.1f ms, median %.1f ms, p99 %.1f ms, max %.1f ms'
+                         % (self.lag_total / self.lag_count * 1000, lags[len(lags) // 2] * 1000,
+                            lags[min(int(len(lags) * 0.99), len(lags) - 1)] * 1000, self.lag_max * 1000))
+        return lines
+
+
+def replay(records, service, progress, speed=1.0, destination=None, community=None):
+    """Queue each record's notification to the SendService when due, blocking while its queue is full
+
+    speed is the replay speed against the original timing; 0 sends as
+    fast as possible.
+    """
+    first = None
+    for timestamp, fields, reason in records:
+        if reason:
+            progress.skip(reason)
+            continue
+        if destination:
+            fields['destination_address'] = destination
+        if community:
+            fields['community_string'] = community
+        try:
+            notification = Notification.from_dict(fields)
+        except ValueError as e:
+            progress.skip(str(e))
+            continue
+        if first is None:
+            first = timestamp
+            progress.start()
+        offset = max(timestamp - first, 0.0)  # Records slightly out of order are sent at once
+        if speed:
+            delay = progress.started + offset / speed - timer()
+            if delay > 0:
+                time.sleep(delay)
+        with progress.lock:
+            progress.read += 1
+            progress.original_span = max(progress.original_span, offset)
+        service.put(notification, progress, offset)
+
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description='Replay notifications from a packet capture or snmptrapd log.')
+    parser.add_argument('capture', help='pcap or pcapng capture, or snmptrapd log, optionally gzipped')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='replay speed against the original timing, 0 for as fast as possible '
+                             '(default %(default)s)')
+    parser.add_argument('--destination', help='send every notification here instead of its original destination')
+    parser.add_argument('--community', help='send every notification with this community string')
+    parser.add_argument('--port', type=int, action='append', metavar='N',
+                        help='UDP destination port of notifications in a capture; may be repeated (default 162)')
+    parser.add_argument('--senders', type=int, default=trapapi.SENDERS,
+                        help='sender threads, each with its own engine (default %(default)s)')
+    parser.add_argument('--interval', type=float, default=PROGRESS_INTERVAL,
+                        help='seconds between progress lines on standard error, 0 for none (default %(default)s)')
+    parser.add_argument('--history', metavar='FILE', help='record every send in this history database')
+    trapflow.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.speed < 0:
+        print('Error: --speed must not be negative')
+        return 1
+    records = read_records(args.capture, tuple(args.port or (TRAP_PORT,)))
+    history = None
+    try:
+        if args.history:
+            history = traphistory.HistoryWriter(args.history)
+            history.start()
+        limits, destination_limits = trapflow.limits_from_arguments(args)
+        service = trapapi.SendService(args.senders, REPLAY_QUEUE_SIZE, limits=limits,
+                                      destination_limits=destination_limits, history=history, origin='replay')
+    except (ValueError, sqlite3.Error, trapapi.SenderError) as e:
+        print('Error: %s' % e)
+        if history:
+            history.stop()
+        return 1
+
+    progress = ReplayProgress(args.speed)
+    stopping = threading.Event()
+
+    def report():
+        while not stopping.wait(args.interval):
+            sys.stderr.write(progress.line(service.queue.qsize(), service.sending) + '\n')
+
+    reporter = None
+    if args.interval > 0:
+        reporter = threading.Thread(target=report)
+        reporter.daemon = True
+        reporter.start()
+    try:
+        replay(records, service, progress, args.speed, args.destination, args.community or None)
+    except KeyboardInterrupt:
+        pass
+    except (ValueError, EnvironmentError) as e:
+        sys.stderr.write('Error: unable to read %s: %s\n' % (args.capture, e))
+    finally:
+        service.stop()
+        if history:
+            history.stop()
+        stopping.set()
+        if reporter:
+            reporter.join()
+    for line in progress.report_lines():
+        sys.stderr.write(line + '\n')
+    return 1 if progress.errors or not progress.read else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
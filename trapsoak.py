@@ -0,0 +1,458 @@
+#!/usr/bin/env python
+"""
+trapsoak.py - Misner Trap Tool soak test
+Copyright (C) 2015-2017 Joe Misner <joe@misner.net>
+http://tools.misner.net/
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software Foundation,
+Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+Sends one notification continuously for a set duration through the same
+trapapi SendService used by the API server and trapstream.py, to show
+that memory stays bounded over millions of sends.  At every interval the
+process RSS, the memory traced by tracemalloc (Python 3.4 and later), or
+on Python 2.7 the number of objects tracked by the garbage collector, and
+the send latency of the interval are sampled.  The first sample after
+the warm-up period is the baseline; a sample growing past --max-growth
+or --max-traced-growth megabytes, or whose median latency drifts past
+--max-latency-drift percent of the baseline, raises an alert, and any
+alert makes the exit status 1.  The source lines allocating the most
+memory, or the object types growing the most, since the baseline are
+reported with each alert and at the end.
+
+Without --notification, SNMPv2c Traps (or Informs with --inform) are
+sent to a receiver in this process, whose memory is then included; send
+to another host with --destination to measure the sender alone.
+
+python trapsoak.py [--duration 1h] [--interval SECONDS] [--warm-up SECONDS]
+                   [--notification notification.ntf] [--destination ADDRESS]
+                   [--inform] [--senders N] [--max-growth MB]
+                   [--max-traced-growth MB] [--max-latency-drift PERCENT]
+                   [--stop-on-alert] [--no-tracemalloc] [--output samples.jsonl]
+                   [--history history.sqlite] [--rate N] [--burst N]
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import threading
+from array import array
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import win32api
+    import win32process
+except ImportError:
+    win32process = None
+from notification import Notification, timer
+import trapapi
+import trapflow
+import traphistory
+import trapprofile
+import trapreceiver
+
+SOAK_DURATION = '1h'
+SAMPLE_INTERVAL = 60          # Seconds between samples
+WARM_UP = 60                  # Seconds before the baseline sample, while caches and pools fill
+SOAK_QUEUE_SIZE = 1000
+ALLOCATION_TOP = 5
+TRACEMALLOC_FRAMES = 1        # Allocations are grouped by source line only
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+MEGABYTE = 1024.0 * 1024.0
+
+SOAK_SOURCE_OID = '1.3.6.1.4.1.3.1.1.0.1'
+SOAK_VARBINDS = [['1.3.6.1.4.1.3.1.1.1.1', 'Integer', '2'],
+                 ['1.3.6.1.4.1.3.1.1.1.2', 'String', 'Soak test notification'],
+                 ['1.3.6.1.4.1.3.1.1.1.3', 'Counter32', '4294967295']]
+
+
+def parse_duration(text):
+    """Return the seconds of a duration such as 90, 90s, 30m, 12h or 3d; raises ValueError if invalid"""
+    text = text.strip().lower()
+    multiplier = DURATION_UNITS.get(text[-1:])
+    if multiplier:
+        text = text[:-1]
+    try:
+        seconds = float(text) * (multiplier or 1)
+    except ValueError:
+        raise ValueError('Duration must be a number of seconds, or end in s, m, h or d.')
+    if seconds <= 0:
+        raise ValueError('Duration must be greater than zero.')
+    return seconds
+
+
+def rss_bytes():
+    """Return the resident set size of this process in bytes, or None if it cannot be read
+
+    Where only the peak is available (neither Linux nor Windows), the
+    peak is returned, which still shows growth.
+    """
+    if win32process:
+        handle = win32api.GetCurrentProcess()
+        return win32process.GetProcessMemoryInfo(handle)['WorkingSetSize']
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        pass
+    if resource:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024  # Bytes on macOS, kilobytes elsewhere
+    return None
+
+
+def percentile(values, fraction):
+    """Return the value below which fraction of the sorted values fall"""
+    if not values:
+        return None
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def megabytes(size):
+    """Return a byte count as megabytes text"""
+    return 'n/a' if size is None else '%.1f MB' % (size / MEGABYTE)
+
+
+class SoakRecorder(object):
+    """SendService job callback collecting send results between samples"""
+    def __init__(self):
+        """Executed when the SoakRecorder() object is created"""
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.errors = 0
+        self.last_error = None
+        self.latencies = array('d')
+
+    def complete(self, index, error, seconds):
+        """SendService callback once a notification has been sent"""
+        with self.lock:
+            if error:
+                self.errors += 1
+                self.last_error = error
+            else:
+                self.sent += 1
+                self.latencies.append(seconds)
+
+    def take(self):
+        """Return (sent, errors, sorted latencies since the previous call)"""
+        with self.lock:
+            latencies, self.latencies = self.latencies, array('d')
+            sent, errors = self.sent, self.errors
+        return sent, errors, sorted(latencies)
+
+
+class SoakMonitor(object):
+    """Samples memory and latency, comparing each sample with the baseline taken after warm-up"""
+    def __init__(self, recorder, max_growth=None, max_traced_growth=None, max_latency_drift=None,
+                 top=ALLOCATION_TOP, count_objects=False):
+        """Executed when the SoakMonitor() object is created; growth limits are in bytes, drift in percent
+
+        With count_objects, the objects tracked by the garbage collector are
+        counted by type at each sample, for when tracemalloc is missing.
+        """
+        self.recorder = recorder
+        self.count_objects = count_objects
+        self.baseline_counts = None
+        self.max_growth = max_growth
+        self.max_traced_growth = max_traced_growth
+        self.max_latency_drift = max_latency_drift
+        self.top = top
+        self.started = timer()
+        self.last = (self.started, 0)
+        self.baseline = None
+        self.baseline_snapshot = None
+        self.alerts = 0
+
+    def sample(self, baseline=False):
+        """Return a sample dictionary, taking it as the baseline if asked to
+
+        The sample's 'alerts' list names each threshold it exceeds.
+        """
+        now = timer()
+        sent, errors, latencies = self.recorder.take()
+        last_time, last_done = self.last
+        self.last = (now, sent + errors)
+        sample = {'elapsed': round(now - self.started, 3), 'sent': sent, 'errors': errors,
+                  'rate': round((sent + errors - last_done) / max(now - last_time, 0.001), 1),
+                  'rss': rss_bytes(), 'traced': None, 'objects': None, 'alerts': [], 'allocations': [],
+                  'object_growth': []}
+        for name, fraction in (('p50', 0.5), ('p99', 0.99), ('max', 1.0)):
+            sample[name] = percentile(latencies, fraction)
+        tracing = tracemalloc and tracemalloc.is_tracing()
+        if tracing:
+            sample['traced'] = tracemalloc.get_traced_memory()[0]
+        counts = None
+        if self.count_objects:
+            counts = trapprofile.object_counts()
+            sample['objects'] = sum(counts.values())
+        if baseline:
+            self.baseline = sample
+            if tracing:
+                self.baseline_snapshot = tracemalloc.take_snapshot()
+            self.baseline_counts = counts
+            return sample
+        if not self.baseline:
+            return sample
+
+        sample['growth'] = self.growth(sample, 'rss')
+        sample['traced_growth'] = self.growth(sample, 'traced')
+        sample['objects_growth'] = self.growth(sample, 'objects')
+        sample['latency_drift'] = None
+        if sample['p50'] is not None and self.baseline['p50']:
+            sample['latency_drift'] = round((sample['p50'] / self.baseline['p50'] - 1) * 100, 1)
+        for name, value, limit in (('growth', sample['growth'], self.max_growth),
+                                   ('traced growth', sample['traced_growth'], self.max_traced_growth),
+                                   ('latency drift', sample['latency_drift'], self.max_latency_drift)):
+            if limit is not None and value is not None and value > limit:
+                sample['alerts'].append(name)
+        if sample['alerts']:
+            self.alerts += 1
+        if self.baseline_snapshot:
+            sample['allocations'] = self.allocations()
+        if counts and self.baseline_counts:
+            sample['object_growth'] = self.object_growth(counts)
+        return sample
+
+    def growth(self, sample, key):
+        """Return the bytes a sample's memory figure has grown by since the baseline, or None if unknown"""
+        if sample[key] is None or self.baseline[key] is None:
+            return None
+        return sample[key] - self.baseline[key]
+
+    def allocations(self):
+        """Return (file:line, bytes, blocks) of the source lines allocating the most memory since the baseline"""
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>')))
+        allocations = []
+        for stat in snapshot.compare_to(self.baseline_snapshot, 'lineno')[:self.top]:
+            frame = stat.traceback[0]
+            allocations.append(('%s:%s' % (os.path.basename(frame.filename), frame.lineno),
+                                stat.size_diff, stat.count_diff))
+        return allocations
+
+    def object_growth(self, counts):
+        """Return (type name, objects) of the object types whose count grew the most since the baseline"""
+        growth = [(name, count - self.baseline_counts.get(name, 0)) for name, count in counts.items()]
+        growth.sort(key=lambda item: item[1], reverse=True)
+        return [(name, count) for name, count in growth[:self.top] if count > 0]
+
+    def per_send(self, sample):
+        """Return the bytes of RSS growth per notification sent since the baseline, or None if unknown"""
+        done = sample['sent'] + sample['errors'] - self.baseline['sent'] - self.baseline['errors']
+        if sample.get('growth') is None or done <= 0:
+            return None
+        return sample['growth'] / float(done)
+
+
+def format_sample(sample):
+    """Return a sample as a progress line"""
+    line = '%7.0fs sent %s errors %s %6.0f/s  rss %s' % (sample['elapsed'], sample['sent'], sample['errors'],
+                                                          sample['rate'], megabytes(sample['rss']))
+    if sample.get('growth') is not None:
+        line += ' (%+.1f)' % (sample['growth'] / MEGABYTE)
+    if sample['traced'] is not None:
+        line += '  traced %s' % megabytes(sample['traced'])
+        if sample.get('traced_growth') is not None:
+            line += ' (%+.1f)' % (sample['traced_growth'] / MEGABYTE)
+    if sample['objects'] is not None:
+        line += '  objects %s' % sample['objects']
+        if sample.get('objects_growth') is not None:
+            line += ' (%+d)' % sample['objects_growth']
+    if sample['p50'] is not None:
+        line += '  p50 %.2f ms p99 %.2f ms' % (sample['p50'] * 1000, sample['p99'] * 1000)
+        if sample.get('latency_drift') is not None:
+            line += ' (%+.0f%%)' % sample['latency_drift']
+    if 'growth' not in sample:
+        line += '  [baseline]' if sample.get('baseline') else '  [warming up]'
+    return line
+
+
+def format_allocations(allocations):
+    """Return top allocation lines"""
+    return ['%10.1f KB %+9s blocks  %s' % (size / 1024.0, blocks, location) for location, size, blocks in allocations]
+
+
+def format_object_growth(object_growth):
+    """Return top object count growth lines"""
+    return ['%+10d objects  %s' % (count, name) for name, count in object_growth]
+
+
+def soak_notification(args, address):
+    """Return the Notification to send repeatedly; raises ValueError if invalid"""
+    if args.notification:
+        try:
+            notification = Notification.open(args.notification)
+        except Exception as e:  # shelve raises a different error per dbm module
+            raise ValueError('Unable to open %s: %s' % (args.notification, e))
+    else:
+        notification = Notification.from_dict({
+            'notification_type': 'SNMPv2c Inform' if args.inform else 'SNMPv2c Trap',
+            'community_string': trapreceiver.LOOPBACK_COMMUNITY, 'source_oid': SOAK_SOURCE_OID,
+            'varbinds': SOAK_VARBINDS})
+    if address:
+        notification = notification.copy(destination_address=address)
+    notification.compile()  # Report an invalid notification before the soak starts
+    return notification
+
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description='Send continuously, sampling memory growth and latency drift.')
+    parser.add_argument('--duration', default=SOAK_DURATION,
+                        help='how long to send for, e.g. 90s, 30m, 12h or 3d (default %(default)s)')
+    parser.add_argument('--interval', type=float, default=SAMPLE_INTERVAL,
+                        help='seconds between samples (default %(default)s)')
+    parser.add_argument('--warm-up', type=float, default=WARM_UP,
+                        help='seconds of sending before the baseline sample (default %(default)s)')
+    parser.add_argument('--notification', metavar='NTF', help='notification file to send')
+    parser.add_argument('--destination', help='destination address, default a receiver in this process')
+    parser.add_argument('--inform', action='store_true', help='send InformRequests to the receiver in this process')
+    parser.add_argument('--senders', type=int, default=trapapi.SENDERS,
+                        help='sender threads, each with its own engine (default %(default)s)')
+    parser.add_argument('--max-growth', type=float, metavar='MB', help='alert on RSS growth past the baseline')
+    parser.add_argument('--max-traced-growth', type=float, metavar='MB',
+                        help='alert on traced Python memory growth past the baseline')
+    parser.add_argument('--max-latency-drift', type=float, metavar='PERCENT',
+                        help='alert when median latency rises this far above the baseline')
+    parser.add_argument('--stop-on-alert', action='store_true', help='end the soak at the first alert')
+    parser.add_argument('--no-tracemalloc', dest='tracemalloc', action='store_false',
+                        help='do not trace allocations, or count objects on Python 2.7, which slows sending')
+    parser.add_argument('--output', metavar='FILE', help='write each sample as a JSON line')
+    parser.add_argument('--history', metavar='FILE', help='record every send in this history database')
+    trapflow.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    receiver = None
+    history = None
+    output = None
+    try:
+        duration = parse_duration(args.duration)
+        if args.interval <= 0:
+            raise ValueError('Interval must be greater than zero.')
+        address = args.destination
+        if not address and not args.notification:
+            receiver = trapreceiver.TrapReceiver((trapreceiver.LOOPBACK_ADDRESS, 0))
+            receiver.start()
+            address = '%s:%s' % (trapreceiver.LOOPBACK_ADDRESS, receiver.port())
+        notification = soak_notification(args, address)
+        if args.output:
+            output = open(args.output, 'w')
+        if args.history:
+            history = traphistory.HistoryWriter(args.history)
+            history.start()
+        limits, destination_limits = trapflow.limits_from_arguments(args)
+        service = trapapi.SendService(args.senders, SOAK_QUEUE_SIZE, limits=limits,
+                                      destination_limits=destination_limits, history=history, origin='soak')
+    except (ValueError, EnvironmentError, sqlite3.Error, trapapi.SenderError) as e:
+        print('Error: %s' % e)
+        for running in (receiver, history):
+            if running:
+                running.stop()
+        if output:
+            output.close()
+        return 1
+
+    if args.tracemalloc:
+        if tracemalloc:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        else:
+            sys.stderr.write('Allocation tracing requires Python 3.4 or later; '
+                             'counting objects tracked by the garbage collector instead\n')
+    recorder = SoakRecorder()
+    monitor = SoakMonitor(recorder, args.max_growth and args.max_growth * MEGABYTE,
+                          args.max_traced_growth and args.max_traced_growth * MEGABYTE, args.max_latency_drift,
+                          count_objects=args.tracemalloc and not tracemalloc)
+    stopping = threading.Event()
+
+    def produce():
+        while not stopping.is_set():
+            service.put(notification, recorder, 0)
+
+    producer = threading.Thread(target=produce, name='SoakProducer')
+    producer.daemon = True
+    producer.start()
+    sys.stderr.write('Soaking %s for %.0f seconds with %s senders\n'
+                     % (notification.destination_address, duration, args.senders))
+    started = timer()
+    sample = None
+    try:
+        next_sample = min(args.interval, duration)
+        while True:
+            stopping.wait(max(started + next_sample - timer(), 0))
+            sample = monitor.sample(baseline=monitor.baseline is None and next_sample >= min(args.warm_up, duration))
+            sample['baseline'] = sample is monitor.baseline
+            sys.stderr.write(format_sample(sample) + '\n')
+            if output:
+                output.write(json.dumps(sample) + '\n')
+                output.flush()
+            if sample['alerts']:
+                sys.stderr.write('ALERT: %s exceeded\n' % ', '.join(sample['alerts']))
+                for line in format_allocations(sample['allocations']) + format_object_growth(sample['object_growth']):
+                    sys.stderr.write(line + '\n')
+                if args.stop_on_alert:
+                    break
+            if next_sample == duration:
+                break
+            next_sample = min(next_sample + args.interval, duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopping.set()
+        discarded = service.stop(discard=True)  # Sending what is queued would run past the duration
+        producer.join()
+        if history:
+            history.stop()
+        if receiver:
+            receiver.stop()
+        if output:
+            output.close()
+
+    sent, errors = recorder.sent, recorder.errors
+    elapsed = timer() - started
+    sys.stderr.write('%s sent, %s errors in %.0f seconds (%.0f/s), %s queued notifications discarded\n'
+                     % (sent, errors, elapsed, (sent + errors) / max(elapsed, 0.001), discarded))
+    if recorder.last_error:
+        sys.stderr.write('Last error: %s\n' % recorder.last_error)
+    if sample and 'growth' in sample:
+        per_send = monitor.per_send(sample)
+        if per_send is not None:
+            sys.stderr.write('RSS growth since baseline: %+.1f MB, %+.1f bytes per notification\n'
+                             % (sample['growth'] / MEGABYTE, per_send))
+        if sample['allocations']:
+            sys.stderr.write('Top allocations since baseline:\n')
+            for line in format_allocations(sample['allocations']):
+                sys.stderr.write(line + '\n')
+        if sample['object_growth']:
+            sys.stderr.write('Top object count growth since baseline (objects tracked by the garbage collector):\n')
+            for line in format_object_growth(sample['object_growth']):
+                sys.stderr.write(line + '\n')
+    elif sample is None or monitor.baseline is None:
+        sys.stderr.write('No sample was taken after the warm-up; memory growth was not measured\n')
+    if monitor.alerts:
+        sys.stderr.write('%s samples exceeded a threshold\n' % monitor.alerts)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+"""
+trapstream.py - Misner Trap Tool JSON-lines notification stream
+Copyright (C) 2015-2017 Joe Misner <joe@misner.net>
+http://tools.misner.net/
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software Foundation,
+Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+Reads notifications one JSON object per line from standard input, a
+file or a named pipe, and sends each as soon as it is read.  Lines hold
+the notification file fields written by save_notification, optionally
+on top of a saved notification file given with --defaults; see
+Notification.from_dict() in notification.py.  Blank lines and lines
+starting with # are skipped.
+
+Lines are read one at a time into the bounded queue of a trapapi
+SendService; when the queue is full, reading stops until a sender takes
+the next notification, so a producer writing faster than notifications
+can be sent is held back by the pipe rather than growing memory.
+
+Lines for different destinations are sent fairly within the flow limits
+set by --rate, --burst, --max-inflight and --limit; see trapflow.py.
+
+python trapstream.py [--defaults notification.ntf] [--senders N] [--queue N]
+                     [--follow] [--interval SECONDS] [--rate N] [--burst N]
+                     [--max-inflight N] [--limit DEST=RATE[,BURST[,INFLIGHT]]]
+                     [--no-adaptive] [--history history.sqlite] [input.jsonl | -]
+"""
+
+import os
+import sys
+import json
+import stat
+import time
+import sqlite3
+import argparse
+import threading
+from notification import Notification, timer
+import trapapi
+import trapflow
+import traphistory
+
+STREAM_QUEUE_SIZE = 1000      # Notifications read but not yet sent
+PROGRESS_INTERVAL = 5         # Seconds between progress lines
+MAX_ERROR_LINES = 100         # Errors reported individually before only being counted
+FOLLOW_POLL = 0.25            # Seconds between checks for lines appended to a followed file
+
+
+def iter_lines(filename='-', follow=False):
+    """Generator of (line number, line) from a file, named pipe or standard input ('-')
+
+    Lines are read as they arrive rather than in read-ahead blocks.  With
+    follow, a named pipe is reopened at end of file, waiting for the next
+    writer, and a regular file is read on as lines are appended to it,
+    like tail -f.
+    """
+    line_number = 0
+    if follow and filename != '-' and not stat.S_ISFIFO(os.stat(filename).st_mode):
+        with open(filename, 'rb') as stream:
+            line = b''
+            while True:
+                line += stream.readline()
+                if not line.endswith(b'\n'):  # At end of file, possibly partway through a line being written
+                    time.sleep(FOLLOW_POLL)
+                    continue
+                line_number += 1
+                yield line_number, line
+                line = b''
+    while True:
+        if filename == '-':
+            stream = getattr(sys.stdin, 'buffer', sys.stdin)
+        else:
+            stream = open(filename, 'rb')
+        try:
+            for line in iter(stream.readline, b''):
+                line_number += 1
+                yield line_number, line
+        finally:
+            if stream is not sys.stdin and stream is not getattr(sys.stdin, 'buffer', None):
+                stream.close()
+        if not follow or filename == '-':
+            break
+
+
+def parse_line(line, defaults=None):
+    """Return the Notification of one JSON line, or None if blank or a comment; raises ValueError if invalid"""
+    line = line.strip()
+    if not line or line.startswith(b'#'):
+        return None
+    try:
+        fields = json.loads(line.decode('utf-8'))
+    except ValueError:  # Includes invalid UTF-8
+        raise ValueError('Line is not a valid JSON object.')
+    if defaults and isinstance(fields, dict):
+        merged = dict(defaults)
+        merged.update(fields)
+        fields = merged
+    return Notification.from_dict(fields)
+
+
+class StreamProgress(object):
+    """Counts the results of streamed notifications, reporting errors by input line"""
+    def __init__(self, output=None, max_error_lines=MAX_ERROR_LINES):
+        """Executed when the StreamProgress() object is created"""
+        self.output = output or sys.stderr
+        self.max_error_lines = max_error_lines
+        self.lock = threading.Lock()
+        self.started = timer()
+        self.read = 0
+        self.invalid = 0
+        self.sent = 0
+        self.errors = 0
+        self.send_seconds = 0.0
+        self.last = (self.started, 0)
+
+    def report_error(self, line_number, error):
+        """Write an error for an input line, until max_error_lines have been written"""
+        with self.lock:
+            reported = self.invalid + self.errors
+        if reported <= self.max_error_lines:
+            self.output.write('Line %s: %s\n' % (line_number, error))
+        if reported == self.max_error_lines:
+            self.output.write('Further errors are counted but not shown\n')
+
+    def line_invalid(self, line_number, error):
+        """Count a line which could not be parsed into a notification"""
+        with self.lock:
+            self.invalid += 1
+        self.report_error(line_number, error)
+
+    def complete(self, line_number, error, seconds):
+        """SendService callback once a notification has been sent"""
+        with self.lock:
+            if error:
+                self.errors += 1
+            else:
+                self.sent += 1
+            self.send_seconds += seconds
+        if error:
+            self.report_error(line_number, error)
+
+    def line(self, queued=0, sending=0):
+        """Return a progress line with totals and the send rate since the previous progress line"""
+        now = timer()
+        with self.lock:
+            done = self.sent + self.errors
+            last_time, last_done = self.last
+            self.last = (now, done)
+            average = self.send_seconds / done if done else 0.0
+            return ('read %s, sent %s, errors %s, invalid %s, queued %s, sending %s, %.0f/s, %.1f ms average send'
+                    % (self.read, self.sent, self.errors, self.invalid, queued, sending,
+                       (done - last_done) / max(now - last_time, 0.001), average * 1000))
+
+
+def stream(lines, service, progress, defaults=None):
+    """Parse and queue each line to the SendService, blocking while its queue is full"""
+    for line_number, line in lines:
+        try:
+            notification = parse_line(line, defaults)
+        except ValueError as e:
+            progress.line_invalid(line_number, e)
+            continue
+        if notification is None:
+            continue
+        with progress.lock:
+            progress.read += 1
+        service.put(notification, progress, line_number)
+
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description='Send notifications read one JSON object per line.')
+    parser.add_argument('input', nargs='?', default='-',
+                        help='file or named pipe to read (default: standard input)')
+    parser.add_argument('--defaults', metavar='NTF', help='notification file whose fields each line overrides')
+    parser.add_argument('--senders', type=int, default=trapapi.SENDERS,
+                        help='sender threads, each with its own engine (default %(default)s)')
+    parser.add_argument('--queue', type=int, default=STREAM_QUEUE_SIZE,
+                        help='notifications read but not yet sent (default %(default)s)')
+    parser.add_argument('--follow', action='store_true',
+                        help='keep reading a file as lines are appended, or reopen a named pipe for its next writer')
+    parser.add_argument('--interval', type=float, default=PROGRESS_INTERVAL,
+                        help='seconds between progress lines on standard error, 0 for none (default %(default)s)')
+    parser.add_argument('--history', metavar='FILE', help='record every send in this history database')
+    trapflow.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    defaults = None
+    if args.defaults:
+        try:
+            defaults = Notification.open(args.defaults).to_ntf()
+        except Exception as e:  # shelve raises a different error per dbm module
+            print('Error: unable to open %s: %s' % (args.defaults, e))
+            return 1
+    history = None
+    try:
+        if args.history:
+            history = traphistory.HistoryWriter(args.history)
+            history.start()
+        limits, destination_limits = trapflow.limits_from_arguments(args)
+        service = trapapi.SendService(args.senders, args.queue, limits=limits, destination_limits=destination_limits,
+                                      history=history, origin='stream')
+    except (ValueError, sqlite3.Error, trapapi.SenderError) as e:
+        print('Error: %s' % e)
+        if history:
+            history.stop()
+        return 1
+
+    progress = StreamProgress()
+    stopping = threading.Event()
+
+    def report():
+        while not stopping.wait(args.interval):
+            sys.stderr.write(progress.line(service.queue.qsize(), service.sending) + '\n')
+
+    reporter = None
+    if args.interval > 0:
+        reporter = threading.Thread(target=report)
+        reporter.daemon = True
+        reporter.start()
+    started = time.time()
+    try:
+        stream(iter_lines(args.input, args.follow), service, progress, defaults)
+    except KeyboardInterrupt:
+        pass
+    except EnvironmentError as e:
+        sys.stderr.write('Error: unable to read %s: %s\n' % (args.input, e))
+    finally:
+        service.stop()
+        if history:
+            history.stop()
+        stopping.set()
+        if reporter:
+            reporter.join()
+    elapsed = time.time() - started
+    sys.stderr.write('%s sent, %s errors, %s invalid lines in %.2f seconds (%.0f/s)\n'
+                     % (progress.sent, progress.errors, progress.invalid, elapsed,
+                        progress.sent / max(elapsed, 0.001)))
+    return 1 if progress.errors or progress.invalid else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,557 @@
+#!/usr/bin/env python
+"""
+traptcp.py - Misner Trap Tool SNMP over TCP transport
+Copyright (C) 2015-2017 Joe Misner <joe@misner.net>
+http://tools.misner.net/
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software Foundation,
+Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+Sends SNMPv1/v2c notifications over TCP as described in RFC 3430: each
+message is written as-is, BER being self-delimiting.  PySNMP has no TCP
+transport, so messages are encoded with the fast BER encoder in
+trapber.py.  A TcpPool keeps a few persistent connections per manager,
+each with a bounded send queue drained by a writer thread that
+coalesces queued messages into a single write and reconnects with
+backoff, resending the batch that failed until the messages to that
+manager are discarded.  InformRequests are matched to their Responses
+by request-id.
+
+Without a destination, a local stand-in manager is started which counts
+notifications and acknowledges InformRequests.
+
+python traptcp.py [-n COUNT] [--inform] [--connections N] [--queue N]
+                  [--rate N] [host:port]
+"""
+
+import sys
+import time
+import random
+import socket
+import argparse
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+from notification import Notification
+import trapber
+
+POOL_SIZE = 2                 # Connections per manager
+QUEUE_SIZE = 10000            # Messages waiting per connection
+WRITE_BATCH = 256             # Most messages coalesced into one write
+WRITE_BATCH_BYTES = 65536
+CONNECT_TIMEOUT = 5
+RECONNECT_DELAY = 0.1         # Seconds, doubling after each failed attempt
+MAX_RECONNECT_DELAY = 5
+INFORM_TIMEOUT = 5
+READ_SIZE = 65536
+
+
+def iter_messages(sock, stopping=None):
+    """Generator of the BER messages read from a stream socket as bytearrays, until it closes"""
+    buffer = bytearray()
+    while not (stopping and stopping.is_set()):
+        try:
+            data = sock.recv(READ_SIZE)
+        except socket.error:
+            return
+        if not data:
+            return
+        buffer += data
+        while True:
+            try:
+                tlv = trapber.read_tlv(buffer)
+            except ValueError:
+                return  # Not BER; the stream can't be resynchronized
+            if tlv is None:
+                break
+            end = tlv[2]
+            yield buffer[:end]
+            del buffer[:end]
+
+
+def inform_response(message):
+    """Return the Response-PDU message acknowledging an SNMPv2c InformRequest message"""
+    # The Response carries the same request-id and varbinds with no error, so only the PDU tag differs
+    response = bytearray(message)
+    response[trapber.pdu_offset(response)] = trapber.RESPONSE_PDU
+    return bytes(response)
+
+
+class TcpConnection(object):
+    """Persistent TCP connection to one manager, written from a bounded queue by a background thread
+
+    Delivery is at-least-once: a batch whose write fails is written again
+    on the next connection, so the manager may see some twice.  Messages
+    already handed to the operating system when the manager goes away
+    are lost, as with any TCP sender without application acknowledgments.
+    """
+    def __init__(self, address, queue_size=QUEUE_SIZE, on_message=None, connect_timeout=CONNECT_TIMEOUT):
+        """Executed when the TcpConnection() object is created"""
+        self.address = address
+        self.queue = queue.Queue(queue_size)
+        self.on_message = on_message
+        self.connect_timeout = connect_timeout
+        self.sock = None
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.last_error = None
+        self.generation = 0  # Incremented by discard(), dropping the batch being written
+        self.stats = {'messages': 0, 'bytes': 0, 'writes': 0, 'connects': 0, 'reconnects': 0, 'errors': 0,
+                      'discarded': 0}
+        self.writer = threading.Thread(target=self.write_loop, name='TcpConnection %s:%s' % address)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def send(self, message, timeout=None):
+        """Queue an encoded message, blocking while the queue is full; raises queue.Full after timeout"""
+        self.queue.put(message, True, timeout)
+
+    def pending(self):
+        """Return the number of queued messages not yet written"""
+        return self.queue.unfinished_tasks
+
+    def discard(self):
+        """Drop every queued message and the batch being retried, returning the number of queued messages dropped
+
+        Called once the messages have been reported as failed, so that a
+        manager which has gone away is not reconnected to indefinitely.
+        """
+        discarded = 0
+        with self.lock:
+            self.generation += 1
+        while True:
+            try:
+                message = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if message is None:  # Closing; leave the writer its stop marker
+                self.queue.put(None)
+                self.queue.task_done()
+                break
+            discarded += 1
+            self.queue.task_done()
+        self.stats['discarded'] += discarded
+        return discarded
+
+    def connect(self, generation=None):
+        """Return a new connected socket, retrying with backoff until connected, closed or discarded"""
+        delay = RECONNECT_DELAY
+        while not self.stopping.is_set() and (generation is None or generation == self.generation):
+            try:
+                sock = socket.create_connection(self.address, self.connect_timeout)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                sock.settimeout(None)
+            except socket.error as e:
+                self.last_error = e
+                self.stats['errors'] += 1
+                self.stopping.wait(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                continue
+            with self.lock:
+                self.sock = sock
+                self.stats['connects'] += 1
+            reader = threading.Thread(target=self.read_loop, args=(sock,), name='TcpConnection reader')
+            reader.daemon = True
+            reader.start()
+            return sock
+        return None
+
+    def disconnect(self, sock):
+        """Close sock, so that the next write opens a new connection"""
+        with self.lock:
+            if self.sock is sock:
+                self.sock = None
+        try:
+            sock.close()
+        except socket.error:
+            pass
+
+    def read_loop(self, sock):
+        """Reader thread; passes received messages on, and notices the manager closing the connection"""
+        for message in iter_messages(sock, self.stopping):
+            if self.on_message:
+                self.on_message(message)
+        self.disconnect(sock)
+
+    def next_batch(self):
+        """Block for the next message, then take whatever else is already queued up to the batch limits"""
+        batch = [self.queue.get()]
+        size = len(batch[0] or b'')
+        while batch[-1] is not None and len(batch) < WRITE_BATCH and size < WRITE_BATCH_BYTES:
+            try:
+                message = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(message)
+            size += len(message or b'')
+        return batch
+
+    def write_loop(self):
+        """Writer thread; pipelines queued messages into as few writes as possible"""
+        while True:
+            batch = self.next_batch()
+            with self.lock:
+                generation = self.generation
+            closing = batch[-1] is None
+            messages = [message for message in batch if message is not None]
+            data = b''.join(messages)
+            while data:
+                with self.lock:
+                    sock = self.sock
+                if sock is None:
+                    sock = self.connect(generation)
+                    if sock is None:
+                        self.stats['discarded'] += len(messages)
+                        break  # Closed or discarded while reconnecting; the batch is dropped
+                try:
+                    sock.sendall(data)
+                except socket.error as e:
+                    self.last_error = e
+                    self.stats['errors'] += 1
+                    self.stats['reconnects'] += 1
+                    self.disconnect(sock)
+                    continue
+                self.stats['messages'] += len(messages)
+                self.stats['bytes'] += len(data)
+                self.stats['writes'] += 1
+                break
+            for _ in batch:
+                self.queue.task_done()
+            if closing:
+                break
+        with self.lock:
+            sock = self.sock
+        if sock:
+            self.disconnect(sock)
+
+    def flush(self, timeout=None):
+        """Wait until every queued message is written, returning False on timeout"""
+        deadline = None if timeout is None else time.time() + timeout
+        while self.pending():
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def close(self, timeout=CONNECT_TIMEOUT):
+        """Write what is queued, then close the connection"""
+        try:
+            self.queue.put(None, True, timeout)
+        except queue.Full:
+            pass
+        self.stopping.set()  # Stops reconnecting, so that a manager which has gone away can't hold up the join
+        self.writer.join(timeout)
+        with self.lock:
+            sock = self.sock
+        if sock:
+            self.disconnect(sock)
+
+
+class TcpPool(object):
+    """Pooled persistent TCP connections per manager, with InformRequest response tracking"""
+    def __init__(self, size=POOL_SIZE, queue_size=QUEUE_SIZE):
+        """Executed when the TcpPool() object is created"""
+        self.size = size
+        self.queue_size = queue_size
+        self.connections = {}
+        self.turn = 0
+        self.lock = threading.Lock()
+        self.responses = threading.Condition(threading.Lock())
+        self.pending = {}  # Request-id: time sent
+        self.latencies = []
+        self.request_id = random.randrange(1, 0x7fffffff)
+
+    def next_request_id(self):
+        """Return a request-id unique among the pool's outstanding InformRequests"""
+        with self.lock:
+            self.request_id = self.request_id % 0x7fffffff + 1
+            return self.request_id
+
+    def connection(self, address):
+        """Return the next of the pool's connections to address, round-robin"""
+        with self.lock:
+            try:
+                connections = self.connections[address]
+            except KeyError:
+                connections = self.connections[address] = [
+                    TcpConnection(address, self.queue_size, self.message_received) for _ in range(self.size)]
+            self.turn += 1
+            return connections[self.turn % len(connections)]
+
+    def send(self, address, message, request_id=None, timeout=None):
+        """Queue an encoded message to address, tracking its response if request_id is given
+
+        Blocks while the connection's queue is full, raising ValueError
+        once timeout seconds have passed.
+        """
+        if request_id is not None:
+            with self.responses:
+                self.pending[request_id] = time.time()
+        try:
+            self.connection(address).send(message, timeout)
+        except queue.Full:
+            if request_id is not None:
+                with self.responses:
+                    self.pending.pop(request_id, None)
+            raise ValueError('Send queue to %s:%s is full; the connection is not accepting data.' % address)
+
+    def message_received(self, message):
+        """Connection reader callback; matches Responses to outstanding InformRequests"""
+        try:
+            tag, request_id = trapber.pdu_request_id(message)
+        except ValueError:
+            return
+        if tag != trapber.RESPONSE_PDU:
+            return
+        with self.responses:
+            sent = self.pending.pop(request_id, None)
+            if sent is not None:
+                self.latencies.append(time.time() - sent)
+                self.responses.notify_all()
+
+    def wait(self, request_ids=None, timeout=INFORM_TIMEOUT):
+        """Wait for Responses to the given (or all) outstanding InformRequests, returning those timed out"""
+        deadline = time.time() + timeout
+        with self.responses:
+            while True:
+                if request_ids is None:
+                    waiting = list(self.pending)
+                else:
+                    waiting = [request_id for request_id in request_ids if request_id in self.pending]
+                remaining = deadline - time.time()
+                if not waiting or remaining <= 0:
+                    break
+                self.responses.wait(remaining)
+            for request_id in waiting:
+                del self.pending[request_id]
+        return waiting
+
+    def flush(self, timeout=None, address=None):
+        """Wait until every connection, or every connection to address, has written its queue; False on timeout"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.lock:
+            if address is None:
+                connections = [c for destination in self.connections for c in self.connections[destination]]
+            else:
+                connections = list(self.connections.get(address, []))
+        for connection in connections:
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            if not connection.flush(remaining):
+                return False
+        return True
+
+    def unwritten(self, address):
+        """Return the number of messages queued to address and not yet written"""
+        with self.lock:
+            return sum(connection.pending() for connection in self.connections.get(address, []))
+
+    def discard(self, address):
+        """Drop the messages queued to address, returning the number dropped; see TcpConnection.discard()"""
+        with self.lock:
+            connections = list(self.connections.get(address, []))
+        return sum(connection.discard() for connection in connections)
+
+    def last_error(self, address):
+        """Return the most recent socket error of the connections to address, if any"""
+        with self.lock:
+            errors = [c.last_error for c in self.connections.get(address, []) if c.last_error]
+        return errors[-1] if errors else None
+
+    def stats(self):
+        """Return the summed statistics of every connection"""
+        totals = {}
+        with self.lock:
+            connections = [c for address in self.connections for c in self.connections[address]]
+        for connection in connections:
+            for name, value in connection.stats.items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def close(self):
+        """Write what is queued and close every connection"""
+        with self.lock:
+            connections = [c for address in self.connections for c in self.connections[address]]
+            self.connections = {}
+        for connection in connections:
+            connection.close()
+
+
+class TcpNotificationSender(object):
+    """Sends a compiled notification over a TcpPool, encoded with the fast BER encoder"""
+    def __init__(self, pool, plan):
+        """Executed when the TcpNotificationSender() object is created from a SendPlan with PySNMP varbinds"""
+        if plan.version == 'SNMPv3':
+            raise ValueError('SNMPv3 notifications can only be sent over TCP using snmptrap.')
+        self.pool = pool
+        self.plan = plan
+        self.address = (plan.host, plan.port)
+        self.community = plan.notification.community_string
+        self.inform = plan.pdu == 'inform'
+        self.started = time.time()
+        # The table varbinds are the same in every notification, so they are encoded once
+        self.varbinds = [bytes(trapber.encode_varbind(oid, value)) for oid, value in plan.varbinds]
+        if plan.version == 'SNMPv1':
+            generic_trap_type = plan.notification.generic_trap_type
+            self.v1_fields = (plan.enterprise_oid, plan.agent_address, generic_trap_type,
+                              int(plan.specific_trap_type) if generic_trap_type == 6 else 0)
+        else:
+            self.v1_fields = None
+
+    def message(self, request_id=1, varbinds=()):
+        """Return the encoded notification message, with extra (oid, value) varbinds appended"""
+        varbinds = self.varbinds + list(varbinds)
+        if self.v1_fields:
+            enterprise_oid, agent_address, generic_trap_type, specific_trap_type = self.v1_fields
+            return trapber.v1_trap_message(varbinds, self.community, enterprise_oid, agent_address,
+                                           generic_trap_type, specific_trap_type, 0)
+        uptime = int((time.time() - self.started) * 100) % 4294967296
+        return trapber.v2c_message(varbinds, self.inform, self.community, request_id, uptime, self.plan.trap_oid)
+
+    def send(self, varbinds=(), timeout=None):
+        """Queue one notification, returning its request-id; raises ValueError if the queue stays full"""
+        request_id = self.pool.next_request_id()
+        self.pool.send(self.address, self.message(request_id, varbinds),
+                       request_id if self.inform else None, timeout)
+        return request_id
+
+    def run(self, count, rate=0, progress=None, progress_interval=1000, timeout=INFORM_TIMEOUT):
+        """Send count notifications, optionally limited to rate per second
+
+        Traps are counted as sent once written to a connection, and
+        InformRequests once acknowledged.  The progress callback, if given,
+        is called as progress(queued) every progress_interval notifications
+        and may return False to stop.  Returns a (sent, errors, elapsed) tuple.
+        """
+        started = time.time()
+        queued = 0
+        for queued in range(1, count + 1):
+            if rate:
+                delay = started + float(queued - 1) / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            self.send(timeout=timeout)
+            if progress and queued % progress_interval == 0:
+                if progress(queued) is False:
+                    break
+        if self.inform:
+            errors = len(self.pool.wait(timeout=timeout))
+        else:
+            self.pool.flush(timeout, self.address)
+            errors = min(self.pool.unwritten(self.address), queued)  # Others may be queued to the manager too
+        if errors:
+            self.pool.discard(self.address)
+        return queued - errors, errors, time.time() - started
+
+
+class TcpSink(object):
+    """Local stand-in manager accepting SNMP over TCP, counting notifications and acknowledging informs"""
+    def __init__(self, address=('127.0.0.1', 0)):
+        """Executed when the TcpSink() object is created"""
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(address)
+        self.sock.listen(16)
+        self.address = self.sock.getsockname()
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.received = 0
+        self.connections = 0
+
+    def start(self):
+        """Accept connections in a background thread"""
+        thread = threading.Thread(target=self.accept_loop, name='TcpSink')
+        thread.daemon = True
+        thread.start()
+
+    def accept_loop(self):
+        while not self.stopping.is_set():
+            try:
+                conn, address = self.sock.accept()
+            except socket.error:
+                return
+            with self.lock:
+                self.connections += 1
+            thread = threading.Thread(target=self.handle, args=(conn,), name='TcpSink connection')
+            thread.daemon = True
+            thread.start()
+
+    def handle(self, conn):
+        """Count each message received on a connection, acknowledging InformRequests"""
+        for message in iter_messages(conn, self.stopping):
+            with self.lock:
+                self.received += 1
+            try:
+                if message[trapber.pdu_offset(message)] == trapber.INFORM_REQUEST_PDU:
+                    conn.sendall(inform_response(message))
+            except (ValueError, socket.error):
+                break
+        conn.close()
+
+    def stop(self):
+        self.stopping.set()
+        self.sock.close()
+
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description='Send SNMPv2c notifications over TCP through pooled connections.')
+    parser.add_argument('destination', nargs='?', help='host:port of the manager; default is a local stand-in')
+    parser.add_argument('-n', '--count', type=int, default=10000, help='notifications to send (default %(default)s)')
+    parser.add_argument('--inform', action='store_true', help='send InformRequests rather than Traps')
+    parser.add_argument('--connections', type=int, default=POOL_SIZE,
+                        help='persistent connections to the manager (default %(default)s)')
+    parser.add_argument('--queue', type=int, default=QUEUE_SIZE,
+                        help='send queue size per connection (default %(default)s)')
+    parser.add_argument('--rate', type=float, default=0, help='notifications per second, default unlimited')
+    args = parser.parse_args(argv)
+
+    sink = None
+    destination = args.destination
+    if not destination:
+        sink = TcpSink()
+        sink.start()
+        destination = '%s:%s' % sink.address
+    notification = Notification(notification_type=2 if args.inform else 1, community_string='public',
+                                agent_address='127.0.0.1', destination_address='tcp:' + destination,
+                                source_oid='1.3.6.1.4.1.3.1.1',
+                                varbinds=[['1.3.6.1.4.1.3.1.1.1', '3', 'SNMP over TCP benchmark']])
+    pool = TcpPool(args.connections, args.queue)
+    try:
+        sender = TcpNotificationSender(pool, notification.compile())
+        sent, errors, elapsed = sender.run(args.count, args.rate)
+        stats = pool.stats()
+    except ValueError as e:
+        print('Error: %s' % e)
+        return 1
+    finally:
+        pool.close()
+    print('%s %s over TCP: %s sent in %.2f seconds (%.0f/s), %s errors'
+          % (args.count, 'Informs' if args.inform else 'Traps', sent, elapsed, sent / max(elapsed, 0.001), errors))
+    print('%s connections, %s reconnects, %s writes (%.1f messages per write), %s bytes'
+          % (stats.get('connects', 0), stats.get('reconnects', 0), stats.get('writes', 0),
+             stats.get('messages', 0) / float(max(stats.get('writes', 0), 1)), stats.get('bytes', 0)))
+    if sink:
+        deadline = time.time() + 2
+        while sink.received < sent and time.time() < deadline:
+            time.sleep(0.05)
+        print('Local stand-in received %s on %s connections' % (sink.received, sink.connections))
+        sink.stop()
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())